@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+"""
+Beam Search
+
+Greedy packing commits every item to the bin that looks best at
+the time. A beam search keeps the beam_width best partial
+packings instead. Each step extends every packing with the next
+item, in each of its best scoring bins or a new bin, and ranks
+the children by a score over their bins' free areas after a
+greedy rollout of the next few items. The best beam_width
+children survive.
+
+A partial packing is a tuple of pickled bin snapshots. A child
+shares every snapshot but the one it changed with its parent,
+and packings go to the worker processes as their open bins'
+snapshots. Workers evaluate a child by inserting into the
+loaded bins under a checkpoint and rolling back.
+"""
+import io
+import multiprocessing
+import pickle
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from .item import Item
+
+
+# A partial packing: every bin's snapshot and free space
+# summary, and the positions of the bins that can still take
+# one of the remaining items
+BeamState = NamedTuple('BeamState', [('snapshots', Tuple[bytes, ...]),
+                                     ('summaries', Tuple[Tuple[int, int, int], ...]),
+                                     ('open', Tuple[int, ...])])
+
+
+def score_bins(free_areas: List[int], bin_area: int) -> Tuple[int, int]:
+    """ Fewest bins, then the largest sum of squared used areas """
+    return len(free_areas), -sum((bin_area - free) ** 2 for free in free_areas)
+
+
+def score_waste(free_areas: List[int], bin_area: int) -> Tuple[int, int]:
+    """ Fewest bins, then the least free area outside the emptiest bin """
+    return len(free_areas), sum(free_areas) - max(free_areas)
+
+
+SCORES = {
+    'bins': score_bins,
+    'waste': score_waste,
+}
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file: io.BytesIO, snapshots: 'Snapshots') -> None:
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.snapshots = snapshots
+
+
+    def persistent_id(self, obj: Any) -> Optional[tuple]:
+        position = self.snapshots.positions.get(id(obj))
+        if position is None or self.snapshots.items.get(position) is not obj:
+            return None
+        return position, obj.x, obj.y, obj.width, obj.height, obj.rotated
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file: io.BytesIO, snapshots: 'Snapshots') -> None:
+        super().__init__(file)
+        self.snapshots = snapshots
+
+
+    def persistent_load(self, pid: tuple) -> Any:
+        position, x, y, width, height, rotated = pid
+        el = self.snapshots.item(position, width, height)
+        el.x, el.y, el.width, el.height, el.rotated = x, y, width, height, rotated
+        return el
+
+
+class Snapshots:
+    """
+    Pickles bins with each item stored as its position in the
+    packing's item list and its placement. Loading places the
+    given items, or new items when none are given.
+    """
+    def __init__(self, items: Optional[Sequence[Any]] = None) -> None:
+        self.fresh = items is None
+        self.items = {} if items is None else dict(enumerate(items)) # type: Dict[int, Any]
+        self.positions = {id(el): i for i, el in self.items.items()}
+
+
+    def item(self, position: int, width: int, height: int) -> Any:
+        """ Returns the item at position, creating it if needed """
+        el = self.items.get(position)
+        if el is None:
+            el = self.place(position, width, height)
+        return el
+
+
+    def place(self, position: int, width: int, height: int) -> Any:
+        """ Returns an unplaced item for position """
+        if not self.fresh:
+            return self.items[position]
+        el = Item(width, height)
+        self.items[position] = el
+        self.positions[id(el)] = position
+        return el
+
+
+    def dumps(self, binn: Any) -> bytes:
+        buf = io.BytesIO()
+        _Pickler(buf, self).dump(binn)
+        return buf.getvalue()
+
+
+    def loads(self, data: bytes) -> Any:
+        return _Unpickler(io.BytesIO(data), self).load()
+
+
+def _fits(summary: Tuple[int, int, int], side: int, area: int) -> bool:
+    """ Whether a bin could hold an item with this shorter side and area """
+    max_w, max_h, free_area = summary
+    return max_w >= side and max_h >= side and free_area >= area
+
+
+def _best_fit(bins: Dict[int, Any], el: Item) -> Optional[int]:
+    """ The best scoring bin for the item, ties to the lowest position """
+    scores = []
+    for i, binn in bins.items():
+        s = binn._find_best_score(el)[0]
+        if s is not None:
+            scores.append((s, i))
+    if not scores:
+        return None
+    return min(scores)[1]
+
+
+def _rollout(bins: Dict[int, Any],
+             template: bytes,
+             free_areas: List[int],
+             sizes: List[Tuple[int, int]],
+             choice: int,
+             heuristic: str,
+             score: Callable,
+             bin_area: int) -> Tuple[Any, tuple]:
+    """
+    Insert the first item into the chosen bin and the rest by
+    best fit, opening bins as needed. Returns the score and the
+    sorted free areas after the first insert, then rolls back.
+    """
+    context = Snapshots()
+    opened = len(free_areas)
+    bins = dict(bins)
+    free_areas = list(free_areas)
+    marks = {} # type: Dict[int, int]
+    signature = ()
+    for n, (width, height) in enumerate(sizes):
+        el = Item(width, height)
+        target = choice if n == 0 else _best_fit(bins, el)
+        if target is None or target == len(free_areas):
+            target = len(free_areas)
+            bins[target] = context.loads(template)
+            free_areas.append(bin_area)
+        elif target < opened and target not in marks:
+            # Bins opened by the rollout are simply dropped
+            marks[target] = bins[target].checkpoint()
+        bins[target].insert(el, heuristic)
+        free_areas[target] = bins[target].free_area
+        if n == 0:
+            signature = tuple(sorted(free_areas))
+    result = score(free_areas, bin_area)
+    for i, mark in marks.items():
+        bins[i].rollback(mark)
+        bins[i].commit()
+    return result, signature
+
+
+def _expand(task: tuple) -> List[Tuple[Any, int, tuple]]:
+    """
+    Worker process entry point. Loads the open bins of one
+    packing and returns (score, bin position, signature) for
+    each way to insert the next item: its branch best scoring
+    bins and a new bin.
+    """
+    template, bins, summaries, sizes, heuristic, score, bin_area, branch = task
+    context = Snapshots()
+    loaded = {i: context.loads(data) for i, data in bins}
+    free_areas = [summary[2] for summary in summaries]
+    scores = []
+    for i, binn in loaded.items():
+        s = binn._find_best_score(Item(*sizes[0]))[0]
+        if s is not None:
+            scores.append((s, i))
+    choices = [i for _, i in sorted(scores)[:branch]] + [len(free_areas)]
+    children = []
+    for choice in choices:
+        result, signature = _rollout(loaded, template, free_areas, sizes, choice,
+                                     heuristic, score, bin_area)
+        children.append((result, choice, signature))
+    return children
+
+
+def _extend(state: BeamState,
+            choice: int,
+            position: int,
+            size: Tuple[int, int],
+            template: bytes,
+            heuristic: str,
+            side: int,
+            area: int) -> BeamState:
+    """
+    Returns the packing with the item at position inserted in
+    the chosen bin. Only that bin is loaded and stored again,
+    and bins that can no longer hold an item of the given
+    shorter side and area are closed.
+    """
+    context = Snapshots()
+    snapshots, summaries = list(state.snapshots), list(state.summaries)
+    if choice == len(snapshots):
+        binn = context.loads(template)
+        snapshots.append(b'')
+        summaries.append((0, 0, 0))
+        candidates = state.open + (choice,)
+    else:
+        binn = context.loads(snapshots[choice])
+        candidates = state.open
+    binn.insert(context.place(position, *size), heuristic)
+    snapshots[choice] = context.dumps(binn)
+    summaries[choice] = binn.free_space_summary()
+    still_open = tuple(i for i in candidates if _fits(summaries[i], side, area))
+    return BeamState(tuple(snapshots), tuple(summaries), still_open)
+
+
+def search(bins: List[Any],
+           items: Sequence[Any],
+           empty_bin: Any,
+           heuristic: str = 'default',
+           beam_width: int = 4,
+           lookahead: int = 3,
+           score: Union[str, Callable] = 'bins',
+           time_budget: Optional[float] = None,
+           processes: Optional[int] = None) -> List[Any]:
+    """
+    Pack the items, in order, into the bins and new copies of
+    empty_bin, and return the bins of the best packing found.
+
+    Every step keeps the beam_width best packings by score,
+    evaluated after a greedy rollout of lookahead items. score
+    is a name from SCORES or a picklable callable taking the
+    free areas of the bins and the bin area, lower is better.
+    Beams are expanded in a pool of processes worker processes,
+    or in this process if processes is 1. Once the wall-clock
+    time_budget (seconds) runs out, the best packing so far is
+    finished by best fit.
+    """
+    if not callable(score):
+        if score not in SCORES:
+            raise ValueError('No such score!')
+        score = SCORES[score]
+    if beam_width < 1 or lookahead < 1:
+        raise ValueError('Error! beam_width and lookahead must be positive')
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    offset = sum(len(binn.items) for binn in bins)
+    originals = [el for binn in bins for el in binn.items] + list(items)
+    sizes = [(el.width, el.height) for el in items]
+    bin_area = empty_bin.area
+
+    # Shorter side and area of the smallest remaining items,
+    # from each step on
+    sides = [0] * (len(sizes) + 1)
+    areas = [0] * (len(sizes) + 1)
+    for t in range(len(sizes) - 1, -1, -1):
+        width, height = sizes[t]
+        side, area = min(width, height), width * height
+        sides[t] = side if t == len(sizes) - 1 else min(side, sides[t+1])
+        areas[t] = area if t == len(sizes) - 1 else min(area, areas[t+1])
+
+    context = Snapshots(originals)
+    template = context.dumps(empty_bin)
+    summaries = tuple(binn.free_space_summary() for binn in bins)
+    beams = [BeamState(tuple(context.dumps(binn) for binn in bins), summaries,
+                       tuple(i for i, summary in enumerate(summaries)
+                             if _fits(summary, sides[0], areas[0])))]
+
+    pool = None if processes == 1 else multiprocessing.Pool(processes)
+    step = 0
+    try:
+        while step < len(sizes):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            tasks = [(template, [(i, state.snapshots[i]) for i in state.open],
+                      state.summaries, sizes[step:step+lookahead], heuristic,
+                      score, bin_area, beam_width) for state in beams]
+            results = map(_expand, tasks) if pool is None else pool.map(_expand, tasks)
+            # Ties go to the earlier beam, then the lower bin
+            children = sorted((result, b, choice, signature)
+                              for b, expanded in enumerate(results)
+                              for result, choice, signature in expanded)
+            seen = set()
+            next_beams = []
+            for result, b, choice, signature in children:
+                # Different paths often reach the same packing
+                if (result, signature) in seen:
+                    continue
+                seen.add((result, signature))
+                next_beams.append(_extend(beams[b], choice, offset + step, sizes[step],
+                                          template, heuristic, sides[step+1], areas[step+1]))
+                if len(next_beams) == beam_width:
+                    break
+            beams = next_beams
+            step += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    context = Snapshots(originals)
+    result = [context.loads(data) for data in beams[0].snapshots]
+    for el in items[step:]:
+        open_bins = {i: result[i] for i in range(len(result))}
+        target = _best_fit(open_bins, el)
+        if target is None:
+            result.append(context.loads(template))
+            target = len(result) - 1
+        result[target].insert(el, heuristic)
+    return result
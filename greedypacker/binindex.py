@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Bin Index
+
+Tracks a cheap summary of the free space left in each bin
+(largest free width, largest free height and free area) so
+BinManager can skip bins that cannot hold an item without
+running their scoring functions.
+"""
+from typing import Any, List, Set, Tuple
+from sortedcontainers import SortedList # type: ignore
+from .item import Item
+
+
+class BinIndex:
+    """
+    Summaries are stored per bin position and ordered by free
+    area. Bins are marked dirty after an insert attempt and
+    their summaries are recomputed lazily on the next query.
+    """
+    def __init__(self) -> None:
+        self.bins = [] # type: List[Any]
+        self.summaries = [] # type: List[Tuple[int, int, int]]
+        self.by_area = SortedList()
+        self.dirty = set() # type: Set[int]
+
+
+    def __repr__(self) -> str:
+        return "BinIndex(%r)" % (self.summaries)
+
+
+    def __len__(self) -> int:
+        return len(self.bins)
+
+
+    def add(self, binn: Any) -> int:
+        """ Index a new bin and return its position """
+        index = len(self.bins)
+        summary = binn.free_space_summary()
+        self.bins.append(binn)
+        self.summaries.append(summary)
+        self.by_area.add((summary[2], index))
+        return index
+
+
+    def touch(self, index: int) -> None:
+        """ Mark a bin's summary as stale """
+        self.dirty.add(index)
+
+
+    def _refresh(self) -> None:
+        for index in self.dirty:
+            old = self.summaries[index]
+            new = self.bins[index].free_space_summary()
+            if new != old:
+                self.by_area.remove((old[2], index))
+                self.by_area.add((new[2], index))
+                self.summaries[index] = new
+        self.dirty.clear()
+
+
+    def candidates(self, item: Item) -> List[int]:
+        """
+        Returns the positions, in ascending order, of every
+        bin whose summary does not rule out the item in
+        either orientation.
+        """
+        if self.dirty:
+            self._refresh()
+        w, h = item.width, item.height
+        results = []
+        for _, index in self.by_area.irange((item.area,)):
+            max_w, max_h, _ = self.summaries[index]
+            if ((w <= max_w and h <= max_h) or
+                (h <= max_w and w <= max_h)):
+                results.append(index)
+        results.sort()
+        return results
@@ -7,8 +7,17 @@ creation and ranking of bins and returns layout dictionaries
 for packed bins.
 
 """
-from typing import List, Union, Callable, Optional, Any
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
 from . import item
+from . import beam
+from . import binindex
+from . import bounds
+from . import itemstore
 from . import shelf
 from . import guillotine
 from . import maximal_rectangles
@@ -18,6 +27,59 @@ from . import skyline
 Algorithm = Union[shelf.Sheet, guillotine.Guillotine, maximal_rectangles.MaximalRectangle]
 
 
+# Output of BinManager.pack_stream
+StreamPlacement = NamedTuple('StreamPlacement', [('item_id', Any),
+                                                 ('bin_index', int),
+                                                 ('x', int),
+                                                 ('y', int),
+                                                 ('rotated', bool)])
+
+
+ClosedBin = NamedTuple('ClosedBin', [('bin_index', int),
+                                     ('bin', Any)])
+
+
+def keyArea(el: item.Item) -> int:
+    return el.width*el.height
+
+
+def keyShortSide(el: item.Item) -> int:
+    return el.width if el.width < el.height else el.height
+
+
+def keyLongSide(el: item.Item) -> int:
+    return el.width if el.width > el.height else el.height
+
+
+def keyPerimeter(el: item.Item) -> int:
+    return (2*el.width)+(2*el.height)
+
+
+def keyDifference(el: item.Item) -> int:
+    return abs(el.width-el.height)
+
+
+def keyRatio(el: item.Item) -> float:
+    return el.width/el.height
+
+
+# Sorting heuristic name -> (key function, reverse)
+SORTING_HEURISTICS = {
+    'ASCA': (keyArea, False),
+    'DESCA': (keyArea, True),
+    'ASCSS': (keyShortSide, False),
+    'DESCSS': (keyShortSide, True),
+    'ASCLS': (keyLongSide, False),
+    'DESCLS': (keyLongSide, True),
+    'ASCPERIM': (keyPerimeter, False),
+    'DESCPERIM': (keyPerimeter, True),
+    'ASCDIFF': (keyDifference, False),
+    'DESCDIFF': (keyDifference, True),
+    'ASCRATIO': (keyRatio, False),
+    'DESCRATIO': (keyRatio, True),
+}
+
+
 class BinManager:
     """
     Interface Class.
@@ -32,19 +94,20 @@ class BinManager:
                  rectangle_merge: bool = True,
                  wastemap: bool = True,
                  sorting: bool = True,
-                 sorting_heuristic: str = 'DESCA') -> None:
+                 sorting_heuristic: str = 'DESCA',
+                 backend: str = 'python',
+                 floor_ceiling: bool = False) -> None:
         self.bin_width = bin_width
         self.bin_height = bin_height
         self.items = [] # type: List[item.Item]
+        self.demands = [] # type: List[Tuple[item.Item, int]]
+        self._items_sorted = True
         self.bin_count = 0
         self.bin_algo = bin_algo
         self.pack_algo = pack_algo
         self.heuristic = heuristic
 
-        if bin_algo == 'bin_best_fit':
-            self.bin_sel_algo = self._bin_best_fit
-        elif bin_algo == 'bin_first_fit':
-            self.bin_sel_algo =  self._bin_first_fit
+        self._resolve_bin_algo()
         self.heuristic = heuristic
         self.algorithm = pack_algo
 
@@ -54,69 +117,108 @@ class BinManager:
         self.rotation = rotation
         self.rectangle_merge = rectangle_merge
         self.wastemap = wastemap
+        self.backend = backend
+        self.floor_ceiling = floor_ceiling
+
+        self.bins = [] # type: List[Any]
+        self._bin_index = binindex.BinIndex()
+        self._add_bin(self._bin_factory())
+
+
+    def __getstate__(self) -> dict:
+        """
+        The bound bin selection method is resolved again
+        from bin_algo on load.
+        """
+        state = self.__dict__.copy()
+        state.pop('bin_sel_algo', None)
+        return state
+
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._resolve_bin_algo()
+
+
+    def _resolve_bin_algo(self) -> None:
+        if self.bin_algo == 'bin_best_fit':
+            self.bin_sel_algo = self._bin_best_fit
+        elif self.bin_algo == 'bin_first_fit':
+            self.bin_sel_algo = self._bin_first_fit
+        elif self.bin_algo == 'global_best_fit':
+            # execute() packs globally; single items use best fit
+            self.bin_sel_algo = self._bin_best_fit
+
+
+    def items_sort(self) -> None:
+        """
+        Sort self.items by the configured sorting heuristic.
+        Unknown heuristics fall back to DESCA.
+        """
+        key, reverse = SORTING_HEURISTICS.get(self.sorting_heuristic,
+                                              SORTING_HEURISTICS['DESCA'])
+        self.items.sort(key=key, reverse=reverse)
+        self._items_sorted = True
 
-        defaultBin = self._bin_factory() 
-        self.bins = [defaultBin]
-
-    def items_sort(self): 
-        # By Area Ascending
-        if self.sorting_heuristic == 'ASCA':
-            key = lambda el: el.width*el.height
-            self.items.sort(key=key, reverse=False)
-        # By Area Descending
-        elif self.sorting_heuristic == 'DESCA':
-            key = lambda el: el.width*el.height
-            self.items.sort(key=key, reverse=True)
-        # By Shorter Side Ascending
-        elif self.sorting_heuristic == 'ASCSS':
-            key = lambda el: el.width if el.width < el.height else el.height
-            self.items.sort(key=key, reverse=False)
-        # By Shorter Side Descending
-        elif self.sorting_heuristic == 'DESCSS':
-            key = lambda el: el.width if el.width < el.height else el.height
-            self.items.sort(key=key, reverse=True)
-        # By Longer Side Ascending
-        elif self.sorting_heuristic == 'ASCLS':
-            key = lambda el: el.width if el.width > el.height else el.height
-            self.items.sort(key=key, reverse=False)
-        # By Longer Side Descending
-        elif self.sorting_heuristic == 'DESCLS':
-            key = lambda el: el.width if el.width > el.height else el.height
-            self.items.sort(key=key, reverse=True)
-        # By Perimiter Ascending
-        elif self.sorting_heuristic == 'ASCPERIM':
-            key = lambda el: (2*el.width)+(2*el.height)
-            self.items.sort(key=key, reverse=False)
-        # By Perimiter Descending
-        elif self.sorting_heuristic == 'DESCPERIM':
-            key = lambda el: (2*el.width)+(2*el.height)
-            self.items.sort(key=key, reverse=True)
-        # By Difference in Side Length Ascending
-        elif self.sorting_heuristic == 'ASCDIFF':
-            key = lambda el: abs(el.width-el.height)
-            self.items.sort(key=key, reverse=False)
-        # By Difference in Side Length Descending
-        elif self.sorting_heuristic == 'DESCDIFF':
-            key = lambda el: abs(el.width-el.height)
-            self.items.sort(key=key, reverse=True)
-        # By Side Ratio Ascending
-        elif self.sorting_heuristic == 'ASCRATIO':
-            key = lambda el: el.width/el.height
-            self.items.sort(key=key, reverse=False)
-        # By Side Ratio Descending
-        elif self.sorting_heuristic == 'DESCRATIO':
-            key = lambda el: el.width/el.height
-            self.items.sort(key=key, reverse=True)
-        # Default to DESCA
-        else:
-            key = lambda el: el.width*el.height
-            self.items.sort(key=key, reverse=True)
 
     def add_items(self, *items: item.Item) -> None:
-        for item in items:
-            self.items.append(item)
-        if self.sorting:
-            self.items_sort()
+        """
+        Queue items for packing. Items are only appended here;
+        sorting is deferred to a single pass in execute().
+        """
+        self.items.extend(items)
+        self._items_sorted = False
+
+
+    def add_arrays(self, widths: Any, heights: Any, ids: Any = None) -> itemstore.ItemStore:
+        """
+        Queue items given as width and height columns (NumPy
+        arrays, typed arrays or sequences) and optional ids.
+        Returns the ItemStore the placements are written to.
+
+        Every row is queued as an ItemView, and packed bins keep
+        their items, so the store plus its views take about 140
+        bytes per item, more than the 96 of a slotted Item with
+        small sizes. The bare store takes about 52. The gain is
+        bulk ingest and zero-copy export, not memory.
+        """
+        store = itemstore.ItemStore.from_arrays(widths, heights, ids)
+        self.add_items(*store.views())
+        return store
+
+
+    def add_demand(self, *rows: Tuple[int, int, int]) -> None:
+        """
+        Queue items given as (width, height, quantity) rows.
+        Copies are only created as they are placed, and each
+        copy's id is the position of its row in self.demands.
+        """
+        for width, height, quantity in rows:
+            self.demands.append((item.Item(width, height), quantity))
+
+
+    def columns(self, store: itemstore.ItemStore) -> Dict[str, Any]:
+        """
+        Returns the columns of the store, see ItemStore.columns().
+        Bin indices are written to the store as rows are placed.
+        """
+        return store.columns()
+
+
+    def _record_bin(self, el: item.Item, index: int) -> None:
+        """ Write the bin index of a placed ItemStore row """
+        if isinstance(el, itemstore.ItemView):
+            el.store.bins[el.index] = index
+
+
+    def _record_bins(self, start: int = 0) -> None:
+        """
+        Write the bin index of every row packed in the bins from
+        position start on, after bins were removed or replaced
+        """
+        for index in range(start, len(self.bins)):
+            for el in self.bins[index].items:
+                self._record_bin(el, index)
 
 
     def _bin_factory(self) -> Any:
@@ -128,36 +230,62 @@ class BinManager:
             return guillotine.Guillotine(self.bin_width, self.bin_height, self.rotation, self.heuristic,
                                          self.rectangle_merge, self.split_heuristic)
         elif self.algorithm == 'shelf':
-            return shelf.Sheet(self.bin_width, self.bin_height, self.rotation, self.wastemap, self.heuristic)
+            return shelf.Sheet(self.bin_width, self.bin_height, self.rotation, self.wastemap, self.heuristic,
+                               self.floor_ceiling)
 
         elif self.algorithm == 'maximal_rectangle':
-            return maximal_rectangles.MaximalRectangle(self.bin_width, self.bin_height, self.rotation, self.heuristic)
+            return maximal_rectangles.MaximalRectangle(self.bin_width, self.bin_height, self.rotation, self.heuristic,
+                                                       self.backend)
 
         elif self.algorithm == 'skyline':
             return skyline.Skyline(self.bin_width, self.bin_height, self.rotation, self.wastemap, self.heuristic)
+
+        elif self.algorithm == 'skyline_heightmap':
+            return skyline.HeightmapSkyline(self.bin_width, self.bin_height, self.rotation, self.wastemap,
+                                            self.heuristic)
         raise ValueError('Error: No such Algorithm')
 
 
-    def _bin_first_fit(self, item: item.Item) -> None:
+    def _add_bin(self, binn: Any) -> None:
+        """ Append a bin and index its free space """
+        self.bins.append(binn)
+        self._bin_index.add(binn)
+
+
+    def _bin_first_fit(self, item: item.Item) -> Optional[int]:
         """
-        Insert into the first bin that fits the item
+        Insert into the first bin that fits the item.
+        Returns the bin position, or None if the insert failed.
         """
-        result = False
-        for binn in self.bins:
+        width, height = item.width, item.height
+        for i, binn in enumerate(self.bins):
+            if binn.known_fails.dominates(width, height):
+                continue
             result = binn.insert(item, self.heuristic)
+            self._bin_index.touch(i)
             if result:
-                break
-        if not result:
-            self.bins.append(self._bin_factory())
-            self.bins[-1].insert(item, self.heuristic)
+                return i
+            binn.known_fails.add(width, height)
+        new_bin = self._bin_factory()
+        result = new_bin.insert(item, self.heuristic)
+        self._add_bin(new_bin)
+        return len(self.bins) - 1 if result else None
 
 
-    def _bin_best_fit(self, item: item.Item) -> bool:
+    def lower_bound(self) -> int:
         """
-        Insert into the bin that best fits the item
+        Returns a lower bound on the number of bins needed for
+        the queued items and demand rows, see bounds.lower_bound
         """
+        widths = [el.width for el in self.items] + [el.width for el, _ in self.demands]
+        heights = [el.height for el in self.items] + [el.height for el, _ in self.demands]
+        quantities = [1] * len(self.items) + [quantity for _, quantity in self.demands]
+        return bounds.lower_bound(self.bin_width, self.bin_height,
+                                  widths, heights, quantities, self.rotation)
 
-        # Ensure item can theoretically fit the bin
+
+    def _check_size(self, item: item.Item) -> None:
+        """ Ensure item can theoretically fit the bin """
         item_fits = False
         if (item.width <= self.bin_width and 
             item.height <= self.bin_height):
@@ -169,24 +297,537 @@ class BinManager:
         if not item_fits:
             raise ValueError("Error! item too big for bin")
 
+
+    def _best_bin(self, item: item.Item) -> Optional[int]:
+        """
+        Returns the position of the best scoring bin for the
+        item, or None if no open bin fits it
+        """
+        # Only score bins whose free space summary admits the item
+        # and which have not already rejected an item this size
         scores = []
-        for binn in self.bins:
+        width, height = item.width, item.height
+        for i in self._bin_index.candidates(item):
+            binn = self.bins[i]
+            if binn.known_fails.dominates(width, height):
+                continue
             s, _, _ = binn._find_best_score(item)[:3]
             if s is not None:
-                scores.append((s, binn))
-        if scores:
-            _, best_bin = min(scores, key=lambda x: x[0])
-            return best_bin.insert(item)
+                scores.append((s, i))
+            else:
+                binn.known_fails.add(width, height)
+        if not scores:
+            return None
+        return min(scores, key=lambda x: x[0])[1]
+
+
+    def _bin_best_fit(self, item: item.Item) -> Optional[int]:
+        """
+        Insert into the bin that best fits the item.
+        Returns the bin position, or None if the insert failed.
+        """
+        self._check_size(item)
+        best = self._best_bin(item)
+        if best is not None:
+            self._bin_index.touch(best)
+            return best if self.bins[best].insert(item) else None
 
         new_bin = self._bin_factory()
-        new_bin.insert(item, self.heuristic)
-        self.bins.append(new_bin)
+        result = new_bin.insert(item, self.heuristic)
+        self._add_bin(new_bin)
+        return len(self.bins) - 1 if result else None
+
+
+    def _push_scores(self, heap: List[tuple],
+                     index: int,
+                     version: int,
+                     sizes: Dict[Tuple[int, int], Deque[item.Item]],
+                     ranks: Dict[Tuple[int, int], int]) -> int:
+        """
+        Score every remaining item size against one bin and
+        push the fits onto the heap. Returns the number of
+        sizes that fit.
+        """
+        binn = self.bins[index]
+        max_w, max_h, free_area = binn.free_space_summary()
+        pushed = 0
+        for size, items in sizes.items():
+            w, h = size
+            if w * h > free_area:
+                continue
+            if not ((w <= max_w and h <= max_h) or (h <= max_w and w <= max_h)):
+                continue
+            if binn.known_fails.dominates(w, h):
+                continue
+            s = binn._find_best_score(items[0])[0]
+            if s is None:
+                binn.known_fails.add(w, h)
+                continue
+            heapq.heappush(heap, (s, ranks[size], index, version, size))
+            pushed += 1
+        return pushed
+
+
+    def _global_best_fit(self) -> None:
+        """
+        Repeatedly insert the best scoring (item, bin) pair
+        over every remaining item and open bin, opening a new
+        bin only when nothing fits. Items of one size score
+        alike, so scores are cached per size and bin in a
+        heap. After an insert only that bin is rescored, and
+        heap entries from its older versions are dropped when
+        popped. Ties go to the size that comes first in the
+        sort order, then the lowest bin.
+        """
+        sizes = {} # type: Dict[Tuple[int, int], Deque[item.Item]]
+        for el in self.items:
+            sizes.setdefault((el.width, el.height), deque()).append(el)
+        ranks = {size: rank for rank, size in enumerate(sizes)}
+        versions = [0] * len(self.bins)
+        heap = [] # type: List[tuple]
+        for index in range(len(self.bins)):
+            self._push_scores(heap, index, 0, sizes, ranks)
+
+        while sizes:
+            if not heap:
+                self._add_bin(self._bin_factory())
+                versions.append(0)
+                if not self._push_scores(heap, len(self.bins) - 1, 0, sizes, ranks):
+                    raise ValueError("Error! item too big for bin")
+                continue
+            _, _, index, version, size = heapq.heappop(heap)
+            if version != versions[index] or size not in sizes:
+                continue
+            items = sizes[size]
+            binn = self.bins[index]
+            if binn.insert(items[0], self.heuristic):
+                self._record_bin(items.popleft(), index)
+                if not items:
+                    del sizes[size]
+            else:
+                binn.known_fails.add(*size)
+            self._bin_index.touch(index)
+            versions[index] += 1
+            self._push_scores(heap, index, versions[index], sizes, ranks)
+
+
+    def _close_bin(self, position: int) -> Any:
+        """
+        Remove an open bin and rebuild the bin index
+        over the bins that remain
+        """
+        binn = self.bins.pop(position)
+        self._reindex()
+        return binn
+
+
+    def _reindex(self) -> None:
+        """ Rebuild the bin index after bins were removed """
+        self._bin_index = binindex.BinIndex()
+        for binn in self.bins:
+            self._bin_index.add(binn)
+
+
+    def pack_stream(self, items: Iterable[item.Item],
+                    close_bins: bool = False,
+                    max_open_bins: Optional[int] = None,
+                    min_size: Tuple[int, int] = (1, 1)
+                    ) -> Iterator[Union[StreamPlacement, ClosedBin]]:
+        """
+        Pack items one at a time in arrival order, yielding a
+        StreamPlacement as soon as each item is placed. Items
+        are not added to self.items and are not sorted.
+
+        With close_bins, a bin is closed as soon as its free
+        space cannot hold min_size, and once more than
+        max_open_bins are open the oldest one is closed. Closed
+        bins are removed from self.bins and yielded as a
+        ClosedBin, and the open bins are closed when the
+        stream ends, so memory is bounded by the open bins.
+
+        Bin indices count every bin used by this call, open
+        bins first. An item too big for the bin, or that an
+        empty bin rejects, raises ValueError and leaves no
+        empty bin open for it.
+        """
+        ids = list(range(len(self.bins)))
+        next_id = len(self.bins)
+        min_w, min_h = min_size
+        for el in items:
+            self._check_size(el)
+            position = self.bin_sel_algo(el)
+            opened = len(self.bins) > len(ids)
+            if opened:
+                ids.append(next_id)
+                next_id += 1
+            if position is None:
+                # Do not keep the empty bin opened for the item
+                if opened and not self.bins[-1].items:
+                    ids.pop()
+                    self._close_bin(len(self.bins) - 1)
+                raise ValueError("Error! item did not fit an empty bin")
+            self._record_bin(el, ids[position])
+            yield StreamPlacement(el.id, ids[position], el.x, el.y, el.rotated)
+            if not close_bins:
+                continue
+
+            max_w, max_h, _ = self.bins[position].free_space_summary()
+            if not ((min_w <= max_w and min_h <= max_h) or
+                    (self.rotation and min_h <= max_w and min_w <= max_h)):
+                yield ClosedBin(ids.pop(position), self._close_bin(position))
+            if max_open_bins is not None and len(self.bins) > max_open_bins:
+                yield ClosedBin(ids.pop(0), self._close_bin(0))
+
+        if close_bins:
+            while self.bins:
+                yield ClosedBin(ids.pop(0), self._close_bin(0))
+            self._add_bin(self._bin_factory())
+
+
+    def _insert_block(self, position: int,
+                      width: int,
+                      height: int,
+                      quantity: int,
+                      row: int) -> int:
+        """
+        Insert a grid of up to quantity copies into a bin as one
+        block item, sized from the bin's free space summary and
+        halved until it fits. The block is then replaced by its
+        copies in the bin's item list. Returns the number of
+        copies placed.
+        """
+        binn = self.bins[position]
+        max_w, max_h, _ = binn.free_space_summary()
+        # Lay the copies on their side if that fits more of them
+        turned = (self.rotation and
+                  (max_w // height) * (max_h // width) > (max_w // width) * (max_h // height))
+        cw, ch = (height, width) if turned else (width, height)
+        cols = max(1, min(quantity, max_w // cw))
+        rows = max(1, min(quantity // cols, max_h // ch))
+        while True:
+            block = item.Item(cols * cw, rows * ch)
+            if (not binn.known_fails.dominates(block.width, block.height) and
+                binn.insert(block, self.heuristic)):
+                break
+            binn.known_fails.add(block.width, block.height)
+            if cols == rows == 1:
+                binn.known_fails.add(width, height)
+                return 0
+            if rows > 1:
+                rows //= 2
+            else:
+                cols //= 2
+        self._bin_index.touch(position)
+
+        if block.rotated:
+            turned = not turned
+            cw, ch = ch, cw
+        copies = []
+        for j in range(block.height // ch):
+            for i in range(block.width // cw):
+                copy = item.Item(width, height, (block.x + i * cw, block.y + j * ch))
+                copy.id = row
+                if turned:
+                    copy.rotate()
+                copies.append(copy)
+        k = len(binn.items) - 1
+        while binn.items[k] is not block:
+            k -= 1
+        binn.items[k:k+1] = copies
+        return len(copies)
+
+
+    def _score_demand(self, heap: List[Tuple[Any, int]],
+                      scores: Dict[int, Any],
+                      index: int,
+                      probe: item.Item) -> None:
+        """
+        Score one copy against a bin and push it onto the heap,
+        keyed by score for best fit or by position for first fit
+        """
+        binn = self.bins[index]
+        width, height = probe.width, probe.height
+        s = None
+        if not binn.known_fails.dominates(width, height):
+            s = binn._find_best_score(probe)[0]
+            if s is None:
+                binn.known_fails.add(width, height)
+        if s is None:
+            scores.pop(index, None)
+            return
+        key = index if self.bin_algo == 'bin_first_fit' else s
+        scores[index] = key
+        heapq.heappush(heap, (key, index))
+
+
+    def _pack_demand(self, width: int, height: int, quantity: int, row: int) -> None:
+        """
+        Place quantity copies of one size. Every open bin is
+        scored once for a single copy, then as many copies as
+        fit are placed in the best bin as one block and only
+        that bin is scored again.
+        """
+        probe = item.Item(width, height)
+        self._check_size(probe)
+        heap = [] # type: List[Tuple[Any, int]]
+        scores = {} # type: Dict[int, Any]
+        for i in self._bin_index.candidates(probe):
+            self._score_demand(heap, scores, i, probe)
+        while quantity > 0:
+            position = None
+            while heap:
+                key, i = heapq.heappop(heap)
+                if scores.get(i) == key:
+                    position = i
+                    break
+            if position is None:
+                self._add_bin(self._bin_factory())
+                position = len(self.bins) - 1
+            placed = self._insert_block(position, width, height, quantity, row)
+            if not placed and not self.bins[position].items:
+                raise ValueError("Error! item too big for bin")
+            quantity -= placed
+            self._score_demand(heap, scores, position, probe)
+
+
+    def _execute_demands(self) -> None:
+        """
+        Pack the items and the demand rows together in sort
+        order. Single items use the bin best fit or first fit
+        selection.
+        """
+        rows = [(proto, quantity, row) for row, (proto, quantity) in enumerate(self.demands)]
+        singles = ((el, 1, None) for el in self.items)
+        if self.sorting:
+            key, reverse = SORTING_HEURISTICS.get(self.sorting_heuristic,
+                                                  SORTING_HEURISTICS['DESCA'])
+            rows.sort(key=lambda r: key(r[0]), reverse=reverse)
+            order = heapq.merge(singles, rows, key=lambda r: key(r[0]), reverse=reverse)
+        else:
+            order = itertools.chain(singles, rows)
+        for el, quantity, row in order:
+            if row is None:
+                position = self.bin_sel_algo(el)
+                if position is not None:
+                    self._record_bin(el, position)
+            else:
+                self._pack_demand(el.width, el.height, quantity, row)
+
+
+    def _checkpoint(self, marks: Dict[int, int], index: int) -> None:
+        """
+        Open a checkpoint on a bin before its first change in
+        a move so the move can be undone
+        """
+        if index not in marks:
+            marks[index] = self.bins[index].checkpoint()
+
+
+    def _commit(self, marks: Dict[int, int]) -> None:
+        for index in marks:
+            self.bins[index].commit()
+
+
+    def _undo(self, marks: Dict[int, int], states: List[Tuple[item.Item, tuple]]) -> None:
+        """ Roll back the changed bins and restore item positions """
+        for index, mark in marks.items():
+            self.bins[index].rollback(mark)
+            self.bins[index].commit()
+            self._bin_index.touch(index)
+        for el, state in states:
+            el.x, el.y, el.width, el.height, el.rotated = state
+
+
+    def _empty_bin(self, target: int) -> bool:
+        """
+        Move every item of the target bin into the best fitting
+        other bin. The bins that take an item are rolled back
+        if any item does not fit.
+        """
+        key, reverse = SORTING_HEURISTICS.get(self.sorting_heuristic,
+                                              SORTING_HEURISTICS['DESCA'])
+        items = sorted(self.bins[target].items, key=key, reverse=reverse)
+        marks = {} # type: Dict[int, int]
+        states = [(el, (el.x, el.y, el.width, el.height, el.rotated)) for el in items]
+        for el in items:
+            scores = []
+            for i in self._bin_index.candidates(el):
+                binn = self.bins[i]
+                if i == target or binn.known_fails.dominates(el.width, el.height):
+                    continue
+                s = binn._find_best_score(el)[0]
+                if s is not None:
+                    scores.append((s, i))
+                else:
+                    binn.known_fails.add(el.width, el.height)
+            if not scores:
+                self._undo(marks, states)
+                return False
+            best = min(scores, key=lambda x: x[0])[1]
+            self._checkpoint(marks, best)
+            self._bin_index.touch(best)
+            if not self.bins[best].insert(el, self.heuristic):
+                self._undo(marks, states)
+                return False
+        self._commit(marks)
+        del self.bins[target]
+        self._reindex()
+        self._record_bins(min([target] + list(marks)))
         return True
 
 
+    def _repack_bins(self, targets: List[int], rng: random.Random) -> bool:
+        """
+        Reinsert the items of the target bins, in a perturbed
+        sort order, into the other bins and as many fresh bins.
+        Kept if it needs fewer bins, or as many with an emptier
+        least filled bin, which makes that bin easier to empty
+        later. Otherwise the changed bins are rolled back.
+        """
+        key, reverse = SORTING_HEURISTICS.get(self.sorting_heuristic,
+                                              SORTING_HEURISTICS['DESCA'])
+        items = sorted((el for i in targets for el in self.bins[i].items),
+                       key=key, reverse=reverse)
+        for _ in range(len(items) // 3 + 1):
+            a, b = rng.randrange(len(items)), rng.randrange(len(items))
+            items[a], items[b] = items[b], items[a]
+        marks = {} # type: Dict[int, int]
+        states = [(el, (el.x, el.y, el.width, el.height, el.rotated)) for el in items]
+
+        fresh = [] # type: List[Any]
+        for el in items:
+            scores = []
+            for i in self._bin_index.candidates(el):
+                binn = self.bins[i]
+                if i in targets or binn.known_fails.dominates(el.width, el.height):
+                    continue
+                s = binn._find_best_score(el)[0]
+                if s is not None:
+                    scores.append((s, i))
+                else:
+                    binn.known_fails.add(el.width, el.height)
+            for i, binn in enumerate(fresh):
+                s = binn._find_best_score(el)[0]
+                if s is not None:
+                    scores.append((s, -1 - i))
+            if scores:
+                best = min(scores, key=lambda x: x[0])[1]
+                if best >= 0:
+                    self._checkpoint(marks, best)
+                    self._bin_index.touch(best)
+                    placed = self.bins[best].insert(el, self.heuristic)
+                else:
+                    placed = fresh[-1 - best].insert(el, self.heuristic)
+            elif len(fresh) < len(targets):
+                fresh.append(self._bin_factory())
+                placed = fresh[-1].insert(el, self.heuristic)
+            else:
+                placed = False
+            if not placed:
+                self._undo(marks, states)
+                return False
+        if len(fresh) == len(targets):
+            emptiest = max(self.bins[i].free_area for i in targets)
+            if max(binn.free_area for binn in fresh) <= emptiest:
+                self._undo(marks, states)
+                return False
+
+        self._commit(marks)
+        for i in sorted(targets, reverse=True):
+            del self.bins[i]
+        self.bins.extend(fresh)
+        self._reindex()
+        self._record_bins(min(targets + list(marks)))
+        return True
+
+
+    def improve(self, time_budget: Optional[float] = None,
+                iterations: Optional[int] = None,
+                seed: int = 0) -> int:
+        """
+        Local search over a packed result. Each iteration tries
+        to empty the least filled bin not yet tried by moving
+        its items into the other bins. Once every bin has been
+        tried, it repacks the items of two or three of the least
+        filled bins in a perturbed order instead. Failed moves
+        are rolled back in the bins they changed.
+
+        Runs until the wall-clock time_budget (seconds) or the
+        number of iterations is used up, or the bin count
+        reaches lower_bound(). Moves depend only on the seed, so
+        an iteration budget gives the same result on every run.
+        Returns the number of bins removed.
+        """
+        if time_budget is None and iterations is None:
+            raise ValueError('Error! improve needs a time_budget or iterations')
+        deadline = None if time_budget is None else time.monotonic() + time_budget
+        rng = random.Random(seed)
+        bound = self.lower_bound()
+        start = len(self.bins)
+        tried = set() # type: Set[int]
+        count = 0
+        while len(self.bins) > max(bound, 1):
+            if iterations is not None and count >= iterations:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            count += 1
+            # Least filled first, ties to the later bin
+            order = sorted(range(len(self.bins)),
+                           key=lambda i: (-self.bins[i].free_area, -i))
+            untried = [i for i in order if i not in tried]
+            if untried:
+                # Positions only shift when a move succeeds
+                target = untried[0]
+                tried.add(target)
+                if self._empty_bin(target):
+                    tried.clear()
+                continue
+            k = min(len(self.bins), 2 + rng.randrange(2))
+            if self._repack_bins(order[:k], rng):
+                tried.clear()
+        return start - len(self.bins)
+
+
+    def beam_search(self, beam_width: int = 4,
+                    lookahead: int = 3,
+                    score: Union[str, Callable] = 'bins',
+                    time_budget: Optional[float] = None,
+                    processes: Optional[int] = None) -> None:
+        """
+        Pack the queued items with a beam search instead of
+        execute(). Keeps the beam_width best partial packings,
+        ranked by score after a best fit rollout of the next
+        lookahead items, see beam.search. Beams are expanded in
+        a process pool, or in this process with processes=1.
+        Once the time_budget (seconds) runs out, the best
+        packing so far is finished by best fit.
+        """
+        if self.demands:
+            raise ValueError('Error! beam search does not pack demand rows')
+        if self.sorting and not self._items_sorted:
+            self.items_sort()
+        for el in self.items:
+            self._check_size(el)
+        self.bins = beam.search(self.bins, self.items, self._bin_factory(), self.heuristic,
+                                beam_width, lookahead, score, time_budget, processes)
+        self._reindex()
+        self._record_bins()
+
+
     def execute(self) -> None:
         """
         Loop over all items and attempt insertion
         """
+        if self.sorting and not self._items_sorted:
+            self.items_sort()
+        if self.demands:
+            self._execute_demands()
+            return
+        if self.bin_algo == 'global_best_fit':
+            self._global_best_fit()
+            return
         for item in self.items:
-            self.bin_sel_algo(item)
+            position = self.bin_sel_algo(item)
+            if position is not None:
+                self._record_bin(item, position)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+Lower Bounds
+
+Bin count lower bounds for a set of items, used to report the
+optimality gap of a packing and to stop searches early once a
+result reaches the bound.
+
+The area bound divides the total item area by the bin area.
+The L2 bound is the Martello-Vigo style bound for two
+dimensions: items larger than half the bin in both dimensions
+need a bin each, and for every pair of thresholds (p, q) the
+items at least p wide and q tall cannot share a bin with the
+large items that leave less than p by q of slack. Their area
+is charged against the free space of the remaining large item
+bins, and whatever does not fit needs further bins.
+"""
+import bisect
+from typing import Any, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np # type: ignore
+except ImportError:
+    np = None
+
+
+def area_bound(bin_width: int,
+               bin_height: int,
+               widths: Sequence[int],
+               heights: Sequence[int],
+               quantities: Optional[Sequence[int]] = None) -> int:
+    """ Total item area over the bin area, rounded up """
+    if np is not None:
+        areas = np.asarray(widths, dtype=np.int64) * np.asarray(heights, dtype=np.int64)
+        if quantities is not None:
+            areas = areas * np.asarray(quantities, dtype=np.int64)
+        return -(-int(areas.sum()) // (bin_width * bin_height))
+    if quantities is None:
+        quantities = [1] * len(widths)
+    total = sum(int(w) * int(h) * int(q) for w, h, q in zip(widths, heights, quantities))
+    return -(-total // (bin_width * bin_height))
+
+
+def _oriented(bin_width: int,
+              bin_height: int,
+              width: int,
+              height: int,
+              rotation: bool) -> Tuple[int, int]:
+    """
+    Dimensions that hold in every orientation the item can be
+    packed in. An item that fits either way is treated as a
+    square of its shorter side.
+    """
+    if not rotation:
+        return width, height
+    upright = width <= bin_width and height <= bin_height
+    turned = height <= bin_width and width <= bin_height
+    if upright and turned:
+        side = min(width, height)
+        return side, side
+    if turned:
+        return height, width
+    return width, height
+
+
+def _dominance_sums(xs: Sequence[int],
+                    ys: Sequence[int],
+                    values: Sequence[int],
+                    tx: Sequence[Any],
+                    ty: Sequence[Any],
+                    strict: bool) -> List[List[int]]:
+    """
+    Returns a matrix S where S[i][j] sums the values of the
+    points with x >= tx[i] and y >= ty[j] (> with strict),
+    from 2D suffix sums over the distinct coordinates
+    """
+    ux, uy = sorted(set(xs)), sorted(set(ys))
+    grid = [[0] * (len(uy) + 1) for _ in range(len(ux) + 1)]
+    for x, y, v in zip(xs, ys, values):
+        grid[bisect.bisect_left(ux, x)][bisect.bisect_left(uy, y)] += v
+    for i in range(len(ux) - 1, -1, -1):
+        for j in range(len(uy) - 1, -1, -1):
+            grid[i][j] += grid[i+1][j] + grid[i][j+1] - grid[i+1][j+1]
+    search = bisect.bisect_right if strict else bisect.bisect_left
+    rows = [search(ux, t) for t in tx]
+    cols = [search(uy, t) for t in ty]
+    return [[grid[i][j] for j in cols] for i in rows]
+
+
+def _dominance_sums_numpy(xs: Any, ys: Any, values: Any, tx: Any, ty: Any, strict: bool) -> Any:
+    """ Array version of _dominance_sums """
+    ux, uy = np.unique(xs), np.unique(ys)
+    grid = np.zeros((len(ux) + 1, len(uy) + 1), dtype=np.int64)
+    np.add.at(grid, (np.searchsorted(ux, xs), np.searchsorted(uy, ys)), values)
+    grid = grid[::-1, ::-1].cumsum(0).cumsum(1)[::-1, ::-1]
+    side = 'right' if strict else 'left'
+    return grid[np.ix_(np.searchsorted(ux, tx, side), np.searchsorted(uy, ty, side))]
+
+
+def _l2_numpy(W: int, H: int, widths: Any, heights: Any, quantities: Any, rotation: bool) -> int:
+    """ Array version of l2_bound """
+    w = np.asarray(widths, dtype=np.int64)
+    h = np.asarray(heights, dtype=np.int64)
+    q = np.ones_like(w) if quantities is None else np.asarray(quantities, dtype=np.int64)
+    ew, eh = w, h
+    if rotation:
+        upright = (w <= W) & (h <= H)
+        turned = (h <= W) & (w <= H)
+        side = np.minimum(w, h)
+        ew = np.where(upright & turned, side, np.where(turned, h, w))
+        eh = np.where(upright & turned, side, np.where(turned, w, h))
+    big = (2 * ew > W) & (2 * eh > H) & (q > 0)
+    small = ~big & (q > 0)
+    big_count = int(q[big].sum())
+    if not small.any():
+        return big_count
+
+    sw, sh = ew[small], eh[small]
+    ps = np.unique(np.append(sw[2 * sw <= W], min(1, W / 2)))
+    qs = np.unique(np.append(sh[2 * sh <= H], min(1, H / 2)))
+    excess = _dominance_sums_numpy(sw, sh, (q * w * h)[small], ps, qs, False)
+    if big.any():
+        free = (q * (W * H - w * h))[big]
+        lost_free = _dominance_sums_numpy(ew[big], eh[big], free, W - ps, H - qs, True)
+        excess = excess - (int(free.sum()) - lost_free)
+    return big_count + max(0, -(-int(excess.max()) // (W * H)))
+
+
+def l2_bound(bin_width: int,
+             bin_height: int,
+             widths: Sequence[int],
+             heights: Sequence[int],
+             quantities: Optional[Sequence[int]] = None,
+             rotation: bool = True) -> int:
+    """
+    Martello-Vigo L2 style bound, taking the best threshold
+    pair over the widths and heights of the small items.
+    """
+    W, H = bin_width, bin_height
+    if np is not None:
+        return _l2_numpy(W, H, widths, heights, quantities, rotation)
+    bin_area = W * H
+    if quantities is None:
+        quantities = [1] * len(widths)
+
+    big = ([], [], []) # type: Tuple[List[int], List[int], List[int]]
+    small = ([], [], []) # type: Tuple[List[int], List[int], List[int]]
+    big_count = 0
+    for w, h, q in zip(widths, heights, quantities):
+        w, h, q = int(w), int(h), int(q)
+        if q <= 0:
+            continue
+        ew, eh = _oriented(W, H, w, h, rotation)
+        if 2 * ew > W and 2 * eh > H:
+            big_count += q
+            group, value = big, q * (bin_area - w * h)
+        else:
+            group, value = small, q * w * h
+        group[0].append(ew)
+        group[1].append(eh)
+        group[2].append(value)
+    if not small[0]:
+        return big_count
+
+    # Thresholds of at most half the bin keep the slack-limited
+    # items among the large ones
+    ps = sorted({w for w in small[0] if 2 * w <= W} | {min(1, W / 2)})
+    qs = sorted({h for h in small[1] if 2 * h <= H} | {min(1, H / 2)})
+    small_area = _dominance_sums(small[0], small[1], small[2], ps, qs, False)
+    if big[0]:
+        big_free = sum(big[2])
+        lost_free = _dominance_sums(big[0], big[1], big[2],
+                                    [W - p for p in ps], [H - q for q in qs], True)
+    excess = max(small_area[i][j] - (big_free - lost_free[i][j] if big[0] else 0)
+                 for i in range(len(ps)) for j in range(len(qs)))
+    return big_count + max(0, -(-excess // bin_area))
+
+
+def lower_bound(bin_width: int,
+                bin_height: int,
+                widths: Sequence[int],
+                heights: Sequence[int],
+                quantities: Optional[Sequence[int]] = None,
+                rotation: bool = True) -> int:
+    """ The larger of the area bound and the L2 bound """
+    return max(area_bound(bin_width, bin_height, widths, heights, quantities),
+               l2_bound(bin_width, bin_height, widths, heights, quantities, rotation))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Known-Fail Frontier
+
+Free space in a bin only shrinks as items are inserted, so an
+item size that failed to fit a bin will keep failing, as will
+any size at least as large in both dimensions. Each bin keeps
+the minimal failed sizes as a Pareto frontier so hopeless
+insert attempts can be rejected without scanning the bin.
+"""
+import bisect
+from typing import List, Optional
+
+
+class FailFrontier:
+    """
+    Minimal failed (width, height) pairs, stored as parallel
+    lists sorted by ascending width with strictly descending
+    heights. The owning bin sets undo to its undo log while a
+    checkpoint is open.
+    """
+    undo = None # type: Optional[list]
+
+    def __init__(self) -> None:
+        self.widths = [] # type: List[int]
+        self.heights = [] # type: List[int]
+
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state.pop('undo', None)
+        return state
+
+
+    def __repr__(self) -> str:
+        return "FailFrontier(%r)" % (list(zip(self.widths, self.heights)))
+
+
+    def __len__(self) -> int:
+        return len(self.widths)
+
+
+    def dominates(self, width: int, height: int) -> bool:
+        """
+        Returns true if a recorded failure is no larger
+        than (width, height) in both dimensions.
+        """
+        i = bisect.bisect_right(self.widths, width)
+        return i > 0 and self.heights[i-1] <= height
+
+
+    def add(self, width: int, height: int) -> None:
+        """ Record a failed size and drop the sizes it dominates """
+        if self.dominates(width, height):
+            return
+        i = bisect.bisect_left(self.widths, width)
+        j = i
+        while j < len(self.widths) and self.heights[j] >= height:
+            j += 1
+        if self.undo is not None:
+            self.undo.append((self._splice, (i, i+1, self.widths[i:j], self.heights[i:j])))
+        self.widths[i:j] = [width]
+        self.heights[i:j] = [height]
+
+
+    def clear(self) -> None:
+        """ Forget all failures, used when free space can grow """
+        if self.undo is not None and self.widths:
+            self.undo.append((self._splice, (0, 0, self.widths[:], self.heights[:])))
+        del self.widths[:]
+        del self.heights[:]
+
+
+    def _splice(self, start: int, end: int, widths: List[int], heights: List[int]) -> None:
+        """ Replace the failures from start to end, reverting an add or clear """
+        self.widths[start:end] = widths
+        self.heights[start:end] = heights
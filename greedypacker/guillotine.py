@@ -8,11 +8,13 @@ ssbothwell@gmail.com
 import operator
 import typing
 import bisect
-from typing import List, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 from functools import reduce
 from collections import namedtuple
-from sortedcontainers import SortedListWithKey # type: ignore
+from sortedcontainers import SortedList, SortedListWithKey # type: ignore
 from .item import Item
+from .frontier import FailFrontier
+from .undo import Transactional
 
 
 class FreeRectangle(typing.NamedTuple('FreeRectangle', [('width', int), ('height', int), ('x', int), ('y', int)])):
@@ -22,7 +24,259 @@ class FreeRectangle(typing.NamedTuple('FreeRectangle', [('width', int), ('height
         return self.width*self.height
 
 
-class Guillotine:
+def rect_area(rect: FreeRectangle) -> int:
+    """ Sort key for free rectangles """
+    return rect.area
+
+
+class FreeRectList(SortedListWithKey):
+    """
+    Free rectangles sorted by area and indexed by their edges.
+    Each rectangle is keyed by (x, width) with its bottom and
+    top y, and by (y, height) with its left and right x, so a
+    neighbour sharing a full side is found with one lookup.
+    Rectangles added since the last merge are kept pending,
+    and the widths and heights are kept sorted for
+    free_space_summary.
+
+    While the owning bin has a checkpoint open, undo is its
+    undo log. Removed rectangles are logged with their rank
+    among rectangles of equal area, and every change with the
+    edge entries it overwrote, so rolling back restores the
+    exact order and index.
+    """
+    undo = None # type: Optional[list]
+
+    def __init__(self, iterable: Optional[Iterable[FreeRectangle]] = None,
+                 key: Callable = rect_area) -> None:
+        self.bottoms = {} # type: Dict[Tuple[int, int, int], FreeRectangle]
+        self.tops = {} # type: Dict[Tuple[int, int, int], FreeRectangle]
+        self.lefts = {} # type: Dict[Tuple[int, int, int], FreeRectangle]
+        self.rights = {} # type: Dict[Tuple[int, int, int], FreeRectangle]
+        self.pending = set() # type: Set[FreeRectangle]
+        self.widths = SortedList()
+        self.heights = SortedList()
+        super().__init__(key=key)
+        if iterable is not None:
+            self.update(iterable)
+
+
+    def _index_rect(self, rect: FreeRectangle) -> None:
+        self.widths.add(rect.width)
+        self.heights.add(rect.height)
+        self.bottoms[(rect.x, rect.width, rect.y)] = rect
+        self.tops[(rect.x, rect.width, rect.y + rect.height)] = rect
+        self.lefts[(rect.y, rect.height, rect.x)] = rect
+        self.rights[(rect.y, rect.height, rect.x + rect.width)] = rect
+        self.pending.add(rect)
+
+
+    def _edges(self, rect: FreeRectangle) -> List[Tuple[dict, Tuple[int, int, int]]]:
+        """ Returns the edge indexes and keys of a rectangle """
+        return [(self.bottoms, (rect.x, rect.width, rect.y)),
+                (self.tops, (rect.x, rect.width, rect.y + rect.height)),
+                (self.lefts, (rect.y, rect.height, rect.x)),
+                (self.rights, (rect.y, rect.height, rect.x + rect.width))]
+
+
+    def _unindex_rect(self, rect: FreeRectangle) -> None:
+        self.widths.remove(rect.width)
+        self.heights.remove(rect.height)
+        if rect in self:
+            # An identical rectangle is still stored
+            return
+        # Overlapping rectangles can share an edge key, so only
+        # drop entries that still point at this rectangle
+        for edges, key in self._edges(rect):
+            if edges.get(key) == rect:
+                del edges[key]
+        self.pending.discard(rect)
+
+
+    def _index_state(self, rect: FreeRectangle) -> tuple:
+        """ The edge entries under rect's keys and whether it is pending """
+        return tuple(edges.get(key) for edges, key in self._edges(rect)) + (rect in self.pending,)
+
+
+    def _restore_index(self, rect: FreeRectangle, state: tuple) -> None:
+        for (edges, key), value in zip(self._edges(rect), state):
+            if value is None:
+                edges.pop(key, None)
+            else:
+                edges[key] = value
+        if state[-1]:
+            self.pending.add(rect)
+        else:
+            self.pending.discard(rect)
+
+
+    def _log_add(self, value: FreeRectangle, state: tuple) -> None:
+        self.undo.append((self._revert_add, (value, state)))
+
+
+    def _log_removal(self, index: int) -> None:
+        """ Log the removal of the rectangle at index """
+        value = self[index]
+        rank = index - self.bisect_key_left(self._key(value))
+        self.undo.append((self._revert_removal, (value, rank, self._index_state(value))))
+
+
+    def _revert_add(self, value: FreeRectangle, state: tuple) -> None:
+        self.remove(value)
+        self._restore_index(value, state)
+
+
+    def _revert_removal(self, value: FreeRectangle, rank: int, state: tuple) -> None:
+        """
+        Put a removed rectangle back at its rank among the
+        rectangles of equal area. New values go after equal
+        keys, so the ones that followed it are re-added too.
+        """
+        key = self._key(value)
+        start = self.bisect_key_left(key) + rank
+        tail = self[start:self.bisect_key_right(key)]
+        states = [self._index_state(rect) for rect in tail]
+        del self[start:start + len(tail)]
+        self.add(value)
+        for rect, rect_state in zip(tail, states):
+            self.add(rect)
+            self._restore_index(rect, rect_state)
+        self._restore_index(value, state)
+
+
+    def _restore(self, values: List[FreeRectangle], indexes: tuple) -> None:
+        """ Refill the list emptied by clear """
+        super().update(values)
+        self.widths.update(rect.width for rect in values)
+        self.heights.update(rect.height for rect in values)
+        for edges, saved in zip((self.bottoms, self.tops, self.lefts, self.rights,
+                                 self.pending), indexes):
+            edges.update(saved)
+
+
+    def add(self, value: FreeRectangle) -> None:
+        if self.undo is not None:
+            self._log_add(value, self._index_state(value))
+        super().add(value)
+        self._index_rect(value)
+
+
+    def update(self, iterable: Iterable[FreeRectangle]) -> None:
+        values = list(iterable)
+        if self.undo is not None:
+            # Reverted newest first, each with the index
+            # before any of the values were added
+            for value in values:
+                self._log_add(value, self._index_state(value))
+        super().update(values)
+        for value in values:
+            self._index_rect(value)
+
+
+    def __iadd__(self, other: Iterable[FreeRectangle]) -> 'FreeRectList':
+        self.update(other)
+        return self
+
+
+    def discard(self, value: FreeRectangle) -> None:
+        if self.undo is not None and value in self:
+            self._log_removal(self.index(value))
+        size = len(self)
+        super().discard(value)
+        if len(self) != size:
+            self._unindex_rect(value)
+
+
+    def remove(self, value: FreeRectangle) -> None:
+        if self.undo is not None:
+            self._log_removal(self.index(value))
+        super().remove(value)
+        self._unindex_rect(value)
+
+
+    def pop(self, index: int = -1) -> FreeRectangle:
+        if self.undo is not None:
+            self._log_removal(index % len(self) if self else index)
+        value = super().pop(index)
+        self._unindex_rect(value)
+        return value
+
+
+    def __delitem__(self, index: Union[int, slice]) -> None:
+        if self.undo is not None:
+            positions = (range(len(self))[index] if isinstance(index, slice)
+                         else [index % len(self)])
+            # Later positions first, so earlier ranks still hold
+            for position in sorted(positions, reverse=True):
+                self._log_removal(position)
+        values = self[index] if isinstance(index, slice) else [self[index]]
+        super().__delitem__(index)
+        for value in values:
+            self._unindex_rect(value)
+
+
+    def clear(self) -> None:
+        if self.undo is not None and self:
+            self.undo.append((self._restore, (list(self),
+                                              (dict(self.bottoms), dict(self.tops),
+                                               dict(self.lefts), dict(self.rights),
+                                               set(self.pending)))))
+        super().clear()
+        self.bottoms.clear()
+        self.tops.clear()
+        self.lefts.clear()
+        self.rights.clear()
+        self.pending.clear()
+        self.widths.clear()
+        self.heights.clear()
+
+
+    def merge(self) -> bool:
+        """
+        Merge pending rectangles with any neighbour sharing a
+        full side, and merge the results again until no more
+        merges are possible. Returns true if any rectangles
+        were merged.
+        """
+        merged = False
+        work = list(self.pending)
+        while work:
+            rect = work.pop()
+            if self.bottoms.get((rect.x, rect.width, rect.y)) != rect:
+                # Already merged away
+                continue
+            other = self.bottoms.get((rect.x, rect.width, rect.y + rect.height))
+            if other is not None:
+                new_rect = FreeRectangle(rect.width, rect.height + other.height,
+                                         rect.x, rect.y)
+            else:
+                other = self.tops.get((rect.x, rect.width, rect.y))
+                if other is not None:
+                    new_rect = FreeRectangle(rect.width, rect.height + other.height,
+                                             rect.x, other.y)
+                else:
+                    other = self.lefts.get((rect.y, rect.height, rect.x + rect.width))
+                    if other is not None:
+                        new_rect = FreeRectangle(rect.width + other.width, rect.height,
+                                                 rect.x, rect.y)
+                    else:
+                        other = self.rights.get((rect.y, rect.height, rect.x))
+                        if other is None:
+                            continue
+                        new_rect = FreeRectangle(rect.width + other.width, rect.height,
+                                                 other.x, rect.y)
+            self.remove(rect)
+            self.remove(other)
+            self.add(new_rect)
+            work.append(new_rect)
+            merged = True
+        if self.undo is not None and self.pending:
+            self.undo.append((self.pending.update, (list(self.pending),)))
+        self.pending.clear()
+        return merged
+
+
+class Guillotine(Transactional):
     def __init__(self, x: int = 8,
                  y: int = 4,
                  rotation: bool = True,
@@ -36,34 +290,58 @@ class Guillotine:
         self.rMerge = rectangle_merge
         self.split_heuristic = split_heuristic
 
-        if heuristic == 'best_area':
-            self._score = scoreBAF
-        elif heuristic == 'best_shortside':
-            self._score = scoreBSSF
-        elif heuristic == 'best_longside':
-            self._score = scoreBLSF
-        elif heuristic == 'worst_area':
-            self._score = scoreWAF
-        elif heuristic == 'worst_shortside':
-            self._score = scoreWSSF
-        elif heuristic == 'worst_longside':
-            self._score = scoreWLSF
-        else:
+        if heuristic not in HEURISTICS:
             raise ValueError('No such heuristic!')
+        self.heuristic = heuristic
+        self._score = HEURISTICS[heuristic]
 
         if x == 0 or y == 0:
-            #self.freerects = [] # type: List[FreeRectangle]
-            self.freerects = SortedListWithKey(iterable=None, key=lambda x: x.area)
+            self.freerects = [] # type: List[FreeRectangle]
         else:
-            self.freerects = SortedListWithKey([FreeRectangle(self.x, self.y, 0, 0)], key=lambda x: x.area)
+            self.freerects = [FreeRectangle(self.x, self.y, 0, 0)]
         self.items = [] # type: List[Item]
         self.rotation = rotation
+        self.known_fails = FailFrontier()
 
 
     def __repr__(self) -> str:
         return "Guillotine(%r)" % (self.items)
 
 
+    def __getstate__(self) -> dict:
+        """
+        The score function is resolved again from the heuristic
+        name on load, and freerects are stored as a plain list.
+        """
+        state = super().__getstate__()
+        del state['_score']
+        state['_freerects'] = list(self._freerects)
+        return state
+
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._score = HEURISTICS[self.heuristic]
+        self.freerects = state['_freerects']
+
+
+    @property
+    def freerects(self) -> FreeRectList:
+        return self._freerects
+
+
+    @freerects.setter
+    def freerects(self, rects: Iterable[FreeRectangle]) -> None:
+        """ Assigned rectangles are copied into a FreeRectList """
+        self._freerects = FreeRectList(rects)
+        self._freerects.undo = self._undo
+
+
+    def _set_undo(self, log: Optional[list]) -> None:
+        super()._set_undo(log)
+        self._freerects.undo = log
+
+
     @staticmethod
     def _item_fits_rect(item: Item,
                        rect: FreeRectangle,
@@ -143,56 +421,42 @@ class Guillotine:
         self.free_area -= item.area
 
 
-    def rectangle_merge(self) -> None:
+    def rectangle_merge(self) -> bool:
         """
         Rectangle Merge optimization
-        Finds pairs of free rectangles and merges them if they are mergable.
+        Merges free rectangles added since the last merge with
+        neighbours sharing a full side, until no more merges are
+        possible. Returns true if any rectangles were merged.
         """
-        for freerect in self.freerects:
-            widths_func = lambda r: (r.width == freerect.width and
-                                     r.x == freerect.x and r != freerect)
-            matching_widths = list(filter(widths_func, self.freerects))
-            heights_func = lambda r: (r.height == freerect.height and
-                                      r.y == freerect.y and r != freerect)
-            matching_heights = list(filter(heights_func, self.freerects))
-            if matching_widths:
-                widths_adjacent = list(filter(lambda r: r.y == freerect.y + freerect.height, matching_widths)) # type: List[FreeRectangle]
-
-                if widths_adjacent:
-                    match_rect = widths_adjacent[0]
-                    merged_rect = FreeRectangle(freerect.width,
-                                                freerect.height+match_rect.height,
-                                                freerect.x,
-                                                freerect.y)
-                    self.freerects.remove(freerect)
-                    self.freerects.remove(match_rect)
-                    self.freerects.add(merged_rect)
-
-            if matching_heights:
-                heights_adjacent = list(filter(lambda r: r.x == freerect.x + freerect.width, matching_heights))
-                if heights_adjacent:
-                    match_rect = heights_adjacent[0]
-                    merged_rect = FreeRectangle(freerect.width+match_rect.width,
-                                                freerect.height,
-                                                freerect.x,
-                                                freerect.y)
-                    self.freerects.remove(freerect)
-                    self.freerects.remove(match_rect)
-                    self.freerects.add(merged_rect)
+        return self.freerects.merge()
 
 
     def _find_best_score(self, item: Item):
-        rects = []
-        for rect in self.freerects:
-            if self._item_fits_rect(item, rect):
-                rects.append((self._score(rect, item), rect, False))
-            if self.rotation and self._item_fits_rect(item, rect, rotation=True):
-                rects.append((self._score(rect, item), rect, True))
-        try:
-            _score, rect, rot = min(rects, key=lambda x: x[0])
-            return _score, rect, rot
-        except ValueError:
+        """
+        Only free rectangles at least as large as the item are
+        visited, in area order. Area scores are decided by the
+        first area holding a fit, so best_area scans up and
+        worst_area scans down and both stop after that area.
+        Ties go to the first rectangle in area order, unrotated
+        fit first.
+        """
+        width, height = item.width, item.height
+        rotation = self.rotation
+        by_area = self.heuristic in ('best_area', 'worst_area')
+        reverse = self.heuristic == 'worst_area'
+        best = None
+        for rect in self.freerects.irange_key(min_key=item.area, reverse=reverse):
+            if by_area and best is not None and rect.area != best[1].area:
+                break
+            fits = width <= rect.width and height <= rect.height
+            if not (fits or (rotation and height <= rect.width and width <= rect.height)):
+                continue
+            score = self._score(rect, item)
+            if best is None or score < best[0] or (reverse and score == best[0]):
+                best = (score, rect, not fits)
+        if best is None:
             return None, None, False
+        return best
 
 
     def insert(self, item: Item, heuristic: str = 'best_area') -> bool:
@@ -201,17 +465,29 @@ class Guillotine:
         """
         _, best_rect, rotated = self._find_best_score(item)
         if best_rect:
+            self._log_insert(item)
             self._add_item(item, best_rect.x, best_rect.y, rotated)
             self.freerects.remove(best_rect)
             splits = self._split_free_rect(item, best_rect)
             for rect in splits:
                 self.freerects.add(rect)
-            if self.rMerge:
-                self.rectangle_merge()
+            # Merged rectangles can fit items that failed before
+            if self.rMerge and self.rectangle_merge():
+                self.known_fails.clear()
             return True
         return False
 
 
+    def free_space_summary(self) -> Tuple[int, int, int]:
+        """
+        Returns the largest free width, the largest free
+        height and the free area of the bin.
+        """
+        if not self.freerects:
+            return 0, 0, self.free_area
+        return self.freerects.widths[-1], self.freerects.heights[-1], self.free_area
+
+
     def bin_stats(self) -> dict:
         """
         Returns a dictionary with compiled stats on the bin tree
@@ -256,3 +532,13 @@ def scoreWSSF(rect: FreeRectangle, item: Item) -> Tuple[int, int]:
 def scoreWLSF(rect: FreeRectangle, item: Item) -> Tuple[int, int]:
     """ Worst Longside Fit """
     return (0 - max(rect.width-item.width, rect.height-item.height)), (0 - min(rect.width-item.width, rect.height-item.height))
+
+
+HEURISTICS = {
+    'best_area': scoreBAF,
+    'best_shortside': scoreBSSF,
+    'best_longside': scoreBLSF,
+    'worst_area': scoreWAF,
+    'worst_shortside': scoreWSSF,
+    'worst_longside': scoreWLSF,
+}
@@ -5,6 +5,8 @@ class Item:
     """
     Items class for rectangles inserted into sheets
     """
+    __slots__ = ('width', 'height', 'x', 'y', 'area', 'rotated', 'id')
+
     def __init__(self, width, height,
                  CornerPoint: tuple = (0, 0),
                  rotation: bool = True) -> None:
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+Item Store
+
+Columnar storage for large item sets. Widths, heights,
+positions, rotation flags and bin assignments are kept in
+typed arrays, and ItemView objects expose a single row
+through the Item interface so they can be handed to
+BinManager or any bin directly. Columns are exported as
+NumPy arrays without copying when NumPy is installed.
+"""
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+try:
+    import numpy as np # type: ignore
+except ImportError:
+    np = None
+
+
+def _int64_column(values: Any) -> array:
+    """
+    Copy a column into an int64 typed array, in bulk when the
+    values are a NumPy array or a contiguous 8 byte integer
+    buffer. Non-integer columns raise ValueError rather than
+    being truncated.
+    """
+    column = array('q')
+    if np is not None and isinstance(values, np.ndarray):
+        if not np.issubdtype(values.dtype, np.integer):
+            raise ValueError('Error! columns must be integers')
+        column.frombytes(memoryview(np.ascontiguousarray(values, dtype=np.int64)).cast('B'))
+        return column
+    try:
+        view = memoryview(values)
+    except TypeError:
+        view = None
+    if view is not None and view.format in ('q', 'l') and view.itemsize == 8 and view.c_contiguous:
+        column.frombytes(view.cast('B'))
+        return column
+    try:
+        column.extend(values if view is None else view.tolist())
+    except TypeError:
+        raise ValueError('Error! columns must be integers')
+    return column
+
+
+class ItemView:
+    """
+    Lightweight Item stand-in that reads and writes
+    one row of an ItemStore
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store: 'ItemStore', index: int) -> None:
+        self.store = store
+        self.index = index
+
+
+    def __repr__(self) -> str:
+        return 'Item(width=%r, height=%r, x=%r, y=%r)' % (self.width, self.height, self.x, self.y)
+
+
+    @property
+    def width(self) -> int:
+        return self.store.widths[self.index]
+
+
+    @width.setter
+    def width(self, value: int) -> None:
+        self.store.widths[self.index] = value
+
+
+    @property
+    def height(self) -> int:
+        return self.store.heights[self.index]
+
+
+    @height.setter
+    def height(self, value: int) -> None:
+        self.store.heights[self.index] = value
+
+
+    @property
+    def x(self) -> int:
+        return self.store.x[self.index]
+
+
+    @x.setter
+    def x(self, value: int) -> None:
+        self.store.x[self.index] = value
+
+
+    @property
+    def y(self) -> int:
+        return self.store.y[self.index]
+
+
+    @y.setter
+    def y(self, value: int) -> None:
+        self.store.y[self.index] = value
+
+
+    @property
+    def rotated(self) -> bool:
+        return bool(self.store.rotated[self.index])
+
+
+    @rotated.setter
+    def rotated(self, value: bool) -> None:
+        self.store.rotated[self.index] = value
+
+
+    @property
+    def area(self) -> int:
+        return self.store.widths[self.index] * self.store.heights[self.index]
+
+
+    @property
+    def id(self) -> int:
+        return self.store.ids[self.index]
+
+
+    @property
+    def bin_index(self) -> int:
+        return self.store.bins[self.index]
+
+
+    def rotate(self) -> None:
+        store, i = self.store, self.index
+        store.widths[i], store.heights[i] = store.heights[i], store.widths[i]
+        store.rotated[i] = not store.rotated[i]
+
+
+class ItemStore:
+    """
+    Struct-of-arrays item set. Unplaced items have
+    a bin index of -1.
+    """
+    def __init__(self, sizes: Iterable[Tuple[int, int]] = ()) -> None:
+        self.widths = array('q')
+        self.heights = array('q')
+        self.x = array('q')
+        self.y = array('q')
+        self.rotated = array('b')
+        self.bins = array('q')
+        self.ids = array('q')
+        self.extend(sizes)
+
+
+    def __repr__(self) -> str:
+        return "ItemStore(%r)" % (list(zip(self.widths, self.heights)))
+
+
+    def __len__(self) -> int:
+        return len(self.widths)
+
+
+    def __getitem__(self, index: int) -> ItemView:
+        if index < 0:
+            index += len(self.widths)
+        if not 0 <= index < len(self.widths):
+            raise IndexError('ItemStore index out of range')
+        return ItemView(self, index)
+
+
+    def __iter__(self) -> Iterator[ItemView]:
+        for i in range(len(self.widths)):
+            yield ItemView(self, i)
+
+
+    def append(self, width: int, height: int) -> int:
+        """ Add an item and return its row """
+        self.widths.append(width)
+        self.heights.append(height)
+        self.x.append(0)
+        self.y.append(0)
+        self.rotated.append(0)
+        self.bins.append(-1)
+        self.ids.append(len(self.ids))
+        return len(self.widths) - 1
+
+
+    def extend(self, sizes: Iterable[Tuple[int, int]]) -> None:
+        for width, height in sizes:
+            self.append(width, height)
+
+
+    def extend_arrays(self, widths: Any, heights: Any, ids: Any = None) -> None:
+        """
+        Append whole columns at once from NumPy arrays, typed
+        arrays or any other sequence of integers. Ids default
+        to the row numbers.
+        """
+        widths, heights = _int64_column(widths), _int64_column(heights)
+        if len(widths) != len(heights):
+            raise ValueError('Error! widths and heights differ in length')
+        start, count = len(self.widths), len(widths)
+        if ids is None:
+            ids = array('q', range(start, start + count))
+        else:
+            ids = _int64_column(ids)
+            if len(ids) != count:
+                raise ValueError('Error! ids and widths differ in length')
+        self.widths.extend(widths)
+        self.heights.extend(heights)
+        self.x.extend(array('q', bytes(8 * count)))
+        self.y.extend(array('q', bytes(8 * count)))
+        self.rotated.extend(array('b', bytes(count)))
+        self.bins.extend(array('q', [-1]) * count)
+        self.ids.extend(ids)
+
+
+    @classmethod
+    def from_arrays(cls, widths: Any, heights: Any, ids: Any = None) -> 'ItemStore':
+        """ Build a store from width and height columns """
+        store = cls()
+        store.extend_arrays(widths, heights, ids)
+        return store
+
+
+    def views(self) -> List[ItemView]:
+        """ Returns an ItemView for every row """
+        return [ItemView(self, i) for i in range(len(self.widths))]
+
+
+    def columns(self) -> Dict[str, Any]:
+        """
+        Returns each column by name. With NumPy installed the
+        columns are int64/bool arrays sharing the store's memory,
+        otherwise the underlying typed arrays are returned.
+        The store cannot grow while shared columns are alive.
+        """
+        names = ('widths', 'heights', 'x', 'y', 'rotated', 'bins', 'ids')
+        if np is None:
+            return {name: getattr(self, name) for name in names}
+        cols = {}
+        for name in names:
+            data = getattr(self, name)
+            if not len(data):
+                dtype = np.bool_ if name == 'rotated' else np.int64
+                cols[name] = np.zeros(0, dtype=dtype)
+            elif name == 'rotated':
+                cols[name] = np.frombuffer(data, dtype=np.int8).view(np.bool_)
+            else:
+                cols[name] = np.frombuffer(data, dtype=np.int64)
+        return cols
@@ -5,11 +5,31 @@ Maximal Rectangle 2D Bin Algorithm
 Solomon Bothwell
 ssbothwell@gmail.com
 """
+import bisect
 import typing
-from typing import List, Tuple, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 from functools import reduce
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+from sortedcontainers import SortedDict # type: ignore
 from .item import Item
+from .frontier import FailFrontier
+from .undo import Transactional
+
+try:
+    import numpy as np # type: ignore
+except ImportError:
+    np = None
+
+
+# Below this many free rectangles the Python loop beats
+# the fixed overhead of the numpy backend
+NUMPY_MIN_RECTS = 24
+
+# The spatial index splits each bin axis into this many cells
+GRID_CELLS = 8
+
+# Order keys deeper than this are renumbered after an insert
+KEY_DEPTH_LIMIT = 16
 
 
 class FreeRectangle(typing.NamedTuple('FreeRectangle', [('width', int), ('height', int), ('x', int), ('y', int)])):
@@ -19,47 +39,169 @@ class FreeRectangle(typing.NamedTuple('FreeRectangle', [('width', int), ('height
         return self.width*self.height
 
 
-class MaximalRectangle:
+class MaximalRectangle(Transactional):
     def __init__(self, x: int = 8,
                  y: int = 4,
                  rotation: bool = True,
-                 heuristic: str = 'best_area') -> None:
+                 heuristic: str = 'best_area',
+                 backend: str = 'python') -> None:
         self.x = x
         self.y = y
         self.area = self.x * self.y
         self.free_area = self.area
 
-        if heuristic == 'best_area':
-            self._score = scoreBAF
-        elif heuristic == 'best_shortside':
-            self._score = scoreBSSF
-        elif heuristic == 'best_longside':
-            self._score = scoreBLSF
-        elif heuristic == 'worst_area':
-            self._score = scoreWAF
-        elif heuristic == 'worst_shortside':
-            self._score = scoreWSSF
-        elif heuristic == 'worst_longside':
-            self._score = scoreWLSF
-        elif heuristic == 'bottom_left':
-            self._score = scoreBL
-        elif heuristic == 'contact_point':
-            self._score = scoreCP
-        else:
+        if heuristic not in HEURISTICS:
             raise ValueError('No such heuristic!')
-
+        self.heuristic = heuristic
+        self._score = HEURISTICS[heuristic]
+
+        if backend not in ('python', 'numpy'):
+            raise ValueError('No such backend!')
+        if backend == 'numpy' and np is None:
+            raise ImportError('The numpy backend requires numpy')
+        self.backend = backend
+        # (version, rectangle array) for the numpy backend
+        self._soa = None # type: Optional[tuple]
+
+        # Free rectangles are stored under order keys that sort
+        # in the same order as the original list, and indexed
+        # by the grid cells they cover
+        self._cell_w = max(1, -(-x // GRID_CELLS))
+        self._cell_h = max(1, -(-y // GRID_CELLS))
+        self._version = 0
+        self._cache = (-1, []) # type: Tuple[int, List[FreeRectangle]]
         if x == 0 or y == 0:
             self.freerects = [] # type: List[FreeRectangle]
         else:
             self.freerects = [FreeRectangle(self.x, self.y, 0, 0)] # type: List[FreeRectangle]
+        self._clean = True
         self.items = [] # type: List[Item]
+        # Placed item edges for contact_point, keyed by the
+        # edge's coordinate. Each maps to a sorted list of
+        # (start, end) spans, which never overlap since items
+        # don't.
+        self._left_edges = {} # type: Dict[int, List[Tuple[int, int]]]
+        self._right_edges = {} # type: Dict[int, List[Tuple[int, int]]]
+        self._bottom_edges = {} # type: Dict[int, List[Tuple[int, int]]]
+        self._top_edges = {} # type: Dict[int, List[Tuple[int, int]]]
         self.rotation = rotation
+        self.known_fails = FailFrontier()
 
 
     def __repr__(self) -> str:
         return "MaximalRectangle(%r)" % (self.items)
 
 
+    def __getstate__(self) -> dict:
+        """ The score function is resolved again by name on load """
+        state = super().__getstate__()
+        del state['_score']
+        state['_soa'] = None
+        state['_cache'] = (-1, [])
+        return state
+
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._score = HEURISTICS[self.heuristic]
+
+
+    @property
+    def freerects(self) -> List[FreeRectangle]:
+        """
+        Free rectangles in order. The list is a snapshot and
+        must not be modified; assign a new list instead.
+        """
+        version, rects = self._cache
+        if version != self._version:
+            rects = list(self._rects.values())
+            self._cache = (self._version, rects)
+        return rects
+
+
+    @freerects.setter
+    def freerects(self, rects: Iterable[FreeRectangle]) -> None:
+        self._rects = SortedDict()
+        self._grid = defaultdict(set) # type: typing.DefaultDict[tuple, set]
+        self._next_key = 0
+        self._version += 1
+        # Assigned lists may hold nested rectangles, so the
+        # next pruning pass checks every rectangle
+        self._clean = False
+        for rect in rects:
+            self._add_rect(rect)
+
+
+    def _cells(self, x1: int, y1: int, x2: int, y2: int) -> List[tuple]:
+        """
+        Returns the grid cells overlapping the box
+        from (x1, y1) to (x2, y2)
+        """
+        cw, ch = self._cell_w, self._cell_h
+        rows = range(y1 // ch, max(y2 - 1, y1) // ch + 1)
+        return [(cx, cy) for cx in range(x1 // cw, max(x2 - 1, x1) // cw + 1)
+                for cy in rows]
+
+
+    def _add_rect(self, rect: FreeRectangle, key: Optional[tuple] = None) -> tuple:
+        """
+        Store a free rectangle under an order key, appending
+        it after every other rectangle if no key is given
+        """
+        if key is None:
+            self._log(setattr, self, '_next_key', self._next_key)
+            key = (self._next_key,)
+            self._next_key += 1
+        self._log(self._discard_rect, key)
+        self._rects[key] = rect
+        grid = self._grid
+        for cell in self._cells(rect.x, rect.y, rect.x+rect.width, rect.y+rect.height):
+            grid[cell].add(key)
+        self._version += 1
+        return key
+
+
+    def _discard_rect(self, key: tuple) -> FreeRectangle:
+        rect = self._rects.pop(key)
+        self._log(self._add_rect, rect, key)
+        grid = self._grid
+        for cell in self._cells(rect.x, rect.y, rect.x+rect.width, rect.y+rect.height):
+            grid[cell].discard(key)
+        self._version += 1
+        return rect
+
+
+    def _key_of(self, rect: FreeRectangle) -> tuple:
+        """ Returns the key of the first free rectangle equal to rect """
+        cell = (rect.x // self._cell_w, rect.y // self._cell_h)
+        keys = [key for key in self._grid.get(cell, ()) if self._rects[key] == rect]
+        if keys:
+            return min(keys)
+        for key, value in self._rects.items():
+            if value == rect:
+                return key
+        raise ValueError('FreeRectangle not in bin')
+
+
+    def _relabel(self) -> None:
+        """ Renumber order keys once clipping has nested them deeply """
+        clean = self._clean
+        log = self._undo
+        if log is not None:
+            # The old structures are replaced, not changed, so
+            # putting them back reverts the whole renumbering
+            log.append((self._restore_rects, (self._rects, self._grid, self._next_key)))
+            self._undo = None
+        self.freerects = list(self._rects.values())
+        self._clean = clean
+        self._undo = log
+
+
+    def _restore_rects(self, rects: SortedDict, grid: dict, next_key: int) -> None:
+        self._rects, self._grid, self._next_key = rects, grid, next_key
+        self._version += 1
+
+
     @staticmethod
     def _item_fits_rect(item: Item,
                        rect: FreeRectangle,
@@ -201,45 +343,163 @@ class MaximalRectangle:
         return True
 
 
-    def _remove_redundent(self) -> List[FreeRectangle]:
+    def _remove_redundent(self, keys: Optional[Iterable[tuple]] = None) -> List[FreeRectangle]:
         """
         Remove all FreeRectangles full encapsulated
-        inside another FreeRectangle.
-        """
-        i = 0
-        while i < len(self.freerects):
-            j = i + 1
-            while j < len(self.freerects):
-                if self._encapsulates(self.freerects[j], self.freerects[i]):
-                    del self.freerects[i]
-                    i -= 1
+        inside another FreeRectangle. Of identical
+        FreeRectangles, the last in order is kept.
+
+        A rectangle can only be enclosed by rectangles covering
+        the grid cell of its lower left corner, so each check is
+        a single cell lookup. If keys are given only those
+        rectangles are checked, which is enough when the rest
+        are already free of nesting.
+        """
+        rects, grid = self._rects, self._grid
+        if keys is None:
+            keys = list(rects.keys())
+            self._log(setattr, self, '_clean', self._clean)
+            self._clean = True
+        cw, ch = self._cell_w, self._cell_h
+        redundant = []
+        for key in keys:
+            rect = rects.get(key)
+            if rect is None:
+                continue
+            for other in grid.get((rect.x // cw, rect.y // ch), ()):
+                if other == key:
+                    continue
+                outer = rects[other]
+                if (self._encapsulates(outer, rect) and
+                    (outer != rect or other > key)):
+                    redundant.append(key)
                     break
-                if self._encapsulates(self.freerects[i], self.freerects[j]):
-                    del self.freerects[j]
-                    j -= 1
-                j += 1
-            i += 1
+        for key in redundant:
+            self._discard_rect(key)
         return self.freerects
 
 
-    def _prune_overlaps(self, itemBounds: tuple) -> None:
+    def _prune_overlaps(self, itemBounds: tuple, new_keys: Optional[List[tuple]] = None) -> None:
         """
-        Loop through all FreeRectangles and prune
-        any overlapping the itemBounds
+        Clip every FreeRectangle overlapping the itemBounds.
+        Only rectangles sharing a grid cell with the item are
+        checked, and clipped pieces take their parent's place
+        in the order.
+
+        Pieces of a rectangle cannot enclose a rectangle that
+        was not nested before, so only the pieces and new_keys
+        (the split of the chosen rectangle) are checked for
+        containment.
         """
-        result = [] # type: List[FreeRectangle]
-        for rect in self.freerects:
+        new_keys = [] if new_keys is None else new_keys
+        rects, grid = self._rects, self._grid
+        candidates = set() # type: set
+        for cell in self._cells(*itemBounds):
+            candidates.update(grid.get(cell, ()))
+        depth = 0
+        for key in candidates:
+            rect = rects[key]
             if self._check_intersection(rect, itemBounds):
                 overlap = self._find_overlap(rect, itemBounds)
-                new_rects = self._clip_overlap(rect, overlap)
-                result += new_rects
-            else:
-                result.append(rect)
-        self.freerects = result
-        self._remove_redundent()
+                self._discard_rect(key)
+                for n, piece in enumerate(self._clip_overlap(rect, overlap)):
+                    new_keys.append(self._add_rect(piece, key + (n,)))
+                depth = max(depth, len(key) + 1)
+        if self._clean:
+            self._remove_redundent(new_keys)
+        else:
+            self._remove_redundent()
+        if depth > KEY_DEPTH_LIMIT:
+            self._relabel()
 
     
+    def _rect_arrays(self):
+        """
+        Returns the free rectangles as an (n, 4) array of
+        width, height, x, y columns. The array is rebuilt
+        only when the free rectangle list has changed.
+        """
+        soa = self._soa
+        if soa is None or soa[0] != self._version:
+            arr = np.array(self.freerects, dtype=np.int64).reshape(-1, 4)
+            soa = self._soa = (self._version, arr)
+        return soa[1]
+
+
+    def _index_edges(self, item: Item) -> None:
+        """ Add a placed item's sides to the edge index """
+        x1, y1 = item.x, item.y
+        x2, y2 = x1 + item.width, y1 + item.height
+        self._log(self._unindex_edges, x1, y1, x2, y2)
+        bisect.insort(self._left_edges.setdefault(x1, []), (y1, y2))
+        bisect.insort(self._right_edges.setdefault(x2, []), (y1, y2))
+        bisect.insort(self._bottom_edges.setdefault(y1, []), (x1, x2))
+        bisect.insort(self._top_edges.setdefault(y2, []), (x1, x2))
+
+
+    def _unindex_edges(self, x1: int, y1: int, x2: int, y2: int) -> None:
+        """ Drop a removed item's sides from the edge index """
+        for edges, key, span in ((self._left_edges, x1, (y1, y2)),
+                                 (self._right_edges, x2, (y1, y2)),
+                                 (self._bottom_edges, y1, (x1, x2)),
+                                 (self._top_edges, y2, (x1, x2))):
+            spans = edges[key]
+            spans.remove(span)
+            if not spans:
+                del edges[key]
+
+
+    def _contact_perimeter(self, x: int, y: int, width: int, height: int) -> int:
+        """
+        Returns the length of a box's perimeter touching the
+        bin walls or placed items. Only the item edges lying
+        on the box's four sides are visited.
+        """
+        perim = 0
+        if x == 0:
+            perim += height
+        if x + width == self.x:
+            perim += height
+        if y == 0:
+            perim += width
+        if y + height == self.y:
+            perim += width
+        perim += edge_contact(self._right_edges.get(x), y, y + height)
+        perim += edge_contact(self._left_edges.get(x + width), y, y + height)
+        perim += edge_contact(self._top_edges.get(y), x, x + width)
+        perim += edge_contact(self._bottom_edges.get(y + height), x, x + width)
+        return perim
+
+
+    def _find_best_score_numpy(self, item: Item):
+        """
+        Vectorized _find_best_score. Fit masks and scores for
+        every free rectangle are computed in one pass, and ties
+        are broken in list order with the unrotated fit first,
+        exactly like the pure-Python loop.
+        """
+        arr = self._rect_arrays()
+        W, H = arr[:, 0], arr[:, 1]
+        w, h = item.width, item.height
+        fits = (w <= W) & (h <= H)
+        fits_rot = (h <= W) & (w <= H)
+        cand = np.flatnonzero(fits | fits_rot)
+        if not len(cand):
+            return None, None, False
+        # Like the Python path, both orientations are scored
+        # with the unrotated item
+        s1, s2 = NUMPY_HEURISTICS[self.heuristic](arr[cand], item)
+        first = s1 == s1.min()
+        cand, s1, s2 = cand[first], s1[first], s2[first]
+        k = int(np.argmin(s2))
+        i = int(cand[k])
+        return (int(s1[k]), int(s2[k])), self.freerects[i], not bool(fits[i])
+
+
     def _find_best_score(self, item: Item):
+        if (self.backend == 'numpy' and self.heuristic in NUMPY_HEURISTICS and
+            len(self.freerects) >= NUMPY_MIN_RECTS):
+            return self._find_best_score_numpy(item)
         rects = []
         for rect in self.freerects:
             if self._item_fits_rect(item, rect):
@@ -260,21 +520,37 @@ class MaximalRectangle:
         _, best_rect, rotated = self._find_best_score(item)
 
         if best_rect:
+            self._log_insert(item)
             if rotated:
                 item.rotate()
             item.x, item.y = best_rect.x, best_rect.y
             self.items.append(item)
+            self._index_edges(item)
             self.free_area -= item.area
             maximals = self._split_rectangle(best_rect, item)
-            self.freerects.remove(best_rect)
-            self.freerects += maximals
+            self._discard_rect(self._key_of(best_rect))
+            new_keys = [self._add_rect(rect) for rect in maximals]
             itemBounds = self._item_bounds(item)
 
-            self._prune_overlaps(itemBounds)
+            self._prune_overlaps(itemBounds, new_keys)
             return True
         return False
 
 
+    def free_space_summary(self) -> Tuple[int, int, int]:
+        """
+        Returns the largest free width, the largest free
+        height and the free area of the bin.
+        """
+        max_width = max_height = 0
+        for rect in self.freerects:
+            if rect.width > max_width:
+                max_width = rect.width
+            if rect.height > max_height:
+                max_height = rect.height
+        return max_width, max_height, self.free_area
+
+
     def bin_stats(self) -> dict:
         """
         Returns a dictionary with compiled stats on the bin tree
@@ -336,19 +612,92 @@ def common_interval_length(Xstart: int, Xend: int,
         return 0
     return min(Xend, Yend) - max(Xstart, Ystart)
 
+def edge_contact(edges: Optional[List[Tuple[int, int]]],
+                 start: int, end: int) -> int:
+    """
+    Returns the total length of the sorted, non overlapping
+    edges shared with the interval from start to end
+    """
+    if not edges:
+        return 0
+    i = bisect.bisect_left(edges, (start,))
+    if i > 0:
+        i -= 1
+    total = 0
+    for Estart, Eend in edges[i:]:
+        if Estart >= end:
+            break
+        total += common_interval_length(Estart, Eend, start, end)
+    return total
+
+
 def scoreCP(rect: FreeRectangle, item: Item, self) -> int:
     """ Contact Point """
-    perim = 0
-    if rect.x == 0 or rect.x + item.width == self.x:
-        perim += item.height
-    if rect.y == 0 or rect.y + item.height == self.y:
-        perim += item.width
-
-    for itm in self.items:
-        if (itm.x == rect.x+rect.width or
-            itm.x+itm.width == rect.x):
-            perim += common_interval_length(itm.y, itm.y+itm.height, rect.y, rect.y+item.height)
-        if (itm.y == rect.y+rect.height or
-            item.y+itm.height == rect.y):
-            perim += common_interval_length(itm.x, itm.x+itm.width, rect.x, rect.x+item.width)
+    perim = self._contact_perimeter(rect.x, rect.y, item.width, item.height)
     return (0 - perim), min(rect.width-item.width, rect.height-item.height)
+
+
+HEURISTICS = {
+    'best_area': scoreBAF,
+    'best_shortside': scoreBSSF,
+    'best_longside': scoreBLSF,
+    'worst_area': scoreWAF,
+    'worst_shortside': scoreWSSF,
+    'worst_longside': scoreWLSF,
+    'bottom_left': scoreBL,
+    'contact_point': scoreCP,
+}
+
+
+def np_scoreBAF(rects, item: Item) -> tuple:
+    """ Vectorized Best Area Fit """
+    dw, dh = rects[:, 0] - item.width, rects[:, 1] - item.height
+    return rects[:, 0]*rects[:, 1] - item.area, np.minimum(dw, dh)
+
+
+def np_scoreBSSF(rects, item: Item) -> tuple:
+    """ Vectorized Best Short Side Fit """
+    dw, dh = rects[:, 0] - item.width, rects[:, 1] - item.height
+    return np.minimum(dw, dh), np.maximum(dw, dh)
+
+
+def np_scoreBLSF(rects, item: Item) -> tuple:
+    """ Vectorized Best Long Side Fit """
+    dw, dh = rects[:, 0] - item.width, rects[:, 1] - item.height
+    return np.maximum(dw, dh), np.minimum(dw, dh)
+
+
+def np_scoreWAF(rects, item: Item) -> tuple:
+    """ Vectorized Worst Area Fit """
+    s1, s2 = np_scoreBAF(rects, item)
+    return -s1, -s2
+
+
+def np_scoreWSSF(rects, item: Item) -> tuple:
+    """ Vectorized Worst Short Side Fit """
+    s1, s2 = np_scoreBSSF(rects, item)
+    return -s1, -s2
+
+
+def np_scoreWLSF(rects, item: Item) -> tuple:
+    """ Vectorized Worst Long Side Fit """
+    s1, s2 = np_scoreBLSF(rects, item)
+    return -s1, -s2
+
+
+def np_scoreBL(rects, item: Item) -> tuple:
+    """ Vectorized Bottom Left """
+    return rects[:, 3] + item.height, rects[:, 2]
+
+
+# Heuristics with a vectorized score. Others fall back
+# to the Python loop on the numpy backend.
+NUMPY_HEURISTICS = {
+    'best_area': np_scoreBAF,
+    'best_shortside': np_scoreBSSF,
+    'best_longside': np_scoreBLSF,
+    'worst_area': np_scoreWAF,
+    'worst_shortside': np_scoreWSSF,
+    'worst_longside': np_scoreWLSF,
+    'bottom_left': np_scoreBL,
+}
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Portfolio
+
+Packing quality varies drastically with the choice of algorithm,
+heuristic, split heuristic and sorting heuristic. A portfolio runs
+a list of BinManager configurations on the same items in a process
+pool and keeps the best result.
+"""
+import itertools
+import multiprocessing
+import time
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from . import bounds
+from .binmanager import BinManager
+from .item import Item
+
+
+# Placement of a single item: bin index, corner point and orientation
+Placement = NamedTuple('Placement', [('bin_index', int),
+                                     ('x', int),
+                                     ('y', int),
+                                     ('width', int),
+                                     ('height', int),
+                                     ('rotated', bool)])
+
+
+PortfolioResult = NamedTuple('PortfolioResult', [('config', dict),
+                                                 ('bin_count', int),
+                                                 ('efficiency', float),
+                                                 ('placements', List[Optional[Placement]])])
+
+
+HEURISTICS = {
+    'guillotine': ['best_area', 'best_shortside', 'best_longside',
+                   'worst_area', 'worst_shortside', 'worst_longside'],
+    'maximal_rectangle': ['best_area', 'best_shortside', 'best_longside',
+                          'worst_area', 'worst_shortside', 'worst_longside',
+                          'bottom_left', 'contact_point'],
+    'skyline': ['bottom_left', 'best_fit'],
+    'skyline_heightmap': ['bottom_left', 'best_fit'],
+    'shelf': ['next_fit', 'best_width_fit', 'best_height_fit', 'best_area_fit',
+              'worst_width_fit', 'worst_height_fit', 'worst_area_fit'],
+}
+
+
+SPLIT_HEURISTICS = ['default', 'SplitShorterLeftoverAxis', 'SplitLongerLeftoverAxis',
+                    'SplitMinimizeArea', 'SplitMaximizeArea',
+                    'SplitShorterAxis', 'SplitLongerAxis']
+
+
+def configurations(pack_algos: Iterable[str] = ('guillotine', 'maximal_rectangle',
+                                                'skyline', 'shelf'),
+                   sorting_heuristics: Iterable[str] = ('DESCA', 'DESCSS', 'DESCLS',
+                                                        'DESCPERIM'),
+                   bin_algos: Iterable[str] = ('bin_best_fit',)) -> List[dict]:
+    """
+    Returns BinManager keyword arguments for every combination of
+    the given algorithms, their heuristics and the sort orders.
+    """
+    configs = []
+    for pack_algo in pack_algos:
+        splits = SPLIT_HEURISTICS if pack_algo == 'guillotine' else ['default']
+        for bin_algo, heuristic, split, sort in itertools.product(bin_algos,
+                                                                  HEURISTICS[pack_algo],
+                                                                  splits,
+                                                                  sorting_heuristics):
+            configs.append({'pack_algo': pack_algo,
+                            'bin_algo': bin_algo,
+                            'heuristic': heuristic,
+                            'split_heuristic': split,
+                            'sorting_heuristic': sort})
+    return configs
+
+
+def _run_config(task: Tuple[int, int, int, List[Tuple[int, int]], dict]) -> Tuple[int, PortfolioResult]:
+    """
+    Worker process entry point. Packs the item sizes with one
+    configuration and returns the placements by item position.
+    """
+    index, bin_width, bin_height, sizes, config = task
+    items = [Item(width, height) for width, height in sizes]
+    M = BinManager(bin_width, bin_height, **config)
+    M.add_items(*items)
+    M.execute()
+
+    positions = {id(item): i for i, item in enumerate(items)}
+    placements = [None] * len(items) # type: List[Optional[Placement]]
+    packed_area = 0
+    for bin_index, binn in enumerate(M.bins):
+        for item in binn.items:
+            placements[positions[id(item)]] = Placement(bin_index, item.x, item.y,
+                                                        item.width, item.height,
+                                                        item.rotated)
+            packed_area += item.area
+    efficiency = packed_area / (len(M.bins) * bin_width * bin_height)
+    return index, PortfolioResult(config, len(M.bins), efficiency, placements)
+
+
+def _objective_key(objective: Union[str, Callable]) -> Callable:
+    if callable(objective):
+        return objective
+    if objective == 'bins':
+        return lambda r: (r.bin_count, -r.efficiency)
+    if objective == 'efficiency':
+        return lambda r: (-r.efficiency, r.bin_count)
+    raise ValueError('No such objective!')
+
+
+def run_portfolio(bin_width: int,
+                  bin_height: int,
+                  items: Sequence[Item],
+                  configs: Iterable[dict],
+                  objective: Union[str, Callable] = 'bins',
+                  processes: Optional[int] = None,
+                  time_budget: Optional[float] = None,
+                  lower_bound: Union[int, str, None] = None) -> Optional[PortfolioResult]:
+    """
+    Run every configuration on the items in a process pool and
+    return the best result by bin count ('bins'), packing
+    efficiency ('efficiency') or a callable key.
+
+    Stops early, terminating the remaining workers, when the
+    wall-clock time_budget (seconds) runs out or a result uses
+    no more than lower_bound bins. With lower_bound='auto' the
+    bound is computed with bounds.lower_bound, and no result
+    can do better once it is reached. The winning placements
+    are written back onto the items. Returns None if no
+    configuration finished within the budget.
+    """
+    key = _objective_key(objective)
+    sizes = [(item.width, item.height) for item in items]
+    tasks = [(i, bin_width, bin_height, sizes, dict(config))
+             for i, config in enumerate(configs)]
+    if not tasks:
+        return None
+    if lower_bound == 'auto':
+        # The bound must hold for every configuration
+        rotation = any(task[4].get('rotation', True) for task in tasks)
+        lower_bound = bounds.lower_bound(bin_width, bin_height,
+                                         [w for w, _ in sizes], [h for _, h in sizes],
+                                         rotation=rotation)
+
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    best = None # type: Optional[Tuple[Any, int, PortfolioResult]]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.imap_unordered(_run_config, tasks)
+        for _ in tasks:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            try:
+                index, result = results.next(timeout)
+            except multiprocessing.TimeoutError:
+                break
+            # Break ties in favour of earlier configurations
+            if best is None or (key(result), index) < best[:2]:
+                best = (key(result), index, result)
+            if lower_bound is not None and best[2].bin_count <= lower_bound:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if best is None:
+        return None
+    result = best[2]
+    for item, placement in zip(items, result.placements):
+        if placement is not None:
+            item.x, item.y = placement.x, placement.y
+            item.width, item.height = placement.width, placement.height
+            item.rotated = placement.rotated
+    return result
@@ -6,8 +6,11 @@ Solomon Bothwell
 ssbothwell@gmail.com
 """
 #from functools import reduce
-from typing import List, Tuple
+from typing import Iterator, List, Optional, Set, Tuple
+from sortedcontainers import SortedList # type: ignore
 from .item import Item
+from .frontier import FailFrontier
+from .undo import Transactional
 from . import guillotine
 
 
@@ -22,6 +25,10 @@ class Shelf:
         self.area = self.available_width * self.y
         self.vertical_offset = v_offset
         self.items = [] # type: List[Item]
+        # Floor-ceiling mode packs items right to left against
+        # the top of the shelf. The floor stops at ceiling_x.
+        self.ceiling_x = self.x
+        self.ceiling_items = [] # type: List[Item]
 
 
     def __repr__(self):
@@ -31,7 +38,7 @@ class Shelf:
 
     def insert(self, item: Item, rotation: bool=True) -> bool:
         if item.width <= self.available_width and item.height <= self.y:
-            item.x, item.y = (self.x - self.available_width, self.vertical_offset)
+            item.x, item.y = (self.ceiling_x - self.available_width, self.vertical_offset)
             self.items.append(item)
             self.available_width -= item.width
             self.area = self.available_width * self.y
@@ -40,7 +47,7 @@ class Shelf:
             if (item.height <= self.available_width and
                 item.width <= self.y):
                 item.rotate()
-                item.x, item.y = (self.x - self.available_width, self.vertical_offset)
+                item.x, item.y = (self.ceiling_x - self.available_width, self.vertical_offset)
                 self.items.append(item)
                 self.available_width -= item.width
                 self.area = self.available_width * self.y
@@ -48,13 +55,52 @@ class Shelf:
         return False
 
 
-class Sheet:
+    def fits_ceiling(self, width: int, height: int) -> bool:
+        """
+        Returns true if an item of the given size fits left
+        of the ceiling items without overlapping the floor
+        items below it.
+        """
+        if width > self.ceiling_x or height > self.y:
+            return False
+        left = self.ceiling_x - width
+        # Floor items are ordered left to right
+        for floor_item in reversed(self.items):
+            if floor_item.x + floor_item.width <= left:
+                break
+            if floor_item.height + height > self.y:
+                return False
+        return True
+
+
+    def insert_ceiling(self, item: Item, rotation: bool = True) -> bool:
+        """
+        Place the item right to left against the ceiling,
+        trying it unrotated first. The floor's available
+        width shrinks to the space left of the ceiling items.
+        """
+        if not self.fits_ceiling(item.width, item.height):
+            if not (rotation and self.fits_ceiling(item.height, item.width)):
+                return False
+            item.rotate()
+        item.x = self.ceiling_x - item.width
+        item.y = self.vertical_offset + self.y - item.height
+        self.ceiling_items.append(item)
+        floor_x = self.items[-1].x + self.items[-1].width if self.items else 0
+        self.ceiling_x = item.x
+        self.available_width = max(0, self.ceiling_x - floor_x)
+        self.area = self.available_width * self.y
+        return True
+
+
+class Sheet(Transactional):
     """
     Sheet class represents a sheet of material to be subdivided.
     Sheets hold a list of rows which hold a list of items.
     """
     def __init__(self, x: int, y: int, rotation: bool = True, 
-                 wastemap: bool = False, heuristic: str = 'best_area_fit') -> None:
+                 wastemap: bool = False, heuristic: str = 'best_area_fit',
+                 floor_ceiling: bool = False) -> None:
         self.x = x
         self.y = y
         self.available_height = self.y
@@ -63,43 +109,133 @@ class Sheet:
         self.area = self.x * self.y
         self.free_area = self.x * self.y
         self.rotation = rotation
+        self.known_fails = FailFrontier()
         self.use_waste_map = wastemap
         if self.use_waste_map:
             self.wastemap = guillotine.Guillotine(0, 0, rotation = self.rotation, heuristic='best_area')
 
-        if heuristic == 'best_width_fit':
-            self._score = scoreBWF
-        elif heuristic == 'best_height_fit':
-            self._score = scoreBHF
-        elif heuristic == 'best_area_fit':
-            self._score = scoreBAF
-        elif heuristic == 'worst_width_fit':
-            self._score = scoreWWF
-        elif heuristic == 'worst_height_fit':
-            self._score = scoreWHF
-        elif heuristic == 'worst_area_fit':
-            self._score = scoreWAF
-        elif heuristic == 'next_fit':
-            self._score = scoreNF
-        elif heuristic == 'first_fit':
-            self._score = scoreFF
-        else:
+        if heuristic not in HEURISTICS:
             raise ValueError('No such heuristic!')
+        self.heuristic = heuristic
+        self._score = HEURISTICS[heuristic]
+
+        # Open shelves, keyed by (height, available width,
+        # position), and their available widths. Full and
+        # closed shelves drop out.
+        self._by_height = SortedList()
+        self._widths = SortedList()
+        # Positions of shelves closed by _add_to_wastemap
+        self._closed = set() # type: Set[int]
+
+        # Items that fit no shelf floor are packed against the
+        # shelf ceilings. Unclosed shelves are keyed by (height,
+        # ceiling_x, position), and their ceiling_x values kept.
+        self.floor_ceiling = floor_ceiling
+        self._ceilings = SortedList()
+        self._ceiling_widths = SortedList()
 
     def __repr__(self) -> str:
         return "Sheet(width=%s, height=%s, available_height=%s, shelves=%s)" % (self.x, self.y, self.available_height, str(self.shelves))
 
 
+    def __getstate__(self) -> dict:
+        """ The score function is resolved again by name on load """
+        state = super().__getstate__()
+        del state['_score']
+        return state
+
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._score = HEURISTICS[self.heuristic]
+
+
+    def _set_undo(self, log: Optional[list]) -> None:
+        super()._set_undo(log)
+        if self.use_waste_map:
+            self.wastemap._set_undo(log)
+
+
+    def _log_shelf(self, position: int) -> None:
+        """ Log the state of the shelf at position before it changes """
+        if self._undo is not None:
+            shelf = self.shelves[position]
+            state = (shelf.available_width, shelf.area, shelf.ceiling_x,
+                     len(shelf.items), len(shelf.ceiling_items), position in self._closed)
+            self._undo.append((self._restore_shelf, (position, state)))
+
+
+    def _restore_shelf(self, position: int, state: tuple) -> None:
+        self._unindex_shelf(position)
+        shelf = self.shelves[position]
+        shelf.available_width, shelf.area, shelf.ceiling_x, items, ceiling_items, closed = state
+        del shelf.items[items:]
+        del shelf.ceiling_items[ceiling_items:]
+        if closed:
+            self._closed.add(position)
+        else:
+            self._closed.discard(position)
+        self._index_shelf(position)
+
+
+    def _remove_shelf(self, available_height: int) -> None:
+        """ Drop the newest shelf, reverting _create_shelf """
+        self._unindex_shelf(len(self.shelves) - 1)
+        self.shelves.pop()
+        self.available_height = available_height
+
+
+    def _index_shelf(self, position: int) -> None:
+        """ Index the shelf at position if it is still open """
+        shelf = self.shelves[position]
+        if position in self._closed:
+            return
+        if shelf.available_width > 0:
+            self._by_height.add((shelf.y, shelf.available_width, position))
+            self._widths.add(shelf.available_width)
+        if self.floor_ceiling and shelf.ceiling_x > 0:
+            self._ceilings.add((shelf.y, shelf.ceiling_x, position))
+            self._ceiling_widths.add(shelf.ceiling_x)
+
+
+    def _unindex_shelf(self, position: int) -> None:
+        shelf = self.shelves[position]
+        key = (shelf.y, shelf.available_width, position)
+        if key in self._by_height:
+            self._by_height.remove(key)
+            self._widths.remove(shelf.available_width)
+        key = (shelf.y, shelf.ceiling_x, position)
+        if key in self._ceilings:
+            self._ceilings.remove(key)
+            self._ceiling_widths.remove(shelf.ceiling_x)
+
+
+    def _position(self, shelf: Shelf) -> int:
+        """ Returns the shelf's position in self.shelves """
+        if self.shelves and self.shelves[-1] is shelf:
+            return len(self.shelves) - 1
+        return next(i for i, s in enumerate(self.shelves) if s is shelf)
+
+
     def _create_shelf(self, item: Item) -> bool:
-        if (self.rotation and item.height > item.width and
+        if self.rotation and item.width > self.x:
+            # Only fits the sheet on its side
+            item.rotate()
+        elif (self.rotation and item.height > item.width and
            item.height < self.x and item.width < self.y):
             item.rotate()
+        elif (self.rotation and item.height > self.available_height and
+              item.width <= self.available_height and item.height <= self.x):
+            # Only fits the remaining height on its side
+            item.rotate()
         if item.height <= self.available_height:
             v_offset = self.y - self.available_height
+            self._log(self._remove_shelf, self.available_height)
             new_shelf = Shelf(self.x, item.height, v_offset)
             self.shelves.append(new_shelf)
             self.available_height -= new_shelf.y
             new_shelf.insert(item)
+            self._index_shelf(len(self.shelves) - 1)
             self.items.append(item)
             self.free_area -= item.area
             return True
@@ -127,13 +263,18 @@ class Sheet:
         return False
 
 
-    def _add_to_shelf(self, item: Item, shelf: Shelf) -> bool:
+    def _add_to_shelf(self, item: Item, shelf: Shelf, position: Optional[int] = None) -> bool:
         """ Item insertion helper method for heuristic methods """
         if not self._item_fits_shelf(item, shelf):
             return False
         if self.rotation:
             self._rotate_to_shelf(item, shelf)
+        if position is None:
+            position = self._position(shelf)
+        self._log_shelf(position)
+        self._unindex_shelf(position)
         res = shelf.insert(item, self.rotation)
+        self._index_shelf(position)
         if res:
             self.items.append(item)
             self.free_area -= item.area
@@ -142,68 +283,159 @@ class Sheet:
 
 
     def _add_to_wastemap(self, shelf: Shelf) -> None:
-        """ Add lost space above items to the wastemap """
-        # Add space above items to wastemap
-        for item in shelf.items:
-            if item.height < shelf.y:
-                freeWidth = item.width
-                freeHeight = shelf.y - item.height
-                freeX = item.x
-                freeY = item.height + shelf.vertical_offset
-                freeRect = guillotine.FreeRectangle(freeWidth,
-                                                    freeHeight,
-                                                    freeX,
-                                                    freeY)
+        """
+        Add lost space above items to the wastemap and
+        close the shelf. Closed shelves are skipped, since
+        their waste is already in the wastemap.
+        """
+        position = self._position(shelf)
+        if position in self._closed:
+            return
+        self._log_shelf(position)
+        self._unindex_shelf(position)
+        self._closed.add(position)
+        # Split the shelf at every item edge. Each piece is
+        # free from the top of its floor item, if any, to the
+        # bottom of its ceiling item, if any.
+        floor = [(i.x, i.x + i.width, i.height) for i in shelf.items]
+        ceiling = [(i.x, i.x + i.width, i.height) for i in reversed(shelf.ceiling_items)]
+        edges = sorted({0, shelf.x}.union(*[(left, right) for left, right, _ in floor + ceiling]))
+        f = c = 0
+        for left, right in zip(edges, edges[1:]):
+            while f < len(floor) and floor[f][1] <= left:
+                f += 1
+            while c < len(ceiling) and ceiling[c][1] <= left:
+                c += 1
+            bottom = floor[f][2] if f < len(floor) and floor[f][0] <= left else 0
+            top = shelf.y
+            if c < len(ceiling) and ceiling[c][0] <= left:
+                top -= ceiling[c][2]
+            if top > bottom:
+                freeRect = guillotine.FreeRectangle(right - left,
+                                                    top - bottom,
+                                                    left,
+                                                    shelf.vertical_offset + bottom)
                 self.wastemap.freerects.add(freeRect)
-        # Move remaining shelf width to wastemap
-        if shelf.available_width > 0:
-            freeWidth = shelf.available_width
-            freeHeight = shelf.y
-            freeX = self.x - shelf.available_width
-            freeY = shelf.vertical_offset
-            freeRect = guillotine.FreeRectangle(freeWidth,
-                                                freeHeight,
-                                                freeX,
-                                                freeY)
-            self.wastemap.freerects.add(freeRect)
         # Close Shelf
         shelf.available_width = 0
         # Merge rectangles in wastemap
         self.wastemap.rectangle_merge()
+        # Space above the shelf's items is now usable
+        self.known_fails.clear()
 
 
     def _find_best_score(self, item: Item) -> Tuple[int, Shelf, bool]:
         """
-        Score all the shelves and return the best
-        one in a tuple with its score and if the item
-        needs to be rotated. If the bin has no shelves
-        and the item fits the available space, then
-        give it a max score (0) with no shelves.
+        Find the best open shelf and return it in a tuple
+        with its score and if the item needs to be rotated.
+        If the bin has no shelves and the item fits the
+        available space, then give it a max score (0) with
+        no shelves.
         """
-        shelves = []
         if not self.shelves:
-            return 0, None, False
-        for shelf in self.shelves:
-            if self._item_fits_shelf(item, shelf):
-                shelves.append((self._score(shelf, item, self), shelf, False))
-            if self._item_fits_shelf(item, shelf, rotation=True):
-                shelves.append((self._score(shelf, item, self), shelf, True))
-
+            return (0, 0), None, False
+        _score, position, rot = self._best_shelf(item)
+        if position is None and self.floor_ceiling:
+            ceiling = self._best_ceiling(item)
+            if ceiling is not None:
+                # Ceiling space is otherwise lost, so it scores
+                # like a new shelf
+                return (0, 0), self.shelves[ceiling[0]], ceiling[1]
+        if position is None:
+            return _score, None, rot
+        return _score, self.shelves[position], rot
+
+
+    def _best_shelf(self, item: Item) -> Tuple[int, Optional[int], bool]:
+        """
+        Returns the best (score, position, rotation) over
+        the open shelves. Ties go to the lowest position,
+        unrotated first. Like the scoring functions, a
+        rotated fit is scored with the unrotated item.
+        """
+        w, h = item.width, item.height
+        # (minimum height, minimum available width, rotation)
+        fits = [(h, w, False)]
+        if self.rotation:
+            fits.append((w, h, True))
+
+        best = None
+        if self.heuristic not in ('next_fit', 'first_fit'):
+            # Within a height band every score improves as the
+            # available width shrinks, or grows for the worst
+            # fits, so each band has one candidate
+            widest = self.heuristic.startswith('worst')
+            for min_y, min_width, rot in fits:
+                for key in shelf_bands(self._by_height, min_y, min_width, widest):
+                    position = key[2]
+                    candidate = (self._score(self.shelves[position], item, self), position, rot)
+                    if best is None or candidate < best:
+                        best = candidate
+                    if self.heuristic == 'best_height_fit':
+                        # Higher bands score worse
+                        break
+        else:
+            # next_fit and first_fit take the first open shelf
+            # the item fits
+            for position, shelf in enumerate(self.shelves):
+                if shelf.available_width == 0 or position in self._closed:
+                    continue
+                for min_y, min_width, rot in fits:
+                    if shelf.y >= min_y and shelf.available_width >= min_width:
+                        best = ((0, 0), position, rot)
+                        break
+                if best:
+                    break
+
+        if best:
+            return best
         # Give max score if item fits sheet but there are no shelves
-        if not shelves and self.available_height >= item.height:
-            shelves.append(((0, 0), None, False))
-        if not shelves and self.available_height >= item.width and self.rotation:
-            shelves.append(((0, 0), None, True))
+        if self.available_height >= item.height and self.x >= item.width:
+            return (0, 0), None, False
+        if self.available_height >= item.width and self.x >= item.height and self.rotation:
+            return (0, 0), None, True
+        return None, None, False
 
-        try:
-            _score, shelf, rot = min(shelves, key=lambda x: x[0])
-            return _score, shelf, rot
-        except ValueError:
-            return None, None, False
+
+    def _best_ceiling(self, item: Item) -> Optional[Tuple[int, bool]]:
+        """
+        Returns the (position, rotation) of the unclosed
+        shelf whose ceiling fits the item with the least
+        width left over. Ties go to the lowest position,
+        unrotated first.
+        """
+        options = [(item.width, item.height, False)]
+        if self.rotation:
+            options.append((item.height, item.width, True))
+        best = None
+        for y, ceiling_x, position in self._ceilings.irange((min(item.width, item.height),)):
+            shelf = self.shelves[position]
+            for width, height, rot in options:
+                if (width <= ceiling_x and height <= y and
+                    shelf.fits_ceiling(width, height)):
+                    candidate = (ceiling_x - width, position, rot)
+                    if best is None or candidate < best:
+                        best = candidate
+        if best is None:
+            return None
+        return best[1], best[2]
+
+
+    def _add_to_ceiling(self, item: Item, position: int, rotated: bool) -> None:
+        if rotated:
+            item.rotate()
+        self._log_shelf(position)
+        self._unindex_shelf(position)
+        self.shelves[position].insert_ceiling(item, rotation=False)
+        self._index_shelf(position)
+        self.items.append(item)
+        self.free_area -= item.area
 
 
     def insert(self, item: Item, heuristic: 'str' = 'best_width') -> bool:
-        if (item.width <= self.x and item.height <= self.y):
+        self._log_insert(item)
+        if ((item.width <= self.x and item.height <= self.y) or
+            (self.rotation and item.height <= self.x and item.width <= self.y)):
             # 1) If there are no shelves, create one and insert the item
             if not self.shelves:
                 return self._create_shelf(item)
@@ -214,19 +446,23 @@ class Sheet:
                 if res:
                     self.items.append(item)
                     self.free_area -= item.area
+                    # The wastemap may have merged rectangles
+                    self.known_fails.clear()
                     return True
 
             # 3) Try the desired heuristic
-            if heuristic == 'first_fit':
-                res = self.first_fit(item)
-                if res:
-                    return True
-            else:
-                _, best_shelf, rotated = self._find_best_score(item)
-                if best_shelf:
-                    if rotated:
-                        item.rotate()
-                    self._add_to_shelf(item, best_shelf)
+            _, position, rotated = self._best_shelf(item)
+            if position is not None:
+                if rotated:
+                    item.rotate()
+                self._add_to_shelf(item, self.shelves[position], position)
+                return True
+
+            # 3b) In floor-ceiling mode try the shelf ceilings
+            if self.floor_ceiling:
+                ceiling = self._best_ceiling(item)
+                if ceiling is not None:
+                    self._add_to_ceiling(item, *ceiling)
                     return True
 
             # 4) If the item didn't fit then close the shelf
@@ -239,6 +475,8 @@ class Sheet:
                 if res:
                     self.items.append(item)
                     self.free_area -= item.area
+                    # The wastemap may have merged rectangles
+                    self.known_fails.clear()
                     return True
             # 6) Attempt to create a new shelf for the item
             return self._create_shelf(item)
@@ -246,6 +484,30 @@ class Sheet:
         return False
 
 
+    def free_space_summary(self) -> Tuple[int, int, int]:
+        """
+        Returns the largest free width, the largest free
+        height and the free area of the sheet, counting
+        open shelves, the space for a new shelf and the
+        wastemap.
+        """
+        max_width = max_height = 0
+        if self.available_height > 0:
+            max_width = self.x
+            max_height = self.available_height
+        if self._widths:
+            max_width = max(max_width, self._widths[-1])
+            max_height = max(max_height, self._by_height[-1][0])
+        if self._ceilings:
+            max_width = max(max_width, self._ceiling_widths[-1])
+            max_height = max(max_height, self._ceilings[-1][0])
+        if self.use_waste_map:
+            waste_width, waste_height, _ = self.wastemap.free_space_summary()
+            max_width = max(max_width, waste_width)
+            max_height = max(max_height, waste_height)
+        return max_width, max_height, self.free_area
+
+
     def bin_stats(self) -> dict:
         """
         Returns a dictionary with compiled stats on the bin tree
@@ -262,6 +524,32 @@ class Sheet:
         return stats
 
 
+def shelf_bands(keys: SortedList,
+                min_y: int,
+                min_width: int,
+                widest: bool = False) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yields, for each band of (height, available width,
+    position) keys sharing a height of at least min_y, the
+    key with the narrowest (or widest) available width of
+    at least min_width. Ties go to the lowest position.
+    Bands are visited from the lowest height.
+    """
+    i = keys.bisect_left((min_y,))
+    while i < len(keys):
+        y = keys[i][0]
+        end = keys.bisect_right((y, float('inf')))
+        if widest:
+            width = keys[end-1][1]
+            if width >= min_width:
+                yield keys[keys.bisect_left((y, width))]
+        else:
+            j = keys.bisect_left((y, min_width))
+            if j < end:
+                yield keys[j]
+        i = end
+
+
 def scoreBAF(shelf: Shelf, item: Item, self=None) -> Tuple[int, int]:
     """ Best Area Fit """
     return (shelf.available_width - item.width)*shelf.y, shelf.available_width - item.width
@@ -312,3 +600,15 @@ def scoreNF(shelf: Shelf, item: Item, self=None) -> Tuple[int, Shelf, bool]:
         if self.rotation and self._item_fits_shelf(item, open_shelf, True):
             return (0, open_shelf, True)
     return (0, None, False)
+
+
+HEURISTICS = {
+    'best_width_fit': scoreBWF,
+    'best_height_fit': scoreBHF,
+    'best_area_fit': scoreBAF,
+    'worst_width_fit': scoreWWF,
+    'worst_height_fit': scoreWHF,
+    'worst_area_fit': scoreWAF,
+    'next_fit': scoreNF,
+    'first_fit': scoreFF,
+}
@@ -5,11 +5,19 @@ Skyline 2D Bin Algorithm
 Solomon Bothwell
 ssbothwell@gmail.com
 """
-from typing import List, NamedTuple, Tuple
+from collections import deque
+from typing import Any, List, NamedTuple, Optional, Tuple
 from sortedcontainers import SortedList
 
 from . import guillotine
 from .item import Item
+from .frontier import FailFrontier
+from .undo import Transactional
+
+try:
+    import numpy as np # type: ignore
+except ImportError:
+    np = None
 
 
 SkylineSegment = NamedTuple('SkylineSegment', [('x', int),
@@ -17,7 +25,7 @@ SkylineSegment = NamedTuple('SkylineSegment', [('x', int),
                                                ('width', int)])
 
 
-class Skyline:
+class Skyline(Transactional):
     def __init__(self, width: int = 8,
                  height: int = 4,
                  rotation: bool = True,
@@ -31,23 +39,39 @@ class Skyline:
         self.area = self.width * self.height
         self.free_area = self.width * self.height
         self.rotation = rotation
+        self.known_fails = FailFrontier()
         self.use_waste_map = wastemap
         if self.use_waste_map:
             self.wastemap = guillotine.Guillotine(0, 0, rotation=self.rotation, heuristic='best_area')
 
-        self.heuristic = heuristic
-        if heuristic == 'bottom_left':
-            self._score = scoreBL
-        elif heuristic == 'best_fit':
-            self._score = scoreBF
-        else:
+        if heuristic not in HEURISTICS:
             raise ValueError('No such heuristic!')
+        self.heuristic = heuristic
+        self._score = HEURISTICS[heuristic]
 
 
     def __repr__(self) -> str:
         return "Skyline(%r)" % (self.items)
 
 
+    def __getstate__(self) -> dict:
+        """ The score function is resolved again by name on load """
+        state = super().__getstate__()
+        del state['_score']
+        return state
+
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._score = HEURISTICS[self.heuristic]
+
+
+    def _set_undo(self, log: Optional[list]) -> None:
+        super()._set_undo(log)
+        if self.use_waste_map:
+            self.wastemap._set_undo(log)
+
+
     @staticmethod
     def _clip_segment(segment: SkylineSegment, item: Item) -> List[SkylineSegment]:
         """
@@ -89,24 +113,57 @@ class Skyline:
 
     def _update_segment(self, segment: SkylineSegment, y:int, item: Item) -> List[SkylineSegment]:
         """
-        Clips the line segment under the new item and returns
-        an updated skyline segment list.
+        Clips the line segments under the new item in place
+        and returns the updated skyline segment list. Only the
+        segments the item covers are touched, and the new
+        segment above the item is merged with its neighbours.
         """
+        skyline = self.skyline
+        seg_i = skyline.index(segment)
         if self.use_waste_map:
-            seg_i = self.skyline.index(segment)
             self._add_to_wastemap(seg_i, item, y)
 
-        new_segments = SortedList([])
-        for seg in self.skyline:
-            new_segments.update(self._clip_segment(seg, item))
+        # Segments under the item start at segment, which
+        # shares the item's left edge
+        item_right = item.x + item.width
+        end = seg_i
+        for seg in skyline.islice(seg_i):
+            if seg.x >= item_right:
+                break
+            end += 1
+        last = skyline[end-1]
+        self._log(skyline.update, skyline[seg_i:end])
+        del skyline[seg_i:end]
+        if last.x + last.width > item_right:
+            self._add_segment(SkylineSegment(item_right, last.y,
+                                             last.x + last.width - item_right))
 
         # Create new segment if room above item
         if item.height + item.y < self.height:
             new_seg_y = item.y + item.height
-            new_seg = SkylineSegment(segment.x, new_seg_y, item.width)
-            new_segments.add(new_seg)
-       
-        return new_segments
+            left, right = segment.x, segment.x + item.width
+            i = skyline.bisect_left(SkylineSegment(left, new_seg_y, 0))
+            if i > 0:
+                prev = skyline[i-1]
+                if prev.y == new_seg_y and prev.x + prev.width == left:
+                    left = prev.x
+                    self._log(skyline.add, prev)
+                    del skyline[i-1]
+                    i -= 1
+            if i < len(skyline):
+                nxt = skyline[i]
+                if nxt.y == new_seg_y and nxt.x == right:
+                    right = nxt.x + nxt.width
+                    self._log(skyline.add, nxt)
+                    del skyline[i]
+            self._add_segment(SkylineSegment(left, new_seg_y, right - left))
+
+        return skyline
+
+
+    def _add_segment(self, segment: SkylineSegment) -> None:
+        self._log(self.skyline.remove, segment)
+        self.skyline.add(segment)
 
 
     def _merge_segments(self) -> None:
@@ -124,6 +181,7 @@ class Skyline:
                 continue
             new_segments.add(seg)
 
+        self._log(setattr, self, 'skyline', self.skyline)
         self.skyline = new_segments
 
 
@@ -133,7 +191,8 @@ class Skyline:
         """
         Returns true if the item will fit above the skyline
         segment sky_index. Also works if the item is wider 
-        then the segment.
+        then the segment. Gaps left where items reach the top
+        of the bin block the item.
         """
         i = sky_index
         x = self.skyline[i].x
@@ -153,9 +212,64 @@ class Skyline:
             i += 1
             if width > 0 and i == len(self.skyline):
                 return (False, None)
+            if width > 0 and self.skyline[i].x != self.skyline[i-1].x + self.skyline[i-1].width:
+                return (False, None)
         return (True, y)
 
 
+    def _resting_heights(self, segs: List[SkylineSegment],
+                         item_width: int,
+                         item_height: int,
+                         waste: bool = False) -> List[Optional[Tuple[int, int]]]:
+        """
+        Returns the (y, wasted area) of an item resting on
+        each segment of segs, or None where it doesn't fit.
+        Matches _check_fit and calc_waste for every segment
+        in one pass: the segments under the item form a
+        window whose ends only move right, and a monotonic
+        deque holds the window's highest segment. Wasted area
+        comes from prefix sums of segment width * y.
+        """
+        n = len(segs)
+        results = [None] * n # type: List[Optional[Tuple[int, int]]]
+        prefix = [0]
+        if waste:
+            for seg in segs:
+                prefix.append(prefix[-1] + seg.width * seg.y)
+        start = 0
+        while start < n:
+            # Windows can't cross a gap, so each contiguous
+            # run of segments is a separate pass
+            end = start + 1
+            while end < n and segs[end].x == segs[end-1].x + segs[end-1].width:
+                end += 1
+            run_right = segs[end-1].x + segs[end-1].width
+            window = deque() # type: deque
+            j = start
+            for i in range(start, end):
+                right = segs[i].x + item_width
+                if right > self.width or right > run_right:
+                    break
+                while j < end and (j <= i or segs[j].x < right):
+                    while window and segs[window[-1]].y <= segs[j].y:
+                        window.pop()
+                    window.append(j)
+                    j += 1
+                while window[0] < i:
+                    window.popleft()
+                y = segs[window[0]].y
+                if y + item_height > self.height:
+                    continue
+                wasted = 0
+                if waste:
+                    last = segs[j-1]
+                    wasted = (y * item_width - (prefix[j-1] - prefix[i]) -
+                              (right - last.x) * last.y)
+                results[i] = (y, wasted)
+            start = end
+        return results
+
+
     def _add_to_wastemap(self, seg_index: int,
                         item: Item, 
                         y: int) -> bool:
@@ -167,7 +281,7 @@ class Skyline:
         # New node edges
         item_left = self.skyline[seg_index].x
         item_right = item_left + item.width
-        for seg in self.skyline[seg_index:]:
+        for seg in self.skyline.islice(seg_index):
             if seg.x >= item_right or seg.x + seg.width <= item_left:
                 break
             left_side = seg.x
@@ -183,26 +297,39 @@ class Skyline:
                                                       w_x,
                                                       w_y)
                 self.wastemap.freerects.add(waste_rect)
-                self.wastemap.rectangle_merge()
+                if self.wastemap.rectangle_merge():
+                    self.known_fails.clear()
             
 
     def _find_best_score(self, item: Item) -> Tuple[int, SkylineSegment, int, bool]:
-        segs = []
-        for i, segment in enumerate(self.skyline):
-            fits, y = self._check_fit(item.width, item.height, i)
-            if fits: 
-                score = self._score(self.skyline, item, y, i)
-                segs.append((score, segment, y, False))
-            if self.rotation:
-                fits, y = self._check_fit(item.height, item.width, i)
-                if fits:
-                    score = self._score(self.skyline, item, y, i, rotation=True)
-                    segs.append((score, segment, y, True))
-        try:
-            _score, seg, y, rot = min(segs, key=lambda x: x[0])
-            return _score, seg, rot, y
-        except ValueError:
+        """
+        Scores every segment in both orientations from one
+        _resting_heights pass each, computing the same scores
+        as scoreBL and scoreBF. Ties go to the leftmost
+        segment, unrotated first.
+        """
+        segs = list(self.skyline)
+        best_fit = self.heuristic == 'best_fit'
+        options = [(item.width, item.height, False)]
+        if self.rotation:
+            options.append((item.height, item.width, True))
+        fits = [self._resting_heights(segs, width, height, waste=best_fit)
+                for width, height, _ in options]
+        best = None
+        for i, seg in enumerate(segs):
+            for (width, height, rot), fit in zip(options, fits):
+                if fit[i] is None:
+                    continue
+                y, wasted = fit[i]
+                if best_fit:
+                    score = (wasted, height + y)
+                else:
+                    score = (height + y, seg.width)
+                if best is None or score < best[0]:
+                    best = (score, seg, rot, y)
+        if best is None:
             return None, None, None, False
+        return best
 
 
     def insert(self, item: Item,
@@ -210,11 +337,14 @@ class Skyline:
         """
         Wrapper for insertion heuristics
         """
-        if self.wastemap:
+        self._log_insert(item)
+        if self.use_waste_map:
             res = self.wastemap.insert(item, heuristic='best_area')
             if res:
                 self.items.append(item)
                 self.free_area -= item.width * item.height
+                # The wastemap may have merged rectangles
+                self.known_fails.clear()
                 return True
 
         _, best_seg, rotation, best_y = self._find_best_score(item)
@@ -224,12 +354,35 @@ class Skyline:
             item.x, item.y = (best_seg.x, best_y)
             self.items.append(item)
             self.free_area -= item.width * item.height
-            self.skyline = self._update_segment(best_seg, best_y, item)
-            self._merge_segments()
+            self._update_segment(best_seg, best_y, item)
             return True
         return False
 
 
+    def free_space_summary(self) -> Tuple[int, int, int]:
+        """
+        Returns the largest free width, the largest free
+        height and the free area of the bin. The widest
+        opening is the longest run of adjacent segments.
+        """
+        max_width = run = end = 0
+        min_y = self.height
+        for seg in self.skyline:
+            # Gaps left where items reach the top end a run
+            if seg.x != end:
+                run = 0
+            run += seg.width
+            end = seg.x + seg.width
+            max_width = max(max_width, run)
+            min_y = min(min_y, seg.y)
+        max_height = self.height - min_y
+        if self.use_waste_map:
+            waste_width, waste_height, _ = self.wastemap.free_space_summary()
+            max_width = max(max_width, waste_width)
+            max_height = max(max_height, waste_height)
+        return max_width, max_height, self.free_area
+
+
     def bin_stats(self) -> dict:
         """
         Returns a dictionary with compiled stats on the bin tree
@@ -246,6 +399,253 @@ class Skyline:
         return stats
 
 
+class HeightmapSkyline(Transactional):
+    """
+    Skyline stored as a dense array of column heights, for
+    bins with integer dimensions. The resting height at
+    every x position is found at once with a vectorized
+    rolling max, and items are placed at the left ends of
+    the skyline's flat runs, the same candidates as Skyline,
+    so placements match the segment list version. Requires
+    numpy.
+    """
+    def __init__(self, width: int = 8,
+                 height: int = 4,
+                 rotation: bool = True,
+                 wastemap: bool = True,
+                 heuristic: str = 'bottom_left') -> None:
+        if np is None:
+            raise ImportError('HeightmapSkyline requires numpy')
+        if heuristic not in HEURISTICS:
+            raise ValueError('No such heuristic!')
+        self.width = width
+        self.height = height
+        self.heights = np.zeros(width, dtype=np.int64)
+        self.items = [] # type: List[Item]
+        self.area = self.width * self.height
+        self.free_area = self.width * self.height
+        self.rotation = rotation
+        self.known_fails = FailFrontier()
+        self.use_waste_map = wastemap
+        if self.use_waste_map:
+            self.wastemap = guillotine.Guillotine(0, 0, rotation=self.rotation, heuristic='best_area')
+        self.heuristic = heuristic
+        # Bumped whenever the height map changes. BinManager
+        # scores an item before inserting it, so the runs and
+        # the last score are reused until then.
+        self._version = 0
+        self._run_cache = (-1, None, None) # type: Tuple[int, Any, Any]
+        self._score_cache = (None, None) # type: Tuple[Any, Any]
+        # Whether any column is filled to the top of the bin
+        self._filled = False
+
+
+    def __repr__(self) -> str:
+        return "HeightmapSkyline(%r)" % (self.items)
+
+
+    def _set_undo(self, log: Optional[list]) -> None:
+        super()._set_undo(log)
+        if self.use_waste_map:
+            self.wastemap._set_undo(log)
+
+
+    def _restore_heights(self, x: int, heights: Any, filled: bool) -> None:
+        self.heights[x:x+len(heights)] = heights
+        self._filled = filled
+        self._version += 1
+
+
+    @property
+    def skyline(self) -> List[SkylineSegment]:
+        """
+        The height map as skyline segments. Columns filled
+        to the top of the bin are gaps, as in Skyline.
+        """
+        starts, widths = self._runs()
+        return [SkylineSegment(int(x), int(self.heights[x]), int(w))
+                for x, w in zip(starts, widths)]
+
+
+    def _runs(self) -> Tuple[Any, Any]:
+        """
+        Returns the start columns and widths of the flat
+        runs below the top of the bin, in ascending order.
+        """
+        if self._run_cache[0] == self._version:
+            return self._run_cache[1:]
+        heights = self.heights
+        change = np.empty(self.width, dtype=bool)
+        change[:1] = True
+        np.not_equal(heights[1:], heights[:-1], out=change[1:])
+        starts = np.flatnonzero(change)
+        widths = np.empty_like(starts)
+        np.subtract(starts[1:], starts[:-1], out=widths[:-1])
+        widths[-1] = self.width - starts[-1]
+        open_runs = heights[starts] < self.height
+        self._run_cache = (self._version, starts[open_runs], widths[open_runs])
+        return self._run_cache[1:]
+
+
+    def _best_position(self, starts: Any,
+                       widths: Any,
+                       item_width: int,
+                       item_height: int) -> Optional[Tuple[Tuple[int, int], int, int]]:
+        """
+        Returns the best (score, x, y) for an item of the
+        given size resting on one of the runs, or None if
+        it fits nowhere. Ties go to the leftmost run.
+        """
+        if item_width > self.width:
+            return None
+        inside = starts + item_width <= self.width
+        xs, run_widths = starts[inside], widths[inside]
+        ys = rolling_max(self.heights, item_width)[xs]
+        fits = ys + item_height <= self.height
+        if not fits.any():
+            return None
+        xs, run_widths, ys = xs[fits], run_widths[fits], ys[fits]
+        if self.heuristic == 'best_fit':
+            sums = np.concatenate(([0], np.cumsum(self.heights)))
+            wasted = ys * item_width - (sums[xs + item_width] - sums[xs])
+            first, second = wasted, ys + item_height
+        else:
+            first, second = ys + item_height, run_widths
+        best = first == first.min()
+        best &= second == second[best].min()
+        i = int(np.argmax(best))
+        return (int(first[i]), int(second[i])), int(xs[i]), int(ys[i])
+
+
+    def _find_best_score(self, item: Item) -> Tuple[Tuple[int, int], int, bool, int]:
+        """
+        Returns the best (score, x, rotation, y) for the
+        item, computing the same scores as scoreBL and
+        scoreBF. Ties go to the leftmost position, unrotated
+        first.
+        """
+        key = (self._version, item.width, item.height)
+        if self._score_cache[0] == key:
+            return self._score_cache[1]
+        starts, widths = self._runs()
+        best = None
+        options = [(item.width, item.height, False)]
+        if self.rotation:
+            options.append((item.height, item.width, True))
+        for width, height, rot in options:
+            res = self._best_position(starts, widths, width, height)
+            if res is None:
+                continue
+            score, x, y = res
+            if best is None or (score, x) < (best[0], best[1]):
+                best = (score, x, rot, y)
+        if best is None:
+            best = (None, None, None, False)
+        self._score_cache = (key, best)
+        return best
+
+
+    def _add_to_wastemap(self, x: int, item: Item, y: int) -> None:
+        """
+        Add the space between the skyline and the bottom
+        of an item inserted at (x, y) to the wastemap, one
+        FreeRectangle per flat run under the item.
+        """
+        columns = self.heights[x:x+item.width]
+        bounds = (np.flatnonzero(columns[1:] != columns[:-1]) + 1).tolist()
+        for left, right in zip([0] + bounds, bounds + [item.width]):
+            run_y = int(columns[left])
+            if y > run_y:
+                waste_rect = guillotine.FreeRectangle(right - left,
+                                                      y - run_y,
+                                                      x + left,
+                                                      run_y)
+                self.wastemap.freerects.add(waste_rect)
+                if self.wastemap.rectangle_merge():
+                    self.known_fails.clear()
+
+
+    def insert(self, item: Item,
+               heuristic: str = 'bottom_left') -> bool:
+        """
+        Wrapper for insertion heuristics
+        """
+        self._log_insert(item)
+        if self.use_waste_map:
+            res = self.wastemap.insert(item, heuristic='best_area')
+            if res:
+                self.items.append(item)
+                self.free_area -= item.width * item.height
+                # The wastemap may have merged rectangles
+                self.known_fails.clear()
+                return True
+
+        _, x, rotation, y = self._find_best_score(item)
+        if x is None:
+            return False
+        if rotation:
+            item.rotate()
+        item.x, item.y = x, y
+        self.items.append(item)
+        self.free_area -= item.width * item.height
+        if self.use_waste_map:
+            self._add_to_wastemap(x, item, y)
+        self._log(self._restore_heights, x, self.heights[x:x+item.width].copy(), self._filled)
+        self.heights[x:x+item.width] = y + item.height
+        self._version += 1
+        if y + item.height == self.height:
+            self._filled = True
+        return True
+
+
+    def free_space_summary(self) -> Tuple[int, int, int]:
+        """
+        Returns the largest free width, the largest free
+        height and the free area of the bin.
+        """
+        max_width = self.width
+        if self._filled:
+            # Adjacent open runs form a single opening
+            open_columns = np.concatenate(([0], self.heights < self.height, [0]))
+            edges = np.flatnonzero(np.diff(open_columns))
+            max_width = int((edges[1::2] - edges[::2]).max()) if len(edges) else 0
+        max_height = self.height - int(self.heights.min())
+        if self.use_waste_map:
+            waste_width, waste_height, _ = self.wastemap.free_space_summary()
+            max_width = max(max_width, waste_width)
+            max_height = max(max_height, waste_height)
+        return max_width, max_height, self.free_area
+
+
+    def bin_stats(self) -> dict:
+        """
+        Returns a dictionary with compiled stats on the bin
+        """
+        stats = {
+            'width': self.width,
+            'height': self.height,
+            'area': self.area,
+            'efficiency': (self.area - self.free_area) / self.area,
+            'items': self.items,
+            }
+
+        return stats
+
+
+def rolling_max(values: Any, window: int) -> Any:
+    """
+    Returns the max of every window of consecutive values.
+    Each np.maximum pass doubles the span result[i] covers,
+    and two overlapping spans then cover a whole window.
+    """
+    result = values
+    span = 1
+    while span * 2 <= window:
+        result = np.maximum(result[:-span], result[span:])
+        span *= 2
+    return np.maximum(result[:len(values) - window + 1], result[window - span:])
+
+
 def scoreBL(segs: List[SkylineSegment], item: Item, y: int, i: int, rotation=False) -> Tuple[int, int]:
     """ Bottom Left """
     seg = segs[i]
@@ -288,3 +688,9 @@ def scoreBF(segs: List[SkylineSegment],
     if rotation:
         return (calc_waste(segs, item, y, i, rotation=True), item.width + y)
     return (calc_waste(segs, item, y, i, rotation=False), item.height + y)
+
+
+HEURISTICS = {
+    'bottom_left': scoreBL,
+    'best_fit': scoreBF,
+}
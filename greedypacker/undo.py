@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Undo Log
+
+Lookahead and local search try placements and take them back.
+Instead of copying a whole bin first, a bin with an open
+checkpoint records how to revert each change as it makes it,
+so rolling back costs time proportional to what changed.
+"""
+from typing import Any, Callable, List, Optional, Tuple
+from .item import Item
+
+
+# (function, arguments) pairs, each reverting one change
+UndoLog = List[Tuple[Callable, tuple]]
+
+
+def item_state(item: Item) -> Tuple[int, int, int, int, bool]:
+    return item.x, item.y, item.width, item.height, item.rotated
+
+
+def restore_item(item: Item, state: Tuple[int, int, int, int, bool]) -> None:
+    item.x, item.y, item.width, item.height, item.rotated = state
+
+
+class Transactional:
+    """
+    Checkpoint and rollback for the bin classes. While a
+    checkpoint is open, inserts append their inverse changes
+    to the undo log and rollback applies them newest first.
+    Nested structures such as the free rectangle list, the
+    known fails and the wastemap write to the same log, so
+    one rollback reverts them in order.
+    """
+    _undo = None # type: Optional[UndoLog]
+
+
+    def __getstate__(self) -> dict:
+        """ Copies start without an open checkpoint """
+        state = self.__dict__.copy()
+        state.pop('_undo', None)
+        return state
+
+
+    def checkpoint(self) -> int:
+        """
+        Start logging changes, if not already, and return a
+        mark to roll back to. Checkpoints nest.
+        """
+        if self._undo is None:
+            self._set_undo([])
+        return len(self._undo)
+
+
+    def rollback(self, mark: int = 0) -> None:
+        """
+        Revert every change made since the checkpoint that
+        returned mark. Later checkpoints are discarded and
+        earlier ones stay open.
+        """
+        log = self._undo
+        if log is None or mark > len(log):
+            raise ValueError('No such checkpoint!')
+        # Reverting must not log further changes
+        self._set_undo(None)
+        while len(log) > mark:
+            fn, args = log.pop()
+            fn(*args)
+        self._set_undo(log)
+
+
+    def commit(self) -> None:
+        """ Keep every change, close all checkpoints and stop logging """
+        self._set_undo(None)
+
+
+    def _set_undo(self, log: Optional[UndoLog]) -> None:
+        """ Point this bin and its nested structures at log """
+        self._undo = log
+        self.known_fails.undo = log
+
+
+    def _log(self, fn: Callable, *args: Any) -> None:
+        if self._undo is not None:
+            self._undo.append((fn, args))
+
+
+    def _log_insert(self, item: Item) -> None:
+        """
+        Log the state an insert can change in every bin class:
+        the item, the item list and the free area.
+        """
+        if self._undo is not None:
+            self._undo.append((restore_item, (item, item_state(item))))
+            self._undo.append((self._truncate_items, (len(self.items), self.free_area)))
+
+
+    def _truncate_items(self, count: int, free_area: int) -> None:
+        del self.items[count:]
+        self.free_area = free_area
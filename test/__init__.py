@@ -5,6 +5,13 @@ from . import test_shelf
 from . import test_guillotine
 from . import test_maximalrectangles
 from . import test_skyline
+from . import test_binindex
+from . import test_frontier
+from . import test_portfolio
+from . import test_pickle
+from . import test_itemstore
+from . import test_bounds
+from . import test_undo
 
 def load_tests(loader, standard_tests, pattern):
     if pattern == __name__:
@@ -16,6 +23,13 @@ def load_tests(loader, standard_tests, pattern):
         test_guillotine,
         test_maximalrectangles,
         test_skyline,
+        test_binindex,
+        test_frontier,
+        test_portfolio,
+        test_pickle,
+        test_itemstore,
+        test_bounds,
+        test_undo,
     ]:
         tests = (unittest.defaultTestLoader
                  .loadTestsFromModule(test_module, pattern=pattern))
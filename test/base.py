@@ -7,3 +7,13 @@ class BaseTestCase(unittest.TestCase):
 
     def tearDown(self):
         pass
+
+    def assertValidLayout(self, M):
+        """ Every item lies inside its bin and no two overlap """
+        for binn in M.bins:
+            for i, a in enumerate(binn.items):
+                self.assertTrue(a.x >= 0 and a.x + a.width <= M.bin_width)
+                self.assertTrue(a.y >= 0 and a.y + a.height <= M.bin_height)
+                for b in binn.items[i+1:]:
+                    self.assertFalse(a.x < b.x + b.width and b.x < a.x + a.width and
+                                     a.y < b.y + b.height and b.y < a.y + a.height)
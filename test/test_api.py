@@ -1,7 +1,9 @@
 import sys
 import unittest
+import unittest.mock
 
 import greedypacker
+from greedypacker.binmanager import ClosedBin, StreamPlacement
 
 from .base import BaseTestCase
 from .util import stdout_redirect
@@ -31,6 +33,40 @@ class APITests(BaseTestCase):
             self.assertEqual(ITEM3.y, 0)
 
 
+class Sorting(BaseTestCase):
+    def testDeferredSort(self):
+        """
+        add_items only appends, execute sorts once
+        """
+        M = greedypacker.BinManager(8, 4, pack_algo='shelf', heuristic='next_fit')
+        ITEM = greedypacker.Item(1, 1)
+        ITEM2 = greedypacker.Item(3, 2)
+        ITEM3 = greedypacker.Item(2, 2)
+        M.add_items(ITEM)
+        M.add_items(ITEM2)
+        M.add_items(ITEM3)
+        with self.subTest():
+            self.assertEqual(M.items, [ITEM, ITEM2, ITEM3])
+        M.execute()
+        with self.subTest():
+            self.assertEqual(M.items, [ITEM2, ITEM3, ITEM])
+
+
+    def testSortingHeuristic(self):
+        """
+        Shorter side ascending
+        """
+        M = greedypacker.BinManager(8, 4, pack_algo='shelf',
+                                    heuristic='next_fit',
+                                    sorting_heuristic='ASCSS')
+        ITEM = greedypacker.Item(3, 3)
+        ITEM2 = greedypacker.Item(1, 4)
+        ITEM3 = greedypacker.Item(2, 4)
+        M.add_items(ITEM, ITEM2, ITEM3)
+        M.items_sort()
+        self.assertEqual(M.items, [ITEM2, ITEM3, ITEM])
+
+
 class BestBinFit(BaseTestCase):
     def testGuillotineBWFSortingRotation(self):
         """
@@ -436,12 +472,423 @@ class BinFirstFit(BaseTestCase):
             self.assertEqual(ITEM3.y, 4)
 
 
+class GlobalBestFit(BaseTestCase):
+    def testFillsFirstBin(self):
+        """
+        Bin best fit places items in order and needs a second
+        bin for the last one. Global best fit places the
+        tightest (item, bin) pair first and fits all three.
+        """
+        ITEM = greedypacker.Item(1, 2)
+        ITEM2 = greedypacker.Item(2, 3)
+        ITEM3 = greedypacker.Item(2, 4)
+        M = greedypacker.BinManager(4, 4, pack_algo='maximal_rectangle',
+                                    heuristic='best_area',
+                                    bin_algo='global_best_fit',
+                                    sorting=False)
+        M.add_items(ITEM, ITEM2, ITEM3)
+        M.execute()
+        with self.subTest():
+            self.assertEqual(len(M.bins), 1)
+        with self.subTest():
+            self.assertCountEqual(M.bins[0].items, [ITEM, ITEM2, ITEM3])
+        with self.subTest():
+            self.assertEqual((ITEM3.x, ITEM3.y), (0, 0))
+            self.assertEqual((ITEM2.x, ITEM2.y), (2, 0))
+            self.assertEqual((ITEM.x, ITEM.y), (2, 3))
+
+
+    def testItemTooBig(self):
+        M = greedypacker.BinManager(8, 4, pack_algo='skyline',
+                                    heuristic='bottom_left',
+                                    bin_algo='global_best_fit')
+        M.add_items(greedypacker.Item(2, 2), greedypacker.Item(10, 20))
+        with self.assertRaises(ValueError):
+            M.execute()
+
+
+    def testMatchesExhaustiveSearch(self):
+        """
+        Compare against scoring every remaining item against
+        every bin before each insert
+        """
+        def exhaustive(sizes, **kwargs):
+            M = greedypacker.BinManager(12, 10, **kwargs)
+            items = [greedypacker.Item(w, h) for w, h in sizes]
+            M.add_items(*items)
+            M.items_sort()
+            ranks = {} # type: dict
+            for el in M.items:
+                ranks.setdefault((el.width, el.height), len(ranks))
+            remaining = list(M.items)
+            while remaining:
+                best = None
+                for i, el in enumerate(remaining):
+                    for b, binn in enumerate(M.bins):
+                        score = binn._find_best_score(el)[0]
+                        key = (score, ranks[(el.width, el.height)], b)
+                        if score is not None and (best is None or key < best[0]):
+                            best = (key, i, b)
+                if best is None:
+                    M.bins.append(M._bin_factory())
+                    continue
+                M.bins[best[2]].insert(remaining.pop(best[1]), M.heuristic)
+            return len(M.bins), [(el.x, el.y, el.width, el.height) for el in items]
+
+        def fast(sizes, **kwargs):
+            M = greedypacker.BinManager(12, 10, bin_algo='global_best_fit', **kwargs)
+            items = [greedypacker.Item(w, h) for w, h in sizes]
+            M.add_items(*items)
+            M.execute()
+            return len(M.bins), [(el.x, el.y, el.width, el.height) for el in items]
+
+        configs = [{'pack_algo': 'maximal_rectangle', 'heuristic': 'best_area'},
+                   {'pack_algo': 'guillotine', 'heuristic': 'best_shortside'},
+                   {'pack_algo': 'skyline', 'heuristic': 'bottom_left'},
+                   {'pack_algo': 'shelf', 'heuristic': 'best_width_fit'}]
+        sizes = [(5, 3), (2, 7), (6, 6), (3, 3), (1, 4), (4, 1), (5, 3),
+                 (6, 2), (2, 2), (7, 5), (3, 6), (1, 1), (2, 5), (4, 4)]
+        for config in configs:
+            with self.subTest(config=config):
+                self.assertEqual(fast(sizes, **config), exhaustive(sizes, **config))
+
+
+class Stream(BaseTestCase):
+    def testPlacements(self):
+        """
+        Placements are yielded in arrival order and the
+        items are not queued on the manager
+        """
+        M = greedypacker.BinManager(8, 4, pack_algo='shelf', heuristic='next_fit')
+        ITEM = greedypacker.Item(4, 2)
+        ITEM2 = greedypacker.Item(5, 2)
+        ITEM3 = greedypacker.Item(2, 2)
+        for i, el in enumerate([ITEM, ITEM2, ITEM3]):
+            el.id = i
+        res = list(M.pack_stream(iter([ITEM, ITEM2, ITEM3])))
+        correct = [StreamPlacement(0, 0, 0, 0, False),
+                   StreamPlacement(1, 0, 0, 2, False),
+                   StreamPlacement(2, 0, 4, 0, False)]
+        with self.subTest():
+            self.assertEqual(res, correct)
+        with self.subTest():
+            self.assertEqual(M.items, [])
+        with self.subTest():
+            self.assertCountEqual(M.bins[0].items, [ITEM, ITEM2, ITEM3])
+
+
+    def testCloseFullBins(self):
+        M = greedypacker.BinManager(2, 2, pack_algo='skyline', heuristic='bottom_left')
+        ITEM = greedypacker.Item(2, 2)
+        ITEM2 = greedypacker.Item(1, 2)
+        ITEM3 = greedypacker.Item(1, 2)
+        res = list(M.pack_stream([ITEM, ITEM2, ITEM3], close_bins=True))
+        with self.subTest():
+            self.assertEqual(res[0], StreamPlacement(0, 0, 0, 0, False))
+            self.assertEqual(res[1].bin_index, 0)
+            self.assertEqual(res[1].bin.items, [ITEM])
+        with self.subTest():
+            self.assertEqual([r.bin_index for r in res[2:4]], [1, 1])
+            self.assertEqual(res[4].bin_index, 1)
+            self.assertCountEqual(res[4].bin.items, [ITEM2, ITEM3])
+        with self.subTest():
+            self.assertEqual(len(res), 5)
+            self.assertEqual(len(M.bins), 1)
+            self.assertEqual(M.bins[0].items, [])
+
+
+    def testMaxOpenBins(self):
+        M = greedypacker.BinManager(10, 10, pack_algo='maximal_rectangle',
+                                    heuristic='best_area')
+        items = [greedypacker.Item(w, h) for w, h in
+                 [(6, 6), (7, 3), (5, 5), (3, 8), (6, 2), (4, 4), (9, 1),
+                  (2, 7), (5, 6), (3, 3), (8, 4), (1, 1)] * 5]
+        placements = {}
+        closed = {}
+        for res in M.pack_stream(items, close_bins=True, max_open_bins=2):
+            if isinstance(res, ClosedBin):
+                closed[res.bin_index] = res.bin
+            else:
+                placements[res.bin_index] = placements.get(res.bin_index, 0) + 1
+                self.assertLessEqual(len(M.bins), 3)
+        with self.subTest():
+            self.assertEqual(sum(placements.values()), len(items))
+        with self.subTest():
+            self.assertEqual(sorted(closed), sorted(placements))
+        with self.subTest():
+            self.assertEqual({i: len(b.items) for i, b in closed.items()}, placements)
+
+
+    def testItemTooBig(self):
+        """
+        Both bin algorithms reject the item without opening a bin
+        """
+        for bin_algo in ('bin_best_fit', 'bin_first_fit'):
+            M = greedypacker.BinManager(10, 10, bin_algo=bin_algo, pack_algo='guillotine',
+                                        heuristic='best_area')
+            stream = M.pack_stream([greedypacker.Item(4, 4), greedypacker.Item(30, 3)],
+                                   close_bins=True)
+            with self.subTest(bin_algo=bin_algo):
+                self.assertEqual(next(stream).bin_index, 0)
+            with self.subTest(bin_algo=bin_algo):
+                with self.assertRaises(ValueError):
+                    next(stream)
+            with self.subTest(bin_algo=bin_algo):
+                self.assertEqual(len(M.bins), 1)
+
+
+    def testShelfRotatedOnly(self):
+        """
+        A shelf item that only fits on its side is placed
+        """
+        M = greedypacker.BinManager(4, 10, pack_algo='shelf', heuristic='best_width_fit',
+                                    rotation=True)
+        results = list(M.pack_stream([greedypacker.Item(10, 4)], close_bins=True))
+        self.assertEqual(results[0], StreamPlacement(0, 0, 0, 0, True))
+        self.assertEqual(len(results[1].bin.items), 1)
+
+
+    def testRejectedByEmptyBin(self):
+        """
+        An item an empty bin rejects raises rather than being
+        dropped, and its bin is not kept open
+        """
+        for bin_algo in ('bin_best_fit', 'bin_first_fit'):
+            M = greedypacker.BinManager(10, 10, bin_algo=bin_algo, pack_algo='guillotine',
+                                        heuristic='best_area')
+            stream = M.pack_stream([greedypacker.Item(4, 4), greedypacker.Item(9, 9)],
+                                   max_open_bins=1, close_bins=True)
+            next(stream)
+            with unittest.mock.patch.object(greedypacker.guillotine.Guillotine, 'insert',
+                                            return_value=False):
+                with self.subTest(bin_algo=bin_algo):
+                    with self.assertRaises(ValueError):
+                        next(stream)
+            with self.subTest(bin_algo=bin_algo):
+                self.assertEqual([len(binn.items) for binn in M.bins], [1])
+
+
+class Demand(BaseTestCase):
+    def testGridBlocks(self):
+        """
+        Copies fill the space beside the large item as one
+        block, and the rest open a second bin
+        """
+        M = greedypacker.BinManager(8, 4, pack_algo='maximal_rectangle',
+                                    heuristic='best_area')
+        M.add_demand((2, 1, 20), (4, 4, 1))
+        M.execute()
+        with self.subTest():
+            self.assertEqual(len(M.bins), 2)
+        with self.subTest():
+            self.assertEqual(len(M.bins[0].items), 9)
+            self.assertEqual(len(M.bins[1].items), 12)
+        with self.subTest():
+            ids = [el.id for binn in M.bins for el in binn.items]
+            self.assertEqual(ids.count(0), 20)
+            self.assertEqual(ids.count(1), 1)
+        with self.subTest():
+            self.assertEqual(M.bins[0].free_area, 0)
+        self.assertValidLayout(M)
+
+
+    def testMixedWithItems(self):
+        """
+        Demand rows are packed in sort order with added items
+        """
+        M = greedypacker.BinManager(8, 4, pack_algo='shelf',
+                                    heuristic='best_width_fit',
+                                    rotation=False)
+        ITEM = greedypacker.Item(3, 3)
+        M.add_items(ITEM)
+        M.add_demand((1, 1, 5))
+        M.execute()
+        with self.subTest():
+            self.assertEqual(len(M.bins), 1)
+        with self.subTest():
+            self.assertEqual((ITEM.x, ITEM.y), (0, 0))
+        with self.subTest():
+            self.assertEqual(sorted((el.x, el.y) for el in M.bins[0].items[1:]),
+                             [(3, 0), (4, 0), (5, 0), (6, 0), (7, 0)])
+
+
+    def testAllAlgorithms(self):
+        configs = [('guillotine', 'best_area'), ('maximal_rectangle', 'best_area'),
+                   ('shelf', 'best_width_fit'), ('skyline', 'bottom_left')]
+        for pack_algo, heuristic in configs:
+            for bin_algo in ('bin_best_fit', 'bin_first_fit'):
+                with self.subTest(pack_algo=pack_algo, bin_algo=bin_algo):
+                    M = greedypacker.BinManager(20, 15, pack_algo=pack_algo,
+                                                heuristic=heuristic,
+                                                bin_algo=bin_algo)
+                    M.add_demand((3, 2, 40), (7, 5, 6), (2, 9, 11), (1, 1, 30))
+                    M.execute()
+                    self.assertEqual(sum(len(b.items) for b in M.bins), 87)
+                    self.assertValidLayout(M)
+
+
+    def testItemTooBig(self):
+        M = greedypacker.BinManager(8, 4, pack_algo='skyline', heuristic='bottom_left')
+        M.add_demand((10, 20, 3))
+        with self.assertRaises(ValueError):
+            M.execute()
+
+
+class Improve(BaseTestCase):
+    def setUp(self):
+        sizes = [(5, 2), (4, 6), (5, 5), (4, 5), (4, 6), (3, 6), (3, 4)]
+        self.items = [greedypacker.Item(w, h) for w, h in sizes]
+        self.M = greedypacker.BinManager(10, 10, pack_algo='shelf',
+                                         heuristic='best_width_fit')
+        self.M.add_items(*self.items)
+        self.M.execute()
+
+
+    def tearDown(self):
+        del self.items
+        del self.M
+
+
+    def testRemovesBin(self):
+        """
+        The greedy pass needs three bins, the lower bound is two
+        """
+        with self.subTest():
+            self.assertEqual(len(self.M.bins), 3)
+        with self.subTest():
+            self.assertEqual(self.M.improve(iterations=20), 1)
+        with self.subTest():
+            self.assertEqual(len(self.M.bins), 2)
+        with self.subTest():
+            self.assertCountEqual([el for binn in self.M.bins for el in binn.items],
+                                  self.items)
+        self.assertValidLayout(self.M)
+
+
+    def testStopsAtLowerBound(self):
+        self.M.improve(iterations=20)
+        layout = [(el.x, el.y, el.width, el.height) for el in self.items]
+        with self.subTest():
+            self.assertEqual(self.M.improve(iterations=20), 0)
+        with self.subTest():
+            self.assertEqual([(el.x, el.y, el.width, el.height) for el in self.items],
+                             layout)
+
+
+    def testDeterministic(self):
+        """
+        The same seed and iteration budget give the same layout
+        """
+        sizes = [(r * 7 % 9 + 2, r * 5 % 8 + 3) for r in range(40)]
+        layouts = []
+        for _ in range(2):
+            M = greedypacker.BinManager(12, 12, pack_algo='guillotine',
+                                        heuristic='best_area')
+            items = [greedypacker.Item(w, h) for w, h in sizes]
+            M.add_items(*items)
+            M.execute()
+            M.improve(iterations=50, seed=3)
+            layouts.append([(el.x, el.y, el.width, el.height) for el in items])
+            self.assertEqual(sum(len(binn.items) for binn in M.bins), len(items))
+            self.assertValidLayout(M)
+        self.assertEqual(layouts[0], layouts[1])
+
+
+    def testNeedsBudget(self):
+        with self.assertRaises(ValueError):
+            self.M.improve()
+
+
+class BeamSearch(BaseTestCase):
+    def setUp(self):
+        self.sizes = [(r * 7 % 9 + 2, r * 5 % 8 + 3) for r in range(30)]
+
+
+    def layout(self, method, **kwargs):
+        M = greedypacker.BinManager(12, 12, pack_algo='guillotine',
+                                    heuristic='best_area')
+        items = [greedypacker.Item(w, h) for w, h in self.sizes]
+        M.add_items(*items)
+        if method == 'execute':
+            M.execute()
+        else:
+            M.beam_search(**kwargs)
+        self.assertEqual(sum(len(binn.items) for binn in M.bins), len(items))
+        self.assertValidLayout(M)
+        return [(el.x, el.y, el.width, el.height) for el in items]
+
+
+    def testFewerBins(self):
+        """
+        Best fit needs three bins, the beam finds two
+        """
+        sizes = [(4, 5), (3, 8), (5, 4), (4, 8), (8, 6)]
+        counts = []
+        for method in ('execute', 'beam_search'):
+            M = greedypacker.BinManager(10, 10, pack_algo='guillotine',
+                                        heuristic='best_area')
+            M.add_items(*[greedypacker.Item(w, h) for w, h in sizes])
+            if method == 'execute':
+                M.execute()
+            else:
+                M.beam_search(beam_width=4, lookahead=3, processes=1)
+            self.assertValidLayout(M)
+            counts.append(len(M.bins))
+        self.assertEqual(counts, [3, 2])
+
+
+    def testWidthOneIsBestFit(self):
+        """
+        A single beam with no lookahead packs like bin_best_fit
+        """
+        self.assertEqual(self.layout('beam_search', beam_width=1, lookahead=1, processes=1),
+                         self.layout('execute'))
+
+
+    def testTimeBudget(self):
+        """
+        With no time left the rest is packed by best fit
+        """
+        self.assertEqual(self.layout('beam_search', time_budget=0, processes=1),
+                         self.layout('execute'))
+
+
+    def testProcessPool(self):
+        """
+        Worker processes find the same packing
+        """
+        self.assertEqual(self.layout('beam_search', beam_width=3, processes=2),
+                         self.layout('beam_search', beam_width=3, processes=1))
+
+
+    def testScores(self):
+        self.layout('beam_search', score='waste', processes=1)
+        self.layout('beam_search', score=lambda free_areas, bin_area: len(free_areas),
+                    processes=1)
+        with self.assertRaises(ValueError):
+            self.layout('beam_search', score='nope', processes=1)
+
+
+    def testDemandRows(self):
+        M = greedypacker.BinManager(10, 10, pack_algo='guillotine',
+                                    heuristic='best_area')
+        M.add_demand((2, 2, 5))
+        with self.assertRaises(ValueError):
+            M.beam_search(processes=1)
+
+
 def load_tests(loader, tests, pattern):
     suite = unittest.TestSuite()
     if pattern is None:
         suite.addTests(loader.loadTestsFromTestCase(APITests))
+        suite.addTests(loader.loadTestsFromTestCase(Sorting))
         suite.addTests(loader.loadTestsFromTestCase(BestBinFit))
         suite.addTests(loader.loadTestsFromTestCase(BinFirstFit))
+        suite.addTests(loader.loadTestsFromTestCase(GlobalBestFit))
+        suite.addTests(loader.loadTestsFromTestCase(Stream))
+        suite.addTests(loader.loadTestsFromTestCase(Demand))
+        suite.addTests(loader.loadTestsFromTestCase(Improve))
+        suite.addTests(loader.loadTestsFromTestCase(BeamSearch))
     else:
         tests = loader.loadTestsFromName(pattern,
                                          module=sys.modules[__name__])
@@ -0,0 +1,104 @@
+import sys
+import unittest
+
+import greedypacker
+from greedypacker import binindex
+from greedypacker import guillotine
+from greedypacker import maximal_rectangles
+from greedypacker import shelf
+from greedypacker import skyline
+from greedypacker import item
+from .base import BaseTestCase
+
+
+class Summaries(BaseTestCase):
+    def testGuillotineSummary(self):
+        """
+        Horizontal split leaves a 5x2 and an 8x2 rectangle
+        """
+        G = guillotine.Guillotine(8, 4, heuristic='best_area')
+        G.insert(item.Item(3, 2))
+        self.assertEqual(G.free_space_summary(), (8, 2, 26))
+
+
+    def testMaximalRectangleSummary(self):
+        M = maximal_rectangles.MaximalRectangle(8, 4)
+        M.insert(item.Item(3, 2))
+        self.assertEqual(M.free_space_summary(), (8, 4, 26))
+
+
+    def testSkylineSummary(self):
+        """
+        A full height item closes off its columns
+        """
+        S = skyline.Skyline(8, 4, rotation=False, heuristic='bottom_left')
+        S.insert(item.Item(2, 4))
+        self.assertEqual(S.free_space_summary(), (6, 4, 24))
+
+
+    def testSheetSummary(self):
+        S = shelf.Sheet(8, 4, heuristic='best_width_fit', wastemap=True)
+        S.insert(item.Item(8, 3))
+        self.assertEqual(S.free_space_summary(), (8, 1, 8))
+
+
+class Index(BaseTestCase):
+    def setUp(self):
+        self.index = binindex.BinIndex()
+        self.bins = [guillotine.Guillotine(8, 4, heuristic='best_area'),
+                     guillotine.Guillotine(8, 4, heuristic='best_area')]
+        for binn in self.bins:
+            self.index.add(binn)
+
+
+    def tearDown(self):
+        del self.index
+        del self.bins
+
+
+    def testCandidates(self):
+        """
+        Full bins drop out once their summary is refreshed
+        """
+        self.bins[0].insert(item.Item(8, 3))
+        self.index.touch(0)
+        with self.subTest():
+            self.assertEqual(self.index.candidates(item.Item(2, 2)), [1])
+        with self.subTest():
+            self.assertEqual(self.index.candidates(item.Item(1, 8)), [0, 1])
+        with self.subTest():
+            self.assertEqual(self.index.candidates(item.Item(9, 1)), [])
+
+
+    def testBestFitSkipsBins(self):
+        """
+        Bins ruled out by the index are never scored
+        """
+        M = greedypacker.BinManager(4, 4, pack_algo='maximal_rectangle',
+                                    heuristic='best_area',
+                                    bin_algo='bin_best_fit')
+        M.add_items(*[item.Item(4, 4) for _ in range(3)])
+        M.execute()
+        calls = []
+        for binn in M.bins:
+            binn._find_best_score = lambda i, b=binn: calls.append(b) or (None, None, False)
+        M._bin_best_fit(item.Item(1, 1))
+        with self.subTest():
+            self.assertEqual(len(M.bins), 4)
+        with self.subTest():
+            self.assertEqual(calls, [])
+
+
+def load_tests(loader, tests, pattern):
+    suite = unittest.TestSuite()
+    if pattern is None:
+        suite.addTests(loader.loadTestsFromTestCase(Summaries))
+        suite.addTests(loader.loadTestsFromTestCase(Index))
+    else:
+        tests = loader.loadTestsFromName(pattern,
+                                         module=sys.modules[__name__])
+        failedTests = [t for t in tests._tests
+                       if type(t) == unittest.loader._FailedTest]
+        if len(failedTests) == 0:
+            suite.addTests(tests)
+    return suite
@@ -0,0 +1,91 @@
+import random
+import sys
+import unittest
+import unittest.mock
+
+import greedypacker
+from greedypacker import bounds
+from .base import BaseTestCase
+
+
+class Bounds(BaseTestCase):
+    def testAreaBound(self):
+        with self.subTest():
+            self.assertEqual(bounds.area_bound(10, 5, [4, 5, 2], [3, 3, 2]), 1)
+        with self.subTest():
+            self.assertEqual(bounds.area_bound(10, 5, [4, 5, 2], [3, 3, 2], [3, 1, 1]), 2)
+        with self.subTest():
+            self.assertEqual(bounds.area_bound(10, 5, [], []), 0)
+
+
+    def testLargeItems(self):
+        """
+        Items over half the bin in both dimensions need a bin each
+        """
+        with self.subTest():
+            self.assertEqual(bounds.area_bound(10, 10, [6, 6, 6], [6, 6, 6]), 2)
+        with self.subTest():
+            self.assertEqual(bounds.l2_bound(10, 10, [6, 6, 6], [6, 6, 6]), 3)
+
+
+    def testL2(self):
+        """
+        No 5x5 item fits beside a 6x6 item, so the small items
+        need bins of their own
+        """
+        widths, heights = [6, 6] + [5] * 6, [6, 6] + [5] * 6
+        with self.subTest():
+            self.assertEqual(bounds.area_bound(10, 10, widths, heights), 3)
+        with self.subTest():
+            self.assertEqual(bounds.lower_bound(10, 10, widths, heights), 4)
+        with self.subTest():
+            self.assertEqual(bounds.lower_bound(10, 10, [6, 5], [6, 5], [2, 6]), 4)
+
+
+    def testRotation(self):
+        """
+        3x6 items only fit a 10x4 bin on their side
+        """
+        with self.subTest():
+            self.assertEqual(bounds.lower_bound(10, 4, [3, 3], [6, 6]), 2)
+        with self.subTest():
+            self.assertEqual(bounds.lower_bound(10, 4, [3, 3], [3, 3]), 1)
+
+
+    def testPythonFallback(self):
+        r = random.Random(0)
+        widths = [r.randint(1, 20) for _ in range(60)]
+        heights = [r.randint(1, 15) for _ in range(60)]
+        for rotation in (True, False):
+            res = bounds.lower_bound(20, 15, widths, heights, rotation=rotation)
+            with unittest.mock.patch.object(bounds, 'np', None):
+                fallback = bounds.lower_bound(20, 15, widths, heights, rotation=rotation)
+            with self.subTest(rotation=rotation):
+                self.assertEqual(res, fallback)
+
+
+    def testBinManager(self):
+        """
+        The bound is reached by packing the items
+        """
+        M = greedypacker.BinManager(10, 10, pack_algo='maximal_rectangle',
+                                    heuristic='best_area')
+        M.add_items(greedypacker.Item(6, 6), greedypacker.Item(6, 6))
+        M.add_demand((5, 5, 6))
+        self.assertEqual(M.lower_bound(), 4)
+        M.execute()
+        self.assertEqual(len(M.bins), 4)
+
+
+def load_tests(loader, tests, pattern):
+    suite = unittest.TestSuite()
+    if pattern is None:
+        suite.addTests(loader.loadTestsFromTestCase(Bounds))
+    else:
+        tests = loader.loadTestsFromName(pattern,
+                                         module=sys.modules[__name__])
+        failedTests = [t for t in tests._tests
+                       if type(t) == unittest.loader._FailedTest]
+        if len(failedTests) == 0:
+            suite.addTests(tests)
+    return suite
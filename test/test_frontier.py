@@ -0,0 +1,120 @@
+import sys
+import unittest
+
+import greedypacker
+from greedypacker import frontier
+from greedypacker import guillotine
+from greedypacker import item
+from .base import BaseTestCase
+
+
+class Frontier(BaseTestCase):
+    def setUp(self):
+        self.F = frontier.FailFrontier()
+
+
+    def tearDown(self):
+        del self.F
+
+
+    def testDominates(self):
+        """
+        Larger sizes in both dimensions are dominated
+        """
+        self.F.add(3, 4)
+        with self.subTest():
+            self.assertTrue(self.F.dominates(3, 4))
+        with self.subTest():
+            self.assertTrue(self.F.dominates(5, 6))
+        with self.subTest():
+            self.assertFalse(self.F.dominates(2, 9))
+        with self.subTest():
+            self.assertFalse(self.F.dominates(9, 3))
+
+
+    def testAddKeepsMinimalSizes(self):
+        """
+        New failures replace the sizes they dominate
+        """
+        self.F.add(5, 5)
+        self.F.add(2, 8)
+        self.F.add(8, 2)
+        self.F.add(6, 6)
+        self.F.add(4, 4)
+        with self.subTest():
+            self.assertEqual(self.F.widths, [2, 4, 8])
+        with self.subTest():
+            self.assertEqual(self.F.heights, [8, 4, 2])
+
+
+    def testClear(self):
+        self.F.add(1, 1)
+        self.F.clear()
+        self.assertFalse(self.F.dominates(5, 5))
+
+
+    def testMergeClearsFrontier(self):
+        """
+        Merged free rectangles can hold items that failed before
+        """
+        G = guillotine.Guillotine(4, 4, heuristic='best_area')
+        G.known_fails.add(2, 4)
+        G.freerects.clear()
+        G.freerects.update([guillotine.FreeRectangle(2, 1, 0, 1),
+                            guillotine.FreeRectangle(2, 2, 2, 0),
+                            guillotine.FreeRectangle(2, 3, 0, 2)])
+        G.insert(item.Item(2, 2))
+        self.assertEqual(len(G.known_fails), 0)
+
+
+class BinSelection(BaseTestCase):
+    def testFirstFitSkipsKnownFails(self):
+        """
+        Full bins are not asked to insert the same size twice
+        """
+        M = greedypacker.BinManager(4, 4, pack_algo='guillotine',
+                                    heuristic='best_area',
+                                    bin_algo='bin_first_fit')
+        M.add_items(*[item.Item(4, 4) for _ in range(2)])
+        M.add_items(*[item.Item(3, 3) for _ in range(2)])
+        M.execute()
+        calls = []
+        insert = M.bins[0].insert
+        M.bins[0].insert = lambda i, h='best_area': calls.append(i) or insert(i, h)
+        M._bin_first_fit(item.Item(3, 3))
+        M._bin_first_fit(item.Item(4, 3))
+        with self.subTest():
+            self.assertEqual(calls, [])
+        with self.subTest():
+            self.assertEqual(len(M.bins), 6)
+
+
+    def testBestFitRecordsFailures(self):
+        """
+        A bin that scores no position for an item records it
+        """
+        M = greedypacker.BinManager(4, 4, pack_algo='maximal_rectangle',
+                                    heuristic='best_area',
+                                    bin_algo='bin_best_fit',
+                                    sorting=False)
+        M.add_items(item.Item(2, 2), item.Item(3, 3))
+        M.execute()
+        with self.subTest():
+            self.assertEqual(len(M.bins), 2)
+        with self.subTest():
+            self.assertTrue(M.bins[0].known_fails.dominates(3, 3))
+
+
+def load_tests(loader, tests, pattern):
+    suite = unittest.TestSuite()
+    if pattern is None:
+        suite.addTests(loader.loadTestsFromTestCase(Frontier))
+        suite.addTests(loader.loadTestsFromTestCase(BinSelection))
+    else:
+        tests = loader.loadTestsFromName(pattern,
+                                         module=sys.modules[__name__])
+        failedTests = [t for t in tests._tests
+                       if type(t) == unittest.loader._FailedTest]
+        if len(failedTests) == 0:
+            suite.addTests(tests)
+    return suite
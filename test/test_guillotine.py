@@ -1,5 +1,6 @@
 import sys
 import unittest
+import unittest.mock
 
 from sortedcontainers import SortedListWithKey
 from greedypacker import guillotine
@@ -477,6 +478,131 @@ class RectMerge(BaseTestCase):
         self.assertEqual(self.BIN.freerects, [self.freeRectangle(6, 5, 4, 0)])
 
 
+    def testMergeToFixpoint(self):
+        """
+        Merged rectangles keep merging with their neighbours
+        """
+        F0 = self.freeRectangle(2, 2, 0, 0)
+        F1 = self.freeRectangle(2, 2, 2, 0)
+        F2 = self.freeRectangle(4, 3, 0, 2)
+        self.BIN.freerects = [F0, F1, F2]
+        with self.subTest():
+            self.assertTrue(self.BIN.rectangle_merge())
+        with self.subTest():
+            self.assertEqual(list(self.BIN.freerects), [self.freeRectangle(4, 5, 0, 0)])
+
+
+    def testOnlyPendingMerged(self):
+        """
+        Rectangles already checked are only merged again
+        when a new neighbour arrives
+        """
+        F0 = self.freeRectangle(2, 2, 0, 0)
+        self.BIN.freerects = [F0]
+        self.BIN.rectangle_merge()
+        with self.subTest():
+            self.assertEqual(self.BIN.freerects.pending, set())
+        self.BIN.freerects.add(self.freeRectangle(2, 3, 0, 2))
+        with self.subTest():
+            self.assertTrue(self.BIN.rectangle_merge())
+        with self.subTest():
+            self.assertEqual(list(self.BIN.freerects), [self.freeRectangle(2, 5, 0, 0)])
+
+
+    def testEdgeIndex(self):
+        """
+        Edge keys follow every way of changing freerects
+        """
+        F0 = self.freeRectangle(2, 2, 0, 0)
+        F1 = self.freeRectangle(3, 1, 4, 4)
+        rects = self.BIN.freerects
+        rects.clear()
+        rects.update([F0, F1])
+        # Sorted by area, so F1 comes first
+        rects.pop(0)
+        with self.subTest():
+            self.assertEqual(rects.bottoms, {(0, 2, 0): F0})
+        with self.subTest():
+            self.assertEqual(rects.rights, {(0, 2, 2): F0})
+        del rects[0]
+        with self.subTest():
+            self.assertEqual(rects.tops, {})
+
+
+    def testFreeSpaceSummary(self):
+        """
+        Sorted widths and heights follow duplicate rectangles
+        """
+        F0 = self.freeRectangle(5, 1, 0, 0)
+        F1 = self.freeRectangle(1, 4, 0, 1)
+        self.BIN.freerects = [F0, F1, F1]
+        with self.subTest():
+            self.assertEqual(self.BIN.free_space_summary()[:2], (5, 4))
+        self.BIN.freerects.remove(F1)
+        with self.subTest():
+            self.assertEqual(self.BIN.free_space_summary()[:2], (5, 4))
+        self.BIN.freerects.remove(F1)
+        self.BIN.freerects.remove(F0)
+        with self.subTest():
+            self.assertEqual(self.BIN.free_space_summary()[:2], (0, 0))
+
+
+class Lookup(BaseTestCase):
+    def setUp(self):
+        self.freeRectangle = guillotine.FreeRectangle
+
+
+    def tearDown(self):
+        del self.freeRectangle
+
+
+    def testSmallRectsSkipped(self):
+        """
+        Rectangles smaller than the item are never scored
+        """
+        G = guillotine.Guillotine(20, 20, heuristic='best_shortside')
+        F0 = self.freeRectangle(1, 1, 0, 0)
+        F1 = self.freeRectangle(3, 3, 5, 5)
+        G.freerects = [F0, F1]
+        with unittest.mock.patch.object(G, '_score', wraps=G._score) as score:
+            result = G._find_best_score(item.Item(2, 2))
+        with self.subTest():
+            self.assertEqual(result[1], F1)
+        with self.subTest():
+            self.assertEqual(score.call_count, 1)
+
+
+    def testBestAreaStopsEarly(self):
+        """
+        Larger areas are not scored once a fit is found
+        """
+        G = guillotine.Guillotine(20, 20, heuristic='best_area')
+        F0 = self.freeRectangle(4, 1, 0, 0)
+        F1 = self.freeRectangle(2, 2, 5, 5)
+        F2 = self.freeRectangle(1, 4, 8, 8)
+        F3 = self.freeRectangle(5, 5, 10, 10)
+        G.freerects = [F0, F1, F2, F3]
+        with unittest.mock.patch.object(G, '_score', wraps=G._score) as score:
+            result = G._find_best_score(item.Item(1, 3))
+        with self.subTest():
+            # F0 only fits rotated, F1 not at all
+            self.assertEqual(result, ((1, -2), F0, True))
+        with self.subTest():
+            self.assertEqual(score.call_count, 2)
+
+
+    def testWorstAreaTies(self):
+        """
+        Equal scores go to the first rectangle in area order
+        """
+        G = guillotine.Guillotine(20, 20, heuristic='worst_area')
+        F0 = self.freeRectangle(3, 3, 0, 0)
+        F1 = self.freeRectangle(3, 3, 5, 5)
+        F2 = self.freeRectangle(1, 1, 10, 10)
+        G.freerects = [F0, F1, F2]
+        self.assertEqual(G._find_best_score(item.Item(1, 1))[1], F0)
+
+
 class BinStats(BaseTestCase):
     def setUp(self):
         self.BIN = guillotine.Guillotine(10, 5, rotation=False, heuristic='best_area')
@@ -512,6 +638,7 @@ def load_tests(loader, tests, pattern):
         suite.addTests(loader.loadTestsFromTestCase(WorstLongSide))
         suite.addTests(loader.loadTestsFromTestCase(WorstAreaFit))
         suite.addTests(loader.loadTestsFromTestCase(RectMerge))
+        suite.addTests(loader.loadTestsFromTestCase(Lookup))
         suite.addTests(loader.loadTestsFromTestCase(BinStats))
     else:
         tests = loader.loadTestsFromName(pattern,
@@ -0,0 +1,229 @@
+import pickle
+import sys
+import unittest
+import unittest.mock
+from array import array
+
+import greedypacker
+from greedypacker import item
+from greedypacker.binmanager import StreamPlacement
+from greedypacker import itemstore
+from .base import BaseTestCase
+
+
+class Slots(BaseTestCase):
+    def testNoInstanceDict(self):
+        ITEM = item.Item(2, 3)
+        with self.subTest():
+            self.assertFalse(hasattr(ITEM, '__dict__'))
+        with self.subTest():
+            with self.assertRaises(AttributeError):
+                ITEM.colour = 'red'
+
+
+    def testPickle(self):
+        ITEM = item.Item(2, 3, CornerPoint=(1, 4))
+        ITEM.rotate()
+        clone = pickle.loads(pickle.dumps(ITEM))
+        self.assertEqual((clone.width, clone.height, clone.x, clone.y, clone.rotated),
+                         (3, 2, 1, 4, True))
+
+
+class Store(BaseTestCase):
+    def setUp(self):
+        self.store = itemstore.ItemStore([(2, 3), (4, 1)])
+
+
+    def tearDown(self):
+        del self.store
+
+
+    def testViewWritesThrough(self):
+        view = self.store[1]
+        view.x, view.y = 5, 6
+        view.rotate()
+        with self.subTest():
+            self.assertEqual((self.store.x[1], self.store.y[1]), (5, 6))
+        with self.subTest():
+            self.assertEqual((view.width, view.height, view.rotated), (1, 4, True))
+        with self.subTest():
+            self.assertEqual(view.area, 4)
+
+
+    def testIndexing(self):
+        with self.subTest():
+            self.assertEqual(self.store[-1].index, 1)
+        with self.subTest():
+            with self.assertRaises(IndexError):
+                self.store[2]
+
+
+    def testPackViews(self):
+        """
+        Views pack like Items and record their bins
+        """
+        self.store.extend([(8, 4)])
+        M = greedypacker.BinManager(8, 4, pack_algo='maximal_rectangle',
+                                    heuristic='best_area', sorting=False)
+        M.add_items(*self.store)
+        M.execute()
+        with self.subTest():
+            self.assertEqual(list(self.store.bins), [0, 0, 1])
+        with self.subTest():
+            self.assertEqual([(i.x, i.y) for i in M.bins[0].items],
+                             [(self.store.x[0], self.store.y[0]),
+                              (self.store.x[1], self.store.y[1])])
+
+
+    def testPythonColumns(self):
+        with unittest.mock.patch.object(itemstore, 'np', None):
+            cols = self.store.columns()
+        self.assertIs(cols['widths'], self.store.widths)
+
+
+    @unittest.skipUnless(itemstore.np is not None, 'requires numpy')
+    def testNumpyColumns(self):
+        """
+        NumPy columns share memory with the store
+        """
+        cols = self.store.columns()
+        self.store[0].x = 7
+        self.store[1].rotated = True
+        with self.subTest():
+            self.assertEqual(cols['x'].tolist(), [7, 0])
+        with self.subTest():
+            self.assertEqual(cols['rotated'].tolist(), [False, True])
+        with self.subTest():
+            self.assertEqual(cols['bins'].tolist(), [-1, -1])
+
+
+    def testFromArrays(self):
+        store = itemstore.ItemStore.from_arrays(array('i', [2, 4]), [3, 1], ids=(7, 9))
+        with self.subTest():
+            self.assertEqual(list(store.widths), [2, 4])
+            self.assertEqual(list(store.heights), [3, 1])
+        with self.subTest():
+            self.assertEqual([view.id for view in store], [7, 9])
+        with self.subTest():
+            self.assertEqual(list(store.bins), [-1, -1])
+            self.assertEqual(list(store.x), [0, 0])
+        with self.subTest():
+            store.append(5, 5)
+            self.assertEqual(store[2].id, 2)
+        with self.subTest():
+            with self.assertRaises(ValueError):
+                store.extend_arrays([1, 2], [1])
+
+
+    def testPackArrays(self):
+        M = greedypacker.BinManager(8, 4, pack_algo='maximal_rectangle',
+                                    heuristic='best_area', sorting=False)
+        store = M.add_arrays(array('q', [2, 4, 8]), array('q', [3, 1, 4]))
+        M.execute()
+        cols = M.columns(store)
+        with self.subTest():
+            self.assertEqual(list(cols['bins']), [0, 0, 1])
+        with self.subTest():
+            self.assertEqual([(i.x, i.y) for i in M.bins[0].items],
+                             [(cols['x'][0], cols['y'][0]),
+                              (cols['x'][1], cols['y'][1])])
+
+
+    @unittest.skipUnless(itemstore.np is not None, 'requires numpy')
+    def testNumpyArrays(self):
+        """
+        NumPy columns of any integer type are ingested in bulk
+        """
+        np = itemstore.np
+        M = greedypacker.BinManager(8, 4, pack_algo='skyline',
+                                    heuristic='bottom_left', sorting=False)
+        store = M.add_arrays(np.array([4, 4, 4], dtype=np.int32),
+                             np.array([2, 2, 2], dtype=np.uint8),
+                             ids=np.array([30, 20, 10]))
+        M.execute()
+        cols = M.columns(store)
+        with self.subTest():
+            self.assertEqual(cols['ids'].tolist(), [30, 20, 10])
+        with self.subTest():
+            self.assertEqual(cols['bins'].tolist(), [0, 0, 0])
+        with self.subTest():
+            self.assertEqual(sorted(zip(cols['x'].tolist(), cols['y'].tolist())),
+                             [(0, 0), (0, 2), (4, 0)])
+
+
+    @unittest.skipUnless(itemstore.np is not None, 'requires numpy')
+    def testNumpyFloats(self):
+        """
+        Float columns are rejected instead of truncated
+        """
+        np = itemstore.np
+        M = greedypacker.BinManager(8, 4, pack_algo='skyline',
+                                    heuristic='bottom_left')
+        with self.assertRaises(ValueError):
+            M.add_arrays(np.array([3.7, 2.0]), np.array([1, 2]))
+
+
+    def testFloatSequences(self):
+        """
+        Float lists and typed arrays raise the same error
+        """
+        for widths in ([3.7, 2.0], array('d', [3.7, 2.0])):
+            with self.subTest(widths=widths):
+                with self.assertRaises(ValueError):
+                    itemstore.ItemStore.from_arrays(widths, [1, 2])
+
+
+    def testBinsRecordedOnPlacement(self):
+        """
+        Every packing path leaves the bins column matching
+        the bins the rows ended up in
+        """
+        sizes = [(5, 2), (4, 6), (5, 5), (4, 5), (4, 6), (3, 6), (3, 4), (9, 2)]
+        widths, heights = array('q', [w for w, _ in sizes]), array('q', [h for _, h in sizes])
+
+        def packed(**kwargs):
+            M = greedypacker.BinManager(10, 10, pack_algo='shelf',
+                                        heuristic='best_width_fit', **kwargs)
+            return M, M.add_arrays(widths, heights)
+
+        def positions(M):
+            return {el.index: i for i, binn in enumerate(M.bins) for el in binn.items}
+
+        runs = []
+        M, store = packed()
+        M.execute()
+        runs.append(('execute', M, store))
+        M, store = packed()
+        M.execute()
+        M.improve(iterations=20)
+        runs.append(('improve', M, store))
+        M, store = packed(bin_algo='global_best_fit')
+        M.execute()
+        runs.append(('global_best_fit', M, store))
+        M, store = packed()
+        M.beam_search(beam_width=2, processes=1)
+        runs.append(('beam_search', M, store))
+        for name, M, store in runs:
+            with self.subTest(run=name):
+                self.assertEqual(dict(enumerate(M.columns(store)['bins'])), positions(M))
+
+        M, store = packed()
+        placements = list(M.pack_stream(store, close_bins=True, max_open_bins=1))
+        with self.subTest(run='pack_stream'):
+            self.assertEqual(list(store.bins),
+                             [p.bin_index for p in placements if isinstance(p, StreamPlacement)])
+
+
+def load_tests(loader, tests, pattern):
+    suite = unittest.TestSuite()
+    if pattern is None:
+        suite.addTests(loader.loadTestsFromTestCase(Slots))
+        suite.addTests(loader.loadTestsFromTestCase(Store))
+    else:
+        tests = loader.loadTestsFromName(pattern,
+                                         module=sys.modules[__name__])
+        failedTests = [t for t in tests._tests
+                       if type(t) == unittest.loader._FailedTest]
+        if len(failedTests) == 0:
+            suite.addTests(tests)
+    return suite
@@ -1,5 +1,7 @@
+import random
 import sys
 import unittest
+import unittest.mock
 
 
 from greedypacker import maximal_rectangles
@@ -373,6 +375,37 @@ class ContactPoint(BaseTestCase):
             self.assertEqual(self.M.free_area, 22)
 
 
+    def testContactPerimeter(self):
+        """
+        Walls and item sides touching the box are counted,
+        corners touching are not
+        """
+        M = maximal_rectangles.MaximalRectangle(10, 10, heuristic='contact_point')
+        M.freerects = [maximal_rectangles.FreeRectangle(10, 10, 0, 0)]
+        for box in [(0, 0, 3, 2), (5, 2, 2, 4), (2, 6, 1, 1)]:
+            I = item.Item(box[2], box[3], CornerPoint=box[:2])
+            M.items.append(I)
+            M._index_edges(I)
+        with self.subTest():
+            # right side on item 2, item 1 only meets a corner
+            self.assertEqual(M._contact_perimeter(3, 2, 2, 4), 4)
+        with self.subTest():
+            self.assertEqual(M._contact_perimeter(0, 2, 2, 2), 2 + 2)
+        with self.subTest():
+            self.assertEqual(M._contact_perimeter(3, 7, 1, 1), 0)
+        with self.subTest():
+            self.assertEqual(M._contact_perimeter(7, 2, 3, 3), 3 + 3)
+
+
+    def testEdgeIndexAfterInsert(self):
+        I = item.Item(2, 3)
+        self.M.insert(I)
+        with self.subTest():
+            self.assertEqual(self.M._right_edges, {2: [(0, 3)]})
+        with self.subTest():
+            self.assertEqual(self.M._top_edges, {3: [(0, 2)]})
+
+
 class RotationTests(BaseTestCase):
     def setUp(self):
         pass
@@ -471,6 +504,187 @@ class Insert(BaseTestCase):
         self.assertTrue(self.M.insert(I, 'best_shortside'))
 
 
+class SpatialIndex(BaseTestCase):
+    def assertIndexConsistent(self, M):
+        cells = {}
+        for key, rect in M._rects.items():
+            for cell in M._cells(rect.x, rect.y, rect.x+rect.width, rect.y+rect.height):
+                cells.setdefault(cell, set()).add(key)
+        indexed = {cell: keys for cell, keys in M._grid.items() if keys}
+        self.assertEqual(indexed, cells)
+
+
+    def testRandomInserts(self):
+        """
+        The grid matches the free rectangles after every insert
+        """
+        rng = random.Random(3)
+        M = maximal_rectangles.MaximalRectangle(50, 40, heuristic='bottom_left')
+        for _ in range(40):
+            M.insert(item.Item(rng.randint(1, 12), rng.randint(1, 12)))
+            with self.subTest(items=len(M.items)):
+                self.assertIndexConsistent(M)
+
+
+    def testRelabel(self):
+        """
+        Renumbering order keys does not change placements
+        """
+        def pack():
+            rng = random.Random(5)
+            M = maximal_rectangles.MaximalRectangle(50, 40, heuristic='best_area')
+            for _ in range(40):
+                M.insert(item.Item(rng.randint(1, 12), rng.randint(1, 12)))
+            return M
+        M = pack()
+        with unittest.mock.patch.object(maximal_rectangles, 'KEY_DEPTH_LIMIT', 1):
+            M2 = pack()
+        with self.subTest():
+            self.assertEqual([(i.x, i.y, i.width, i.height) for i in M2.items],
+                             [(i.x, i.y, i.width, i.height) for i in M.items])
+        with self.subTest():
+            self.assertEqual(M2.freerects, M.freerects)
+        with self.subTest():
+            self.assertIndexConsistent(M2)
+
+
+    def testPruneVisitsNearbyRects(self):
+        """
+        Rectangles in other grid cells are not checked
+        """
+        M = maximal_rectangles.MaximalRectangle(80, 80)
+        F0 = maximal_rectangles.FreeRectangle(10, 10, 0, 0)
+        F1 = maximal_rectangles.FreeRectangle(10, 10, 60, 60)
+        M.freerects = [F0, F1]
+        with unittest.mock.patch.object(M, '_check_intersection',
+                                        wraps=M._check_intersection) as check:
+            M._prune_overlaps((0, 0, 2, 2))
+        with self.subTest():
+            self.assertEqual(check.call_count, 1)
+        with self.subTest():
+            self.assertEqual(M.freerects, [maximal_rectangles.FreeRectangle(8, 10, 2, 0),
+                                           maximal_rectangles.FreeRectangle(10, 8, 0, 2),
+                                           F1])
+
+
+    def testClippedPiecesKeepOrder(self):
+        F0 = maximal_rectangles.FreeRectangle(1, 1, 7, 7)
+        F1 = maximal_rectangles.FreeRectangle(4, 4, 0, 0)
+        F2 = maximal_rectangles.FreeRectangle(1, 1, 6, 0)
+        M = maximal_rectangles.MaximalRectangle(8, 8)
+        M.freerects = [F0, F1, F2]
+        M._prune_overlaps((0, 0, 2, 2))
+        self.assertEqual(M.freerects, [F0,
+                                       maximal_rectangles.FreeRectangle(2, 4, 2, 0),
+                                       maximal_rectangles.FreeRectangle(4, 2, 0, 2),
+                                       F2])
+
+
+class Containment(BaseTestCase):
+    def testDuplicatesKeepLast(self):
+        F0 = maximal_rectangles.FreeRectangle(2, 2, 0, 0)
+        F1 = maximal_rectangles.FreeRectangle(3, 1, 4, 0)
+        M = maximal_rectangles.MaximalRectangle(8, 8)
+        M.freerects = [F0, F1, F0]
+        M._remove_redundent()
+        self.assertEqual(M.freerects, [F1, F0])
+
+
+    def testInsertChecksNewRects(self):
+        """
+        After an insert only the new rectangles are checked
+        """
+        M = maximal_rectangles.MaximalRectangle(8, 8, heuristic='bottom_left')
+        M.insert(item.Item(2, 2))
+        with unittest.mock.patch.object(M, '_remove_redundent',
+                                        wraps=M._remove_redundent) as remove:
+            M.insert(item.Item(2, 2))
+        # The split of the chosen rectangle, the other one
+        # does not touch the item
+        with self.subTest():
+            self.assertEqual(len(remove.call_args[0][0]), 2)
+        with self.subTest():
+            self.assertCountEqual(M.freerects,
+                                  [maximal_rectangles.FreeRectangle(8, 6, 0, 2),
+                                   maximal_rectangles.FreeRectangle(4, 8, 4, 0)])
+
+
+    def testAssignedRectsFullCheck(self):
+        """
+        Nested rectangles from an assigned list are removed
+        on the next insert
+        """
+        F0 = maximal_rectangles.FreeRectangle(8, 8, 0, 0)
+        F1 = maximal_rectangles.FreeRectangle(2, 2, 6, 6)
+        M = maximal_rectangles.MaximalRectangle(8, 8, heuristic='bottom_left')
+        M.freerects = [F0, F1]
+        M.insert(item.Item(1, 1))
+        self.assertCountEqual(M.freerects,
+                              [maximal_rectangles.FreeRectangle(7, 8, 1, 0),
+                               maximal_rectangles.FreeRectangle(8, 7, 0, 1)])
+
+
+@unittest.skipUnless(maximal_rectangles.np is not None, 'requires numpy')
+class NumpyBackend(BaseTestCase):
+    def packed(self, backend, heuristic, sizes):
+        M = maximal_rectangles.MaximalRectangle(40, 30, heuristic=heuristic,
+                                                backend=backend)
+        for width, height in sizes:
+            M.insert(item.Item(width, height))
+        return [(i.x, i.y, i.width, i.height, i.rotated) for i in M.items]
+
+
+    def testMatchesPython(self):
+        """
+        Every vectorized heuristic packs exactly like the Python loop
+        """
+        rng = random.Random(7)
+        sizes = [(rng.randint(1, 9), rng.randint(1, 9)) for _ in range(60)]
+        with unittest.mock.patch.object(maximal_rectangles, 'NUMPY_MIN_RECTS', 0):
+            for heuristic in maximal_rectangles.NUMPY_HEURISTICS:
+                with self.subTest(heuristic=heuristic):
+                    self.assertEqual(self.packed('numpy', heuristic, sizes),
+                                     self.packed('python', heuristic, sizes))
+
+
+    def testScoreTies(self):
+        """
+        Ties go to the first rectangle, unrotated fit first.
+        Rotated fits are scored with the unrotated item, as
+        in the Python loop.
+        """
+        M = maximal_rectangles.MaximalRectangle(10, 10, backend='numpy')
+        F0 = maximal_rectangles.FreeRectangle(2, 3, 5, 0)
+        F1 = maximal_rectangles.FreeRectangle(3, 2, 0, 0)
+        F2 = maximal_rectangles.FreeRectangle(3, 2, 0, 5)
+        M.freerects = [F0, F1, F2]
+        ITEM = item.Item(3, 2)
+        with unittest.mock.patch.object(maximal_rectangles, 'NUMPY_MIN_RECTS', 0):
+            result = M._find_best_score(ITEM)
+        with self.subTest():
+            self.assertEqual(result, ((0, -1), F0, True))
+        M.backend = 'python'
+        with self.subTest():
+            self.assertEqual(M._find_best_score(ITEM), result)
+
+
+    def testStaleArrays(self):
+        """
+        Reassigned free rectangles are picked up
+        """
+        M = maximal_rectangles.MaximalRectangle(10, 10, backend='numpy')
+        with unittest.mock.patch.object(maximal_rectangles, 'NUMPY_MIN_RECTS', 0):
+            M._find_best_score(item.Item(1, 1))
+            F0 = maximal_rectangles.FreeRectangle(2, 2, 4, 4)
+            M.freerects = [F0]
+            self.assertEqual(M._find_best_score(item.Item(1, 1))[1], F0)
+
+
+    def testBadBackend(self):
+        with self.assertRaises(ValueError):
+            maximal_rectangles.MaximalRectangle(10, 10, backend='cuda')
+
+
 def load_tests(loader, tests, pattern):
     suite = unittest.TestSuite()
     if pattern is None:
@@ -482,6 +696,9 @@ def load_tests(loader, tests, pattern):
         suite.addTests(loader.loadTestsFromTestCase(ContactPoint))
         suite.addTests(loader.loadTestsFromTestCase(RotationTests))
         suite.addTests(loader.loadTestsFromTestCase(Insert))
+        suite.addTests(loader.loadTestsFromTestCase(SpatialIndex))
+        suite.addTests(loader.loadTestsFromTestCase(Containment))
+        suite.addTests(loader.loadTestsFromTestCase(NumpyBackend))
     else:
         tests = loader.loadTestsFromName(pattern,
                                          module=sys.modules[__name__])
@@ -0,0 +1,121 @@
+import copy
+import sys
+import pickle
+import unittest
+
+import greedypacker
+from greedypacker import guillotine
+from greedypacker import maximal_rectangles
+from greedypacker import shelf
+from greedypacker import skyline
+from greedypacker import item
+from sortedcontainers import SortedListWithKey # type: ignore
+from .base import BaseTestCase
+
+
+def packed(binn):
+    return [(i.x, i.y, i.width, i.height, i.rotated) for i in binn.items]
+
+
+class BinState(BaseTestCase):
+    def roundtrip(self, binn, before, after):
+        """
+        A pickled copy holds the same items and packs the
+        remaining items exactly like the original
+        """
+        for i in before:
+            binn.insert(item.Item(*i))
+        clone = pickle.loads(pickle.dumps(binn))
+        with self.subTest():
+            self.assertEqual(packed(clone), packed(binn))
+        for i in after:
+            binn.insert(item.Item(*i))
+            clone.insert(item.Item(*i))
+        with self.subTest():
+            self.assertEqual(packed(clone), packed(binn))
+        return clone
+
+
+    def testGuillotine(self):
+        G = guillotine.Guillotine(10, 8, heuristic='best_shortside', rectangle_merge=True)
+        clone = self.roundtrip(G, [(3, 2), (4, 4)], [(2, 5), (1, 1)])
+        self.assertEqual(list(clone.freerects), list(G.freerects))
+
+
+    def testGuillotineLambdaKey(self):
+        """
+        Free rectangle lists sorted with an unpicklable key
+        are rebuilt and keep their area ordering
+        """
+        G = guillotine.Guillotine(4, 4, heuristic='best_area', rectangle_merge=False)
+        G.freerects = SortedListWithKey([guillotine.FreeRectangle(4, 4, 0, 0)],
+                                        key=lambda x: x.area)
+        clone = pickle.loads(pickle.dumps(G))
+        clone.insert(item.Item(1, 3))
+        areas = [rect.area for rect in clone.freerects]
+        with self.subTest():
+            self.assertEqual(len(areas), 2)
+        with self.subTest():
+            self.assertEqual(areas, sorted(areas))
+
+
+    def testMaximalRectangle(self):
+        M = maximal_rectangles.MaximalRectangle(10, 8, heuristic='contact_point')
+        clone = self.roundtrip(M, [(3, 2), (4, 4)], [(2, 5), (1, 1)])
+        self.assertEqual(clone.freerects, M.freerects)
+
+
+    def testSkyline(self):
+        S = skyline.Skyline(10, 8, heuristic='best_fit')
+        clone = self.roundtrip(S, [(3, 2), (4, 4)], [(2, 5), (1, 1)])
+        self.assertEqual(list(clone.skyline), list(S.skyline))
+
+
+    def testSheet(self):
+        S = shelf.Sheet(10, 8, heuristic='best_height_fit')
+        clone = self.roundtrip(S, [(3, 2), (4, 4)], [(2, 5), (1, 1)])
+        self.assertEqual(clone.available_height, S.available_height)
+
+
+class ManagerState(BaseTestCase):
+    def testPickle(self):
+        M = greedypacker.BinManager(8, 4, pack_algo='maximal_rectangle',
+                                    heuristic='best_area', bin_algo='bin_first_fit')
+        M.add_items(item.Item(4, 4), item.Item(3, 3), item.Item(8, 4))
+        clone = pickle.loads(pickle.dumps(M))
+        with self.subTest():
+            self.assertEqual(clone.bin_sel_algo, clone._bin_first_fit)
+        M.execute()
+        clone.execute()
+        with self.subTest():
+            self.assertEqual(len(clone.bins), len(M.bins))
+        with self.subTest():
+            self.assertEqual([packed(b) for b in clone.bins],
+                             [packed(b) for b in M.bins])
+
+
+    def testDeepcopy(self):
+        M = greedypacker.BinManager(8, 4, pack_algo='guillotine',
+                                    heuristic='best_area')
+        M.add_items(item.Item(4, 4), item.Item(2, 2))
+        M.execute()
+        clone = copy.deepcopy(M)
+        with self.subTest():
+            self.assertIs(clone._bin_index.bins[0], clone.bins[0])
+        with self.subTest():
+            self.assertEqual(packed(clone.bins[0]), packed(M.bins[0]))
+
+
+def load_tests(loader, tests, pattern):
+    suite = unittest.TestSuite()
+    if pattern is None:
+        suite.addTests(loader.loadTestsFromTestCase(BinState))
+        suite.addTests(loader.loadTestsFromTestCase(ManagerState))
+    else:
+        tests = loader.loadTestsFromName(pattern,
+                                         module=sys.modules[__name__])
+        failedTests = [t for t in tests._tests
+                       if type(t) == unittest.loader._FailedTest]
+        if len(failedTests) == 0:
+            suite.addTests(tests)
+    return suite
@@ -0,0 +1,111 @@
+import sys
+import unittest
+
+import greedypacker
+from greedypacker import portfolio
+from greedypacker import item
+from .base import BaseTestCase
+
+
+class Portfolio(BaseTestCase):
+    def setUp(self):
+        sizes = [(4, 3), (5, 3), (2, 2), (6, 2), (3, 3), (1, 4), (7, 1), (2, 5)]
+        self.items = [item.Item(w, h) for w, h in sizes]
+        self.configs = [
+            {'pack_algo': 'shelf', 'heuristic': 'next_fit', 'sorting': False},
+            {'pack_algo': 'guillotine', 'heuristic': 'best_area'},
+            {'pack_algo': 'maximal_rectangle', 'heuristic': 'bottom_left'},
+            {'pack_algo': 'skyline', 'heuristic': 'best_fit'},
+        ]
+
+
+    def tearDown(self):
+        del self.items
+        del self.configs
+
+
+    def _bin_count(self, config):
+        M = greedypacker.BinManager(10, 5, **config)
+        M.add_items(*[item.Item(i.width, i.height) for i in self.items])
+        M.execute()
+        return len(M.bins)
+
+
+    def testBestBinCount(self):
+        """
+        The portfolio matches the best serial run
+        """
+        res = portfolio.run_portfolio(10, 5, self.items, self.configs, processes=2)
+        best = min(self._bin_count(config) for config in self.configs)
+        with self.subTest():
+            self.assertEqual(res.bin_count, best)
+        with self.subTest():
+            self.assertEqual(len(res.placements), len(self.items))
+        with self.subTest():
+            self.assertEqual(res.config, self.configs[1])
+
+
+    def testPlacementsApplied(self):
+        """
+        Winning placements are written back onto the items
+        """
+        res = portfolio.run_portfolio(10, 5, self.items, self.configs, processes=2)
+        for i, placement in zip(self.items, res.placements):
+            with self.subTest():
+                self.assertEqual((i.x, i.y, i.width, i.height),
+                                 (placement.x, placement.y,
+                                  placement.width, placement.height))
+
+
+    def testLowerBoundStopsEarly(self):
+        """
+        A result at the lower bound ends the run
+        """
+        res = portfolio.run_portfolio(10, 5, self.items, self.configs[:1] * 6,
+                                      processes=1, lower_bound=10)
+        self.assertEqual(res.config, self.configs[0])
+
+
+    def testAutoLowerBound(self):
+        """
+        The computed bound is reached by the first result
+        """
+        res = portfolio.run_portfolio(10, 5, self.items, self.configs[1:2] * 6,
+                                      processes=1, lower_bound='auto')
+        with self.subTest():
+            self.assertEqual(res.config, self.configs[1])
+        with self.subTest():
+            self.assertEqual(res.bin_count, 2)
+
+
+    def testObjective(self):
+        res = portfolio.run_portfolio(10, 5, self.items, self.configs,
+                                      objective=lambda r: -r.bin_count,
+                                      processes=2)
+        worst = max(self._bin_count(config) for config in self.configs)
+        self.assertEqual(res.bin_count, worst)
+
+
+    def testNoSuchObjective(self):
+        with self.assertRaises(ValueError):
+            portfolio.run_portfolio(10, 5, self.items, self.configs, objective='foo')
+
+
+    def testConfigurations(self):
+        configs = portfolio.configurations(pack_algos=['guillotine', 'skyline'],
+                                           sorting_heuristics=['DESCA'])
+        self.assertEqual(len(configs), 6 * 7 + 2)
+
+
+def load_tests(loader, tests, pattern):
+    suite = unittest.TestSuite()
+    if pattern is None:
+        suite.addTests(loader.loadTestsFromTestCase(Portfolio))
+    else:
+        tests = loader.loadTestsFromName(pattern,
+                                         module=sys.modules[__name__])
+        failedTests = [t for t in tests._tests
+                       if type(t) == unittest.loader._FailedTest]
+        if len(failedTests) == 0:
+            suite.addTests(tests)
+    return suite
@@ -1,8 +1,10 @@
+import random
 import sys
 import unittest
 
 from greedypacker import shelf
 from greedypacker import item
+from greedypacker import BinManager
 
 from .base import BaseTestCase
 from .util import stdout_redirect
@@ -692,6 +694,161 @@ class WorstAreaFit(BaseTestCase):
 #        self.assertEqual(bintree.bin_stats(self.ROOT), expected_result)
 
 
+class ShelfIndex(BaseTestCase):
+    def reference(self, sheet, item):
+        """ Score every open shelf in both orientations """
+        shelves = []
+        for i, s in enumerate(sheet.shelves):
+            if s.available_width == 0 or i in sheet._closed:
+                continue
+            if item.width <= s.available_width and item.height <= s.y:
+                shelves.append((sheet._score(s, item, sheet), i, False))
+            if (sheet.rotation and item.height <= s.available_width and
+                item.width <= s.y):
+                shelves.append((sheet._score(s, item, sheet), i, True))
+        if not shelves:
+            return None
+        return min(shelves)
+
+
+    def testMatchesScan(self):
+        rng = random.Random(3)
+        for heuristic in ['best_width_fit', 'best_height_fit', 'best_area_fit',
+                          'worst_width_fit', 'worst_height_fit', 'worst_area_fit']:
+            sheet = shelf.Sheet(40, 200, heuristic=heuristic, wastemap=True)
+            for n in range(80):
+                ITEM = item.Item(rng.randint(1, 12), rng.randint(1, 8))
+                expected = self.reference(sheet, ITEM)
+                if expected is not None:
+                    with self.subTest(heuristic=heuristic, n=n):
+                        self.assertEqual(sheet._best_shelf(ITEM), expected)
+                sheet.insert(ITEM)
+
+
+    def testClosedShelfDropsOut(self):
+        sheet = shelf.Sheet(8, 4, heuristic='best_width_fit', wastemap=True)
+        sheet.insert(item.Item(3, 3))
+        sheet._add_to_wastemap(sheet.shelves[0])
+        with self.subTest():
+            self.assertEqual(len(sheet._by_height), 0)
+        # A closed shelf's waste is only added once
+        waste = list(sheet.wastemap.freerects)
+        sheet._add_to_wastemap(sheet.shelves[0])
+        with self.subTest():
+            self.assertEqual(list(sheet.wastemap.freerects), waste)
+
+
+    def testFullShelfDropsOut(self):
+        sheet = shelf.Sheet(8, 4, heuristic='best_height_fit')
+        sheet.insert(item.Item(5, 2))
+        sheet.insert(item.Item(3, 2))
+        with self.subTest():
+            self.assertEqual(len(sheet._by_height), 0)
+        with self.subTest():
+            self.assertEqual(sheet.free_space_summary(), (8, 2, 16))
+
+
+    def testNoRotation(self):
+        """
+        Shelves don't take rotated items when rotation is off
+        """
+        sheet = shelf.Sheet(8, 4, heuristic='best_width_fit', rotation=False)
+        sheet.insert(item.Item(6, 2))
+        ITEM = item.Item(2, 1)
+        sheet.insert(item.Item(1, 2))
+        sheet.insert(ITEM)
+        with self.subTest():
+            self.assertFalse(ITEM.rotated)
+        with self.subTest():
+            self.assertEqual((ITEM.x, ITEM.y), (0, 2))
+
+
+    def testFirstFitInsert(self):
+        sheet = shelf.Sheet(8, 4, heuristic='first_fit')
+        sheet.insert(item.Item(3, 2), heuristic='first_fit')
+        ITEM = item.Item(3, 1)
+        sheet.insert(ITEM, heuristic='first_fit')
+        self.assertEqual((ITEM.x, ITEM.y), (3, 0))
+
+
+class FloorCeiling(BaseTestCase):
+    def setUp(self):
+        self.sheet = shelf.Sheet(8, 4, rotation=False, heuristic='best_width_fit',
+                                 floor_ceiling=True)
+        self.sheet.insert(item.Item(5, 3))
+        self.sheet.insert(item.Item(3, 1))
+
+
+    def tearDown(self):
+        del self.sheet
+
+
+    def testCeilingInsert(self):
+        """
+        An item that fits no floor hangs from the ceiling
+        above a short floor item
+        """
+        ITEM = item.Item(2, 2)
+        self.sheet.insert(ITEM)
+        with self.subTest():
+            self.assertEqual((ITEM.x, ITEM.y), (6, 1))
+        with self.subTest():
+            self.assertEqual(self.sheet.shelves[0].ceiling_x, 6)
+        with self.subTest():
+            self.assertEqual(self.sheet.free_area, 10)
+
+
+    def testCeilingBlocked(self):
+        """
+        Ceiling items can't overlap tall floor items
+        """
+        self.assertFalse(self.sheet.shelves[0].fits_ceiling(4, 1))
+
+
+    def testFloorStopsAtCeiling(self):
+        sheet = shelf.Sheet(8, 4, rotation=False, heuristic='best_width_fit',
+                            floor_ceiling=True)
+        sheet.insert(item.Item(2, 3))
+        sheet.shelves[0].insert_ceiling(item.Item(3, 1))
+        with self.subTest():
+            self.assertEqual(sheet.shelves[0].available_width, 3)
+        ITEM = item.Item(3, 2)
+        sheet.shelves[0].insert(ITEM, rotation=False)
+        with self.subTest():
+            self.assertEqual((ITEM.x, ITEM.y), (2, 0))
+        with self.subTest():
+            self.assertEqual(sheet.shelves[0].available_width, 0)
+
+
+    def testWastemapAroundCeiling(self):
+        """
+        Closing a shelf adds the space between its floor and
+        ceiling items
+        """
+        self.sheet.use_waste_map = True
+        self.sheet.wastemap = shelf.guillotine.Guillotine(0, 0, heuristic='best_area')
+        self.sheet.insert(item.Item(2, 2))
+        self.sheet._add_to_wastemap(self.sheet.shelves[0])
+        correct = [(1, 2, 5, 1)]
+        with self.subTest():
+            self.assertCountEqual(self.sheet.wastemap.freerects, correct)
+        with self.subTest():
+            self.assertEqual(len(self.sheet._ceilings), 0)
+
+
+    def testBinManager(self):
+        M = BinManager(8, 4, pack_algo='shelf', heuristic='best_width_fit',
+                       rotation=False, wastemap=False, sorting=False,
+                       floor_ceiling=True)
+        ITEMS = [item.Item(5, 3), item.Item(3, 1), item.Item(2, 2)]
+        M.add_items(*ITEMS)
+        M.execute()
+        with self.subTest():
+            self.assertEqual(len(M.bins), 1)
+        with self.subTest():
+            self.assertEqual((ITEMS[2].x, ITEMS[2].y), (6, 1))
+
+
 def load_tests(loader, tests, pattern):
     suite = unittest.TestSuite()
     if pattern is None:
@@ -706,6 +863,8 @@ def load_tests(loader, tests, pattern):
         suite.addTests(loader.loadTestsFromTestCase(WorstHeightFit))
         suite.addTests(loader.loadTestsFromTestCase(WorstAreaFit))
         suite.addTests(loader.loadTestsFromTestCase(WasteMap))
+        suite.addTests(loader.loadTestsFromTestCase(ShelfIndex))
+        suite.addTests(loader.loadTestsFromTestCase(FloorCeiling))
         #suite.addTests(loader.loadTestsFromTestCase(BinStats))
     else:
         tests = loader.loadTestsFromName(pattern,
@@ -1,3 +1,4 @@
+import random
 import sys
 import unittest
 
@@ -74,6 +75,56 @@ class Methods(BaseTestCase):
         self.assertCountEqual(res, [S1, S2])
 
     
+    def testUpdateSegmentInPlace(self):
+        """
+        The skyline is spliced in place and the new segment
+        merges with equal height neighbours
+        """
+        S0 = skyline.SkylineSegment(0, 2, 2)
+        S1 = skyline.SkylineSegment(2, 0, 2)
+        S2 = skyline.SkylineSegment(4, 1, 1)
+        S3 = skyline.SkylineSegment(5, 2, 3)
+        self.S.use_waste_map = False
+        self.S.skyline.pop()
+        self.S.skyline.update([S0, S1, S2, S3])
+        sky = self.S.skyline
+        I = item.Item(3, 1, CornerPoint=[2, 1])
+        res = self.S._update_segment(S1, 1, I)
+        with self.subTest():
+            self.assertIs(res, sky)
+        with self.subTest():
+            self.assertEqual(list(res), [skyline.SkylineSegment(0, 2, 8)])
+
+
+    def testUpdateSegmentPartialCover(self):
+        """
+        The last covered segment keeps its uncovered part
+        """
+        S0 = skyline.SkylineSegment(0, 0, 3)
+        S1 = skyline.SkylineSegment(3, 1, 5)
+        self.S.use_waste_map = False
+        self.S.skyline.pop()
+        self.S.skyline.update([S0, S1])
+        I = item.Item(4, 2, CornerPoint=[0, 1])
+        res = self.S._update_segment(S0, 1, I)
+        self.assertEqual(list(res), [skyline.SkylineSegment(0, 3, 4),
+                                     skyline.SkylineSegment(4, 1, 4)])
+
+
+    def testFullWidthItem(self):
+        """
+        An item filling the bin leaves an empty skyline
+        """
+        self.S.insert(item.Item(8, 4))
+        self.assertEqual(list(self.S.skyline), [])
+
+
+    def testNoWastemap(self):
+        S = skyline.Skyline(8, 4, wastemap=False)
+        I = item.Item(2, 2)
+        self.assertTrue(S.insert(I))
+
+
     def testMergeSegments(self):
         """
         Two segment merge
@@ -161,6 +212,50 @@ class Methods(BaseTestCase):
         self.assertEqual(wasted_area, 0)
 
 
+class SlidingWindow(BaseTestCase):
+    def reference(self, S, I):
+        """ Score each segment separately with _check_fit """
+        segs = []
+        for i, segment in enumerate(S.skyline):
+            fits, y = S._check_fit(I.width, I.height, i)
+            if fits:
+                segs.append((S._score(S.skyline, I, y, i), segment, False, y))
+            if S.rotation:
+                fits, y = S._check_fit(I.height, I.width, i)
+                if fits:
+                    segs.append((S._score(S.skyline, I, y, i, rotation=True), segment, True, y))
+        if not segs:
+            return None, None, None, False
+        return min(segs, key=lambda x: x[0])
+
+
+    def testMatchesCheckFit(self):
+        rng = random.Random(11)
+        for heuristic in ('bottom_left', 'best_fit'):
+            S = skyline.Skyline(30, 20, heuristic=heuristic)
+            for n in range(60):
+                I = item.Item(rng.randint(1, 9), rng.randint(1, 9))
+                with self.subTest(heuristic=heuristic, n=n):
+                    self.assertEqual(S._find_best_score(I), self.reference(S, I))
+                S.insert(I)
+
+
+    def testGapBlocksItem(self):
+        """
+        Items can't span the gap left by an item
+        reaching the top of the bin
+        """
+        S = skyline.Skyline(8, 4, rotation=False, wastemap=False)
+        S.skyline.pop()
+        S.skyline.update([skyline.SkylineSegment(0, 0, 2),
+                          skyline.SkylineSegment(4, 0, 4)])
+        I = item.Item(3, 1)
+        with self.subTest():
+            self.assertEqual(S._check_fit(3, 1, 0), (False, None))
+        with self.subTest():
+            self.assertEqual(S._find_best_score(I)[1], skyline.SkylineSegment(4, 0, 4))
+
+
 class BottomLeft(BaseTestCase):
     def setUp(self):
         self.S = skyline.Skyline(8, 5, heuristic='bottom_left')
@@ -290,13 +385,88 @@ class WasteMap(BaseTestCase):
         self.assertEqual(I5.y, 1)
 
 
+@unittest.skipUnless(skyline.np is not None, 'requires numpy')
+class Heightmap(BaseTestCase):
+    def testMatchesSkyline(self):
+        """
+        Packs exactly like the segment list skyline
+        """
+        rng = random.Random(5)
+        sizes = [(rng.randint(1, 9), rng.randint(1, 9)) for _ in range(80)]
+        for heuristic in ('bottom_left', 'best_fit'):
+            for wastemap in (True, False):
+                S = skyline.Skyline(30, 20, wastemap=wastemap, heuristic=heuristic)
+                H = skyline.HeightmapSkyline(30, 20, wastemap=wastemap, heuristic=heuristic)
+                for width, height in sizes:
+                    I0, I1 = item.Item(width, height), item.Item(width, height)
+                    S.insert(I0)
+                    H.insert(I1)
+                    with self.subTest(heuristic=heuristic, wastemap=wastemap):
+                        self.assertEqual((I1.x, I1.y, I1.rotated), (I0.x, I0.y, I0.rotated))
+                with self.subTest(heuristic=heuristic, wastemap=wastemap):
+                    self.assertEqual(H.skyline, list(S.skyline))
+                with self.subTest(heuristic=heuristic, wastemap=wastemap):
+                    self.assertEqual(H.free_space_summary(), S.free_space_summary())
+
+
+    def testRollingMax(self):
+        values = skyline.np.array([3, 1, 4, 1, 5, 9, 2, 6, 5, 3])
+        for window in range(1, len(values) + 1):
+            expected = [max(values[i:i+window]) for i in range(len(values) - window + 1)]
+            with self.subTest(window=window):
+                self.assertEqual(skyline.rolling_max(values, window).tolist(), expected)
+
+
+    def testGapBlocksItem(self):
+        """
+        Columns filled to the top of the bin are gaps
+        """
+        H = skyline.HeightmapSkyline(8, 4, rotation=False, wastemap=False)
+        H.insert(item.Item(2, 1))
+        H.insert(item.Item(2, 4))
+        I = item.Item(3, 1)
+        H.insert(I)
+        with self.subTest():
+            self.assertEqual((I.x, I.y), (4, 0))
+        with self.subTest():
+            self.assertEqual(H.skyline, [skyline.SkylineSegment(0, 1, 2),
+                                         skyline.SkylineSegment(4, 1, 3),
+                                         skyline.SkylineSegment(7, 0, 1)])
+        with self.subTest():
+            self.assertEqual(H.free_space_summary(), (4, 4, 19))
+
+
+    def testWastemapInsertion(self):
+        """
+        Figure 7 from Jukka's article, as in WasteMap
+        """
+        H = skyline.HeightmapSkyline(8, 5, heuristic='bottom_left')
+        for width, height in [(2, 2), (2, 1), (3, 3), (3, 2), (4, 2)]:
+            H.insert(item.Item(width, height))
+        F0 = guillotine.FreeRectangle(1, 1, 2, 1)
+        F1 = guillotine.FreeRectangle(1, 2, 3, 1)
+        with self.subTest():
+            self.assertCountEqual(H.wastemap.freerects, [F0, F1])
+        I5 = item.Item(1, 2)
+        H.insert(I5)
+        with self.subTest():
+            self.assertEqual((I5.x, I5.y), (3, 1))
+
+
+    def testItemTooWide(self):
+        H = skyline.HeightmapSkyline(8, 4, rotation=False)
+        self.assertFalse(H.insert(item.Item(9, 1)))
+
+
 def load_tests(loader, tests, pattern):
     suite = unittest.TestSuite()
     if pattern is None:
         suite.addTests(loader.loadTestsFromTestCase(Methods))
+        suite.addTests(loader.loadTestsFromTestCase(SlidingWindow))
         suite.addTests(loader.loadTestsFromTestCase(BottomLeft))
         suite.addTests(loader.loadTestsFromTestCase(BestFit))
         suite.addTests(loader.loadTestsFromTestCase(WasteMap))
+        suite.addTests(loader.loadTestsFromTestCase(Heightmap))
     else:
         tests = loader.loadTestsFromName(pattern,
                                          module=sys.modules[__name__])
@@ -0,0 +1,147 @@
+import copy
+import random
+import sys
+import unittest
+
+from greedypacker import guillotine
+from greedypacker import maximal_rectangles
+from greedypacker import shelf
+from greedypacker import skyline
+from greedypacker import item
+from .base import BaseTestCase
+
+
+def bins():
+    """ One bin of each class, with the wastemaps enabled """
+    yield guillotine.Guillotine(20, 15, heuristic='best_area')
+    yield guillotine.Guillotine(20, 15, heuristic='best_shortside', rectangle_merge=False)
+    yield maximal_rectangles.MaximalRectangle(20, 15, heuristic='best_area')
+    yield maximal_rectangles.MaximalRectangle(20, 15, heuristic='contact_point')
+    yield skyline.Skyline(20, 15)
+    if skyline.np is not None:
+        yield skyline.HeightmapSkyline(20, 15)
+    yield shelf.Sheet(20, 15, wastemap=True, heuristic='best_width_fit')
+    yield shelf.Sheet(20, 15, wastemap=True, floor_ceiling=True)
+
+
+def sizes(seed, count):
+    rng = random.Random(seed)
+    return [(rng.randint(1, 8), rng.randint(1, 8)) for _ in range(count)]
+
+
+def insert_all(binn, sizes):
+    items = [item.Item(w, h) for w, h in sizes]
+    return [(binn.insert(el, binn.heuristic), el.x, el.y, el.width, el.height)
+            for el in items]
+
+
+def state(binn):
+    return (binn.free_space_summary(),
+            [(el.x, el.y, el.width, el.height, el.rotated) for el in binn.items],
+            list(zip(binn.known_fails.widths, binn.known_fails.heights)))
+
+
+class Undo(BaseTestCase):
+    def testRollback(self):
+        """
+        Rolling back reverts the bin and the items, and the
+        bin then packs like an untouched copy
+        """
+        for seed in range(5):
+            for binn in bins():
+                insert_all(binn, sizes(seed, 6))
+                before = state(binn)
+                reference = copy.deepcopy(binn)
+                items = [item.Item(w, h) for w, h in sizes(seed + 10, 12)]
+                mark = binn.checkpoint()
+                for el in items:
+                    binn.insert(el, binn.heuristic)
+                binn.known_fails.add(3, 3)
+                binn.rollback(mark)
+                binn.commit()
+                with self.subTest(bin=binn, seed=seed):
+                    self.assertEqual(state(binn), before)
+                with self.subTest(bin=binn, seed=seed):
+                    self.assertEqual([(el.x, el.y, el.rotated) for el in items],
+                                     [(0, 0, False)] * len(items))
+                with self.subTest(bin=binn, seed=seed):
+                    self.assertEqual(insert_all(binn, sizes(seed + 20, 12)),
+                                     insert_all(reference, sizes(seed + 20, 12)))
+
+
+    def testNestedCheckpoints(self):
+        """
+        Rolling back to an inner checkpoint keeps the outer
+        one open
+        """
+        for binn in bins():
+            outer = binn.checkpoint()
+            insert_all(binn, sizes(1, 4))
+            middle = state(binn)
+            inner = binn.checkpoint()
+            insert_all(binn, sizes(2, 4))
+            binn.rollback(inner)
+            with self.subTest(bin=binn):
+                self.assertEqual(state(binn), middle)
+            binn.rollback(outer)
+            with self.subTest(bin=binn):
+                self.assertEqual(binn.items, [])
+            with self.subTest(bin=binn):
+                self.assertEqual(binn.free_area, binn.area)
+
+
+    def testGuillotineOrder(self):
+        """
+        Free rectangles of equal area return to their order
+        """
+        G = guillotine.Guillotine(10, 10, heuristic='best_area', rectangle_merge=False)
+        G.freerects = [guillotine.FreeRectangle(2, 3, 0, 0),
+                       guillotine.FreeRectangle(3, 2, 5, 5),
+                       guillotine.FreeRectangle(1, 6, 8, 0)]
+        before = list(G.freerects)
+        mark = G.checkpoint()
+        G.insert(item.Item(2, 3))
+        G.rollback(mark)
+        self.assertEqual(list(G.freerects), before)
+
+
+    def testNoCheckpoint(self):
+        """
+        Rollback needs an open checkpoint
+        """
+        for binn in bins():
+            binn.checkpoint()
+            binn.commit()
+            with self.subTest(bin=binn):
+                with self.assertRaises(ValueError):
+                    binn.rollback()
+
+
+    def testCopiesDropLog(self):
+        """
+        A copy of a bin starts without a checkpoint
+        """
+        for binn in bins():
+            binn.checkpoint()
+            insert_all(binn, sizes(3, 4))
+            binn_copy = copy.deepcopy(binn)
+            with self.subTest(bin=binn):
+                with self.assertRaises(ValueError):
+                    binn_copy.rollback()
+            binn.rollback()
+            with self.subTest(bin=binn):
+                self.assertEqual(len(binn_copy.items), 4)
+
+
+def load_tests(loader, tests, pattern):
+    suite = unittest.TestSuite()
+    if pattern is None:
+        suite.addTests(loader.loadTestsFromTestCase(Undo))
+    else:
+        tests = loader.loadTestsFromName(pattern,
+                                         module=sys.modules[__name__])
+        failedTests = [t for t in tests._tests
+                       if type(t) == unittest.loader._FailedTest]
+        if len(failedTests) == 0:
+            suite.addTests(tests)
+    return suite